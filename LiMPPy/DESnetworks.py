@@ -34,10 +34,18 @@
 #############################################################################
 
 import simpy
+import heapq
+import math
+import random
 import networkx as nx
 from itertools import combinations
-from LPS import LPS
+try:
+    from LPS import LPS
+except ImportError:
+    LPS = None # LPS topologies are optional, see topologies.py for built in ones
 from itertools import product
+from itertools import count
+from collections import deque
 import numpy as np
 from simpy.events import AllOf
 from simpy.util import start_delayed
@@ -51,6 +59,60 @@ def letter_gen():
         k += 1
         
 
+# Links of a topology, used as Topology.edges: links[(u,v)] is the resource of the link from u to v
+# Every link gets a dense integer id when it is added, and its simpy resource is only created the first
+# time it is used, so links that carry no traffic cost a dictionary entry.  Without duplex both directions
+# of a link share one id and resource, so the link carries one direction at a time.
+# Resources can also be set directly (links[(u,v)] = resource), as for a dict of resources.
+class Links():
+    def __init__(self, env, duplex = True):
+        self.env = env
+        self.duplex = duplex
+        self.ids = {}  # (u,v) -> link id
+        self.resources = []  # link id -> resource, None until first used
+
+    def add(self, u, v):
+        if not (u,v) in self.ids:
+            self.ids[(u,v)] = len(self.resources)
+            self.resources.append(None)
+        return self.ids[(u,v)]
+
+    # Add the links u -> v and v -> u
+    def connect(self, u, v):
+        i = self.add(u, v)
+        if self.duplex:
+            self.add(v, u)
+        elif not (v,u) in self.ids:
+            self.ids[(v,u)] = i
+
+    def id(self, e):
+        return self.ids[e]
+
+    def __getitem__(self, e):
+        i = self.ids[e]
+        resource = self.resources[i]
+        if resource == None:
+            resource = simpy.Resource(self.env, capacity = 1)
+            self.resources[i] = resource
+        return resource
+
+    def __setitem__(self, e, resource):
+        self.resources[self.add(*e)] = resource
+
+    def __contains__(self, e):
+        return e in self.ids
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Number of links whose resource has been created
+    def used(self):
+        return len(self.resources) - self.resources.count(None)
+
+
 # Base class for topology
 #    env -- discrete event simluator environment the topology lives in
 #    name -- name for the topology, used to anotate packet reporting
@@ -66,6 +128,15 @@ def letter_gen():
 #    route -- route packet is taking through network
 #    id -- an identifier for packet
 #    sync -- if None, a syncronous transmission, otherwise number of bits in the completion packet 
+#    fidelity -- 'packet' sends every packet through the network
+#             -- 'flow' sends eager and RDMA transfers of at least flow_packets packets as a single flow (see FlowNetwork)
+#    packet_engine -- 'process' runs every packet as a simpy process
+#                  -- 'heap' moves packets hop by hop on the event heap of a PacketEngine (same link contention, much faster)
+#    recorder -- if None, statistics is a dict of message and packet ids to lists of times (packets: (node, time))
+#             -- otherwise a Recorder that takes the place of statistics
+#    telemetry -- if not None, a LinkTelemetry counting the load of every link
+#    dag_scheduler -- 'counter' starts a message of messageDAG once the last of its predecessors has completed
+#                  -- 'resource' starts every message at time 0 blocked on a resource of each predecessor (DAGsend)
 class Topology():
     def __init__(self,env = None, name = None, duplex = True):
         #print(env)
@@ -77,10 +148,13 @@ class Topology():
             self.name = "Topology"
         else:
             self.name = name
-        self.edges = {}
+        self.edges = Links(self.env, duplex)
         self.bw = {'RDMA' : 12.5, 'eager' : 3.5}  # Estimated from BlueSky, 4x InfiniBand EDR
         self.route = None # Place holder for routing function
+        self.routes = {} # Routes found by cached_route, by (source, dest)
         self.statistics = {}
+        self.recorder = None
+        self.telemetry = None
         self.node_latency = {'eager': 650, 'RDMA' : 750} 
         self.switch_latency = {'eager' : 100, 'RDMA' : 90}
         self.latency = {} # Records entity specific latencies
@@ -89,12 +163,56 @@ class Topology():
         self.packet_limit = 4096  # Assume a 4K packet limit
         self.packet_overhead = 98 # Assume a maximum InfiniBand overhead
         self.eager_limit = 16384  # Assume threshold for eager is 16K
-        self.rank2node = None # MPI rank to node name (on full system)
+        self.rank2node = None # MPI rank to node name (on full system), see place
         self.node2rank = None # Canoncial node name to MPI rank (on full system)
+        self.fidelity = 'packet'
+        self.flow_packets = 2 # Smallest transfer (in packets) that is sent as a flow
+        self.flows = None # FlowNetwork, created on the first flow
+        self.packet_engine = 'process'
+        self.packets = None # PacketEngine, created on the first packet with packet_engine 'heap'
+        self.message_order = count() # Order of the messages sent without one, see send
+        self.dag_scheduler = 'counter'
         
         #print(env)
         #print("Initialized Topology")
 
+    # Add the links u -> v and v -> u (one shared link without duplex)
+    def connect(self, u, v):
+        self.edges.connect(u, v)
+
+    # The key of link e, the same for both directions of a link that is not duplex
+    def link_key(self, e):
+        if isinstance(self.edges, Links):
+            return self.edges.id(e)
+        return e
+
+    # Place MPI rank r on compute node rank2node[r], for topologies whose compute nodes are integers
+    # Both maps are kept as arrays; node2rank is -1 on nodes without a rank
+    def place(self, rank2node, nodes = None):
+        self.rank2node = np.asarray(rank2node, dtype = np.int64)
+        if nodes == None:
+            nodes = int(self.rank2node.max(initial = -1)) + 1
+        self.node2rank = np.full(nodes, -1, dtype = np.int64)
+        self.node2rank[self.rank2node] = np.arange(len(self.rank2node))
+        self.routes = {}
+
+    # Node of MPI rank
+    def node(self, rank):
+        if isinstance(self.rank2node, np.ndarray):
+            return int(self.rank2node[rank])
+        if self.rank2node == None:
+            return rank
+        return self.rank2node[rank]
+
+    # Routing function for topologies that can compute a route with path(source node, dest node)
+    # Source and dest are MPI ranks, mapped to nodes by node(); every route is computed once
+    def cached_route(self, source, dest):
+        R = self.routes.get((source,dest))
+        if R == None:
+            R = self.path(self.node(source), self.node(dest))
+            self.routes[(source,dest)] = R
+        return R
+
     # hold the resource associated with the request until 
     def transmit(self, resource, request, transmit_time):
         #print("Holding",self.env.now, transmit_time)
@@ -102,10 +220,30 @@ class Topology():
         #print("Releasing", self.env.now)
         resource.release(request)
 
+    # Time to push a packet of packet_size bytes onto a link
+    def packet_time(self, packet_size, mode):
+        return math.ceil((packet_size + self.packet_overhead)/self.bw[mode])
+
+    # Send packets, a list of (size, id), along R with the selected packet engine
+    # Returns the event of the arrival of the last of them
+    # key is the (message, step) of the packets for the PacketEngine, see Topology.send
+    def start_packets(self, R, packets, stats = False, RDMA = False, key = None):
+        if self.packet_engine == 'heap':
+            if self.packets == None:
+                self.packets = PacketEngine(self)
+            return self.packets.send(R, packets, stats = stats, RDMA = RDMA, key = key)
+        return AllOf(self.env, [self.env.process(self.packet(R,size, id = pkt, stats = stats, RDMA = RDMA)) for (size,pkt) in packets])
+
+    def start_packet(self, R, packet_size, id = None, stats = False, RDMA = False, key = None):
+        return self.start_packets(R, [(packet_size,id)], stats = stats, RDMA = RDMA, key = key)
+
     def packet_id(self,id):
         if id == None:
             while True:
                 yield None
+        elif not self.recorder == None:
+            for k in count():
+                yield (id, k)
         else:
             g = letter_gen()
             while True:
@@ -117,11 +255,17 @@ class Topology():
         else:
             start_delayed(self.env, self.send(route,message_size, id = id, method = method, sync = sync, packet_stats = packet_stats), start_time)
         
-    def send(self, source, dest, message_size, id = None, method = None, sync = True, packet_stats = False):
+    # order numbers the message for the PacketEngine, whose link requests at the same time are served in order
+    # of (order, step, packet), step counting the transfers of the message (rendezvous start and reply, data,
+    # fin, sync); messages sent without one are numbered as they are sent
+    def send(self, source, dest, message_size, id = None, method = None, sync = True, packet_stats = False, order = None):
         pid = self.packet_id(id)
+        if order == None:
+            order = next(self.message_order)
+        step = count()
         # If there is a message id, assume we want statistics
         if not id == None:
-            self.statistics[id] = [self.env.now]
+            self.record(id, 'send')
 
         # Automatically determine transferm method if there is none specified
         if method == None:
@@ -141,70 +285,142 @@ class Topology():
                     packets.append((partial+self.packet_overhead,next(pid))) 
             else:
                 packets = [(self.packet_overhead + message_size,next(pid))]
-            yield AllOf(self.env, [self.env.process(self.packet(R,size, id = pkt, stats = packet_stats)) for (size,pkt) in packets])
+            if self.fidelity == 'flow' and len(packets) >= self.flow_packets:
+                next(step)
+                yield self.env.process(self.flow(R, [size for (size,pkt) in packets], id = (id,'flow'), stats = packet_stats))
+            else:
+                yield self.start_packets(R, packets, stats = packet_stats, key = (order, next(step)))
         elif method == 'rendezvous':
-            yield self.env.process(self.packet(R,self.packet_overhead, id = (id,'rndz_start'), stats = packet_stats))
-            yield self.env.process(self.packet(R[::-1],self.packet_overhead, id = (id, 'rndz_reply'), stats = packet_stats))
+            yield self.start_packet(R,self.packet_overhead, id = (id,'rndz_start'), stats = packet_stats, key = (order, next(step)))
+            yield self.start_packet(R[::-1],self.packet_overhead, id = (id, 'rndz_reply'), stats = packet_stats, key = (order, next(step)))
             # RDMA data transfer
             packets = list(zip( [self.packet_limit + self.packet_overhead]*(message_size//self.packet_limit),pid))
             partial = message_size%self.packet_limit
             if not partial == 0:
                 packets.append((self.packet_overhead + partial,next(pid)))
-            yield AllOf(self.env, [self.env.process(self.packet(R,size, id = pkt, stats = packet_stats, RDMA = True)) for (size,pkt) in packets])
-            yield self.env.process(self.packet(R[::-1],self.packet_overhead, id = (id, 'fin'), stats = packet_stats))
+            if self.fidelity == 'flow' and len(packets) >= self.flow_packets:
+                next(step)
+                yield self.env.process(self.flow(R, [size for (size,pkt) in packets], id = (id,'flow'), stats = packet_stats, RDMA = True))
+            else:
+                yield self.start_packets(R, packets, stats = packet_stats, RDMA = True, key = (order, next(step)))
+            yield self.start_packet(R[::-1],self.packet_overhead, id = (id, 'fin'), stats = packet_stats, key = (order, next(step)))
             
         if not id == None:
-            self.statistics[id].append(self.env.now)
+            self.record(id, 'sent')
         if sync:
-            yield self.env.process(self.packet(R[::-1],self.packet_overhead, id = (id,'sync'), stats = packet_stats))
+            yield self.start_packet(R[::-1],self.packet_overhead, id = (id,'sync'), stats = packet_stats, key = (order, next(step)))
             if not id == None:
-                self.statistics[id].append(self.env.now)
+                self.record(id, 'synced')
+
+    # Record an event ('send', 'sent' or 'synced') of message id at the current time
+    def record(self, id, event):
+        if not self.recorder == None:
+            self.recorder.message(id, event, self.env.now)
+        elif event == 'send':
+            self.statistics[id] = [self.env.now]
+        else:
+            self.statistics[id].append(self.env.now)
+
+    # The function log(hop, node, event, time) recording the events of packet id as it leaves node, or None if
+    # the packet is not recorded.  Without a recorder, packets are recorded when stats is set and every event
+    # adds (node, time) to statistics[id]; with a recorder its level decides.
+    def packet_log(self, id, stats, node):
+        if not self.recorder == None:
+            return self.recorder.packet(id, node, self.env.now)
+        if not stats:
+            return None
+        entries = [(node, self.env.now)]
+        self.statistics[id] = entries
+        return lambda hop, node, event, time: entries.append((node, time))
     
     def packet(self,R,packet_size,id = None, stats = False, RDMA = False):
-        if stats:
-            self.statistics[id] = [(R[0], self.env.now)]
+        log = self.packet_log(id, stats, R[0])
 
             
         if RDMA:
             mode = 'RDMA'
-            packet_time = int(np.ceil((packet_size + self.packet_overhead)/self.bw['RDMA']))
         else:
-            packet_time = int(np.ceil((packet_size + self.packet_overhead)/self.bw['eager']))
             mode = 'eager'
+        packet_time = self.packet_time(packet_size, mode)
         
-        for e in zip(R,R[1:]):
+        for (hop,e) in enumerate(zip(R,R[1:])):
             # Latency for e[0]
             if e[0] in self.switch:
                 yield self.env.timeout(self.latency.get(e[0],self.switch_latency)[mode])
             else:
                 yield self.env.timeout(self.latency.get(e[0],self.node_latency)[mode])
 
-            if stats:
-                self.statistics[id].append((e[0], self.env.now))
+            if not log == None:
+                log(hop, e[0], 'request', self.env.now)
+            requested = self.env.now
+            queued = len(self.edges[e].queue)
             # Wait for availbility of edge e
             req = self.edges[e].request()
             yield req
-            if stats:
-                self.statistics[id].append((e[0], self.env.now))
+            if not log == None:
+                log(hop, e[0], 'grant', self.env.now)
             # Hold edge e for long enough for everything to be transmitted
             # If e[1] is a switch, then hold time includes time to traverse the switch
             if e[1] in self.switch:
-                self.env.process(self.transmit(self.edges[e],req, self.latency.get(e[1],self.switch_latency)[mode] + packet_time))
+                hold = self.latency.get(e[1],self.switch_latency)[mode] + packet_time
             else:
-                self.env.process(self.transmit(self.edges[e],req, packet_time))
+                hold = packet_time
+            self.env.process(self.transmit(self.edges[e],req, hold))
+            if not self.telemetry == None:
+                self.telemetry.packet(e, requested, self.env.now, hold, packet_size, queued, self.link_key(e))
 
             # If e[1] is a compute node, there is a latency cost for entering the node
             if not RDMA and not e[1] in self.switch:
                 yield self.env.timeout(self.latency.get(e[1],self.node_latency)[mode])
             # If we want to add delay for transiting lines it would be added here
-            if stats:     
-                self.statistics[id].append((e[1], self.env.now))
+            if not log == None:
+                log(hop, e[1], 'enter', self.env.now)
         
 
         # The packet isn't done until the last bit arrives
         yield self.env.timeout(packet_time)
-        if stats:     
-            self.statistics[id].append((e[1], self.env.now))
+        if not log == None:
+            log(hop, e[1], 'arrive', self.env.now)
+
+    # Send the packets (sizes in bytes) along R as one flow
+    # The flow first covers the latency of the route, as a single uncontended packet would, and then needs on
+    # each link the time the packet model would hold that link for all of the packets (packet time plus the
+    # latency of a switch at the far end), shared with the other flows by the FlowNetwork.  Against the packet
+    # model this is off by about one packet time per transfer; flows do not contend with individual packets
+    def flow(self, R, packets, id = None, stats = False, RDMA = False):
+        log = self.packet_log(id, stats, R[0])
+        if RDMA:
+            mode = 'RDMA'
+        else:
+            mode = 'eager'
+        if self.flows == None:
+            self.flows = FlowNetwork(self.env)
+
+        latency = 0
+        work = {}
+        for e in zip(R,R[1:]):
+            if e[0] in self.switch:
+                latency += self.latency.get(e[0],self.switch_latency)[mode]
+            else:
+                latency += self.latency.get(e[0],self.node_latency)[mode]
+            if e[1] in self.switch:
+                hold = self.latency.get(e[1],self.switch_latency)[mode]
+            else:
+                hold = 0
+                if not RDMA:
+                    latency += self.latency.get(e[1],self.node_latency)[mode]
+            work[e] = work.get(e,0) + sum([hold + self.packet_time(size, mode) for size in packets])
+
+        yield self.env.timeout(latency)
+        if not self.telemetry == None:
+            for e in work:
+                self.telemetry.transfer(e, self.env.now, work[e], sum(packets), self.link_key(e))
+        shared = {}
+        for e in work:
+            shared[self.link_key(e)] = shared.get(self.link_key(e),0) + work[e]
+        yield self.flows.transfer(shared, sum(packets))
+        if not log == None:
+            log(len(R) - 2, R[-1], 'arrive', self.env.now)
 
     def DAGsend(self,source,dest, message_size, resource, block_count, blocked_by, id = None, method = None, sync = True, packet_stats = False):
         if resource == None:
@@ -228,7 +444,18 @@ class Topology():
     # Message properties are atributes of node
     # No ability to add wait time at compute nodes
     # Easiest application is to recovered dependencies from MPI traces
+    # D is either an nx.DiGraph or a CompactDAG (see read_messageDAG), which is always run with the counter scheduler
     def messageDAG(self, D):
+        if isinstance(D, CompactDAG):
+            self.compactStart(D, np.flatnonzero(D.indegree == 0).tolist(), {})
+            return
+        if self.dag_scheduler == 'counter':
+            # Only messages without predecessors are started; the rest wait in DAGcomplete
+            waiting = {}
+            for M in D.nodes:
+                if D.in_degree(M) == 0:
+                    self.DAGstart(D, M, waiting)
+            return
         messages = {v : simpy.PriorityResource(self.env,capacity = D.out_degree(v)) for v in D.nodes if D.out_degree(v) > 0}
         for v in D.nodes:
             if D.out_degree(v) == 0:
@@ -241,6 +468,49 @@ class Topology():
             message_size = D.nodes[M]["message_size"]
             self.env.process(self.DAGsend(source,dest, message_size, messages[M], D.out_degree(M), [messages[x] for x in D.predecessors(M)], packet_stats = packet_stats, id = M, method = method, sync = sync))
 
+    def DAGstart(self, D, M, waiting):
+        source, dest, idx = M
+        method = D.nodes[M].get("method",None)
+        packet_stats = D.nodes[M].get("packet_stats",False)
+        sync = D.nodes[M].get("sync",True)
+        message_size = D.nodes[M]["message_size"]
+        process = self.env.process(self.send(source,dest,message_size, id = M, method = method, sync = sync, packet_stats = packet_stats))
+        process.callbacks.append(lambda event: self.DAGcomplete(D, M, waiting))
+
+    # Count the completed predecessors of the successors of M, starting those that have none left
+    # A counter only exists while some but not all predecessors of a message are complete
+    def DAGcomplete(self, D, M, waiting):
+        for x in D.successors(M):
+            count = waiting.pop(x, D.in_degree(x)) - 1
+            if count == 0:
+                self.DAGstart(D, x, waiting)
+            else:
+                waiting[x] = count
+
+    # Start the messages in ready (vertices of the CompactDAG D), and with them every event vertex that completes
+    # Event vertices take no time, so their successors are processed here rather than in a simpy callback
+    def compactStart(self, D, ready, waiting):
+        i = 0
+        while i < len(ready):
+            v = ready[i]
+            i += 1
+            if D.kind[v] > 0:
+                ready.extend(self.compactComplete(D, v, waiting))
+                continue
+            process = self.env.process(self.send(int(D.source[v]), int(D.dest[v]), int(D.size[v]), id = D.id(v), method = D.method, sync = D.sync, packet_stats = D.packet_stats, order = v))
+            process.callbacks.append(lambda event, v = v: self.compactStart(D, self.compactComplete(D, v, waiting), waiting))
+
+    # The successors of v that have no incomplete predecessors left once v is complete
+    def compactComplete(self, D, v, waiting):
+        ready = []
+        for x in D.successors(v).tolist():
+            count = waiting.pop(x, int(D.indegree[x])) - 1
+            if count == 0:
+                ready.append(x)
+            else:
+                waiting[x] = count
+        return ready
+
     # Send messages according to a DAG where vertices are copies of compute nodes
     # Messages are given by the directed edges
     # Directed edge (i,j) implies that the message from i must be recieved by j before j can send outbound messages
@@ -252,6 +522,546 @@ class Topology():
 
 
 
+# Packets without simpy processes
+# Topology.packet spends most of its time creating generators and events: per hop a latency timeout, a link
+# request and a transmit process to release the link.  With a capacity 1 link held for a known time, the link
+# is a FIFO queue: a request at time t is granted at max(t, free[link]) and the link is free again once the hold
+# is over.  Processing the link requests of all packets in time order therefore reproduces the contention of
+# the packet model with one heap entry per packet and hop.
+# New packets only come from simpy events, which start no earlier than env.peek(), so every request before
+# that time can be processed ahead of the simpy clock; only the arrival of the last packet of a transfer is
+# scheduled as a simpy event.  Requests at the same time are served in order of the (message, step, packet) of
+# their packets (see Topology.send), the same order as the parallel engine of parallel.py, rather than in the
+# order simpy would happen to create them.
+class PacketEngine():
+    def __init__(self, topology):
+        self.topology = topology
+        self.env = topology.env
+        self.heap = []
+        self.sequence = count()
+        self.free = {}  # link key -> time the link is released
+        self.wakeup = None  # time of the pending simpy event draining the heap
+
+    # Start packets, a list of (size, id), along R now; the returned event fires when the last of them has arrived
+    # key is the (message, step) of the packets, by default the order of the call
+    def send(self, R, packets, stats = False, RDMA = False, key = None):
+        T = self.topology
+        if RDMA:
+            mode = 'RDMA'
+        else:
+            mode = 'eager'
+        # Per hop: link, link key, hold time beyond the packet time, latency of entering the next node,
+        # latency before requesting the next link (or None on the last hop)
+        hops = []
+        for (a,b) in zip(R,R[1:]):
+            if b in T.switch:
+                hold = T.latency.get(b,T.switch_latency)[mode]
+                enter = 0
+            else:
+                hold = 0
+                if RDMA:
+                    enter = 0
+                else:
+                    enter = T.latency.get(b,T.node_latency)[mode]
+            hops.append(((a,b), T.link_key((a,b)), hold, enter, self.latency(b, mode)))
+        done = self.env.event()
+        # Packets still in flight and the time the last of them arrived
+        train = [len(packets), self.env.now, done]
+        if len(hops) == 0:
+            # Source and destination coincide, as in Topology.packet only the packet time is spent
+            train[1] += max([T.packet_time(size, mode) for (size,id) in packets])
+            self.arrive(train)
+            return done
+        hops[-1] = hops[-1][:4] + (None,)
+        start = self.env.now + self.latency(R[0], mode)
+        if key == None:
+            key = (-1, next(self.sequence))
+        for (k,(size,id)) in enumerate(packets):
+            # (time, (message, step, packet), sequence, [hops, hop, packet time, size, log, train])
+            heapq.heappush(self.heap, (start, key + (k,), next(self.sequence), [hops, 0, T.packet_time(size, mode), size, T.packet_log(id, stats, R[0]), train]))
+        self.schedule()
+        return done
+
+    def latency(self, node, mode):
+        T = self.topology
+        if node in T.switch:
+            return T.latency.get(node,T.switch_latency)[mode]
+        return T.latency.get(node,T.node_latency)[mode]
+
+    def schedule(self):
+        if len(self.heap) > 0 and (self.wakeup == None or self.heap[0][0] < self.wakeup):
+            self.wakeup = self.heap[0][0]
+            self.env.timeout(self.wakeup - self.env.now).callbacks.append(self.drain)
+
+    # Process the link requests of the packets in time order, up to the next simpy event
+    def drain(self, event):
+        if not self.wakeup == self.env.now:
+            return
+        self.wakeup = None
+        heap = self.heap
+        env = self.env
+        free = self.free
+        telemetry = self.topology.telemetry
+        sequence = self.sequence
+        heappush = heapq.heappush
+        heappop = heapq.heappop
+        while len(heap) > 0 and (heap[0][0] <= env.now or heap[0][0] < env.peek()):
+            (time, order, _, packet) = heappop(heap)
+            # The packet requests the link of its current hop at time
+            (hops, hop, packet_time, size, log, train) = packet
+            (link, key, hold, enter, latency) = hops[hop]
+            grant = free.get(key, time)
+            if grant < time:
+                grant = time
+            free[key] = grant + hold + packet_time
+            if not telemetry == None:
+                telemetry.packet(link, time, grant, hold + packet_time, size, key = key)
+            t = grant + enter
+            if not log == None:
+                log(hop, link[0], 'request', time)
+                log(hop, link[0], 'grant', grant)
+                log(hop, link[1], 'enter', t)
+            if not latency == None:
+                packet[1] = hop + 1
+                heappush(heap, (t + latency, order, next(sequence), packet))
+                continue
+            # The packet isn't done until the last bit arrives
+            t += packet_time
+            if not log == None:
+                log(hop, link[1], 'arrive', t)
+            train[0] -= 1
+            if train[1] < t:
+                train[1] = t
+            if train[0] == 0:
+                self.arrive(train)
+        self.schedule()
+
+    def arrive(self, train):
+        if train[1] == self.env.now:
+            train[2].succeed()
+        else:
+            self.env.timeout(train[1] - self.env.now).callbacks.append(lambda event: train[2].succeed())
+
+
+# Links shared by flows with weighted max-min fairness
+# A flow of size bytes needs work[e] nanoseconds of link e, so at rate r (bytes per nanosecond) it uses the
+# fraction r*work[e]/size of the link.  Rates are raised together until some link is saturated, the flows
+# through that link are fixed at that rate, and the remaining flows continue on the leftover capacity.
+# Rates are recomputed whenever a flow starts or finishes.
+class FlowNetwork():
+    def __init__(self, env):
+        self.env = env
+        self.flows = {}  # done event -> [remaining bytes, {link : use per byte}, rate]
+        self.updated = env.now
+        self.generation = 0
+
+    # Start a flow; the returned event fires when it is complete
+    def transfer(self, work, size):
+        done = self.env.event()
+        if size <= 0 or len(work) == 0:
+            done.succeed()
+            return done
+        self.advance()
+        self.flows[done] = [size, {e : w/size for (e,w) in work.items()}, 0]
+        self.schedule()
+        return done
+
+    def advance(self):
+        elapsed = self.env.now - self.updated
+        for flow in self.flows.values():
+            flow[0] -= flow[2]*elapsed
+        self.updated = self.env.now
+
+    def allocate(self):
+        capacity = {}
+        users = {}
+        for (f,flow) in self.flows.items():
+            for e in flow[1]:
+                capacity[e] = 1.0
+                users.setdefault(e, []).append(f)
+        active = set(self.flows)
+        while len(active) > 0:
+            share = {}
+            for (e,fs) in users.items():
+                use = sum([self.flows[f][1][e] for f in fs if f in active])
+                if use > 0:
+                    share[e] = max(capacity[e],0)/use
+            rate = min(share.values())
+            # Every link saturated at this rate (up to rounding) fixes its flows
+            frozen = set([f for e in share if share[e] <= rate*(1 + 1e-9) for f in users[e] if f in active])
+            for f in frozen:
+                self.flows[f][2] = rate
+                active.remove(f)
+                for (link,use) in self.flows[f][1].items():
+                    capacity[link] -= rate*use
+
+    # Wake up at the next completion; earlier wake ups are ignored once the rates change
+    def schedule(self):
+        self.allocate()
+        self.generation += 1
+        if len(self.flows) == 0:
+            return
+        delay = min([flow[0]/flow[2] for flow in self.flows.values()])
+        wakeup = self.env.timeout(max(delay,0), value = self.generation)
+        wakeup.callbacks.append(self.complete)
+
+    def complete(self, event):
+        if not event.value == self.generation:
+            return
+        self.advance()
+        for (f,flow) in list(self.flows.items()):
+            if flow[0] <= 1e-6:
+                del self.flows[f]
+                f.succeed()
+        self.schedule()
+
+
+# Load of every link, counted as packets hold links (or flows use them)
+#    busy -- total time the link is held, bytes, packets -- bytes and packets carried
+#    wait, max_wait -- total and largest time a packet waited for the link
+#    queue -- histogram of the number of packets already waiting when a packet requests the link
+#             (the last of queue_bins bins counts every longer queue)
+#    series -- with bucket set, busy time of every link in each bucket of that many nanoseconds (summary
+#              reports it as the utilization of each bucket)
+# Links are numbered in order of first use, so the counters only grow with the links that carry traffic
+# The counters are kept by the key of a link (Topology.link_key), so without duplex both directions of a link,
+# which share one resource and queue, are counted as the one link named by the direction used first
+class LinkTelemetry():
+    def __init__(self, bucket = None, queue_bins = 16, capacity = 1024):
+        self.bucket = bucket
+        self.queue_bins = queue_bins
+        self.ids = {}  # link key -> link number
+        self.links = []
+        self.busy = np.zeros(capacity, dtype = np.float64)
+        self.bytes = np.zeros(capacity, dtype = np.int64)
+        self.packets = np.zeros(capacity, dtype = np.int64)
+        self.wait = np.zeros(capacity, dtype = np.float64)
+        self.max_wait = np.zeros(capacity, dtype = np.float64)
+        self.queue = np.zeros((capacity, queue_bins), dtype = np.int64)
+        self.series = {}  # link number -> busy time per bucket
+        self.grants = {}  # link number -> grant times of the requests not yet granted, for the PacketEngine
+
+    # Number of link e with key (e itself when key is None)
+    def link(self, e, key = None):
+        if key == None:
+            key = e
+        i = self.ids.get(key)
+        if i == None:
+            i = len(self.links)
+            self.ids[key] = i
+            self.links.append(e)
+            if i == len(self.busy):
+                for name in ('busy', 'bytes', 'packets', 'wait', 'max_wait'):
+                    setattr(self, name, np.resize(getattr(self, name), 2*i))
+                    getattr(self, name)[i:] = 0
+                self.queue = np.concatenate((self.queue, np.zeros_like(self.queue)))
+        return i
+
+    # A packet of size bytes requested link e at time request and held it from grant for hold
+    # queued is the number of packets waiting for e at the request; if None it is found from the grant times,
+    # which are in order since a link serves its requests first come first served
+    def packet(self, e, request, grant, hold, size, queued = None, key = None):
+        i = self.transfer(e, grant, hold, size, key)
+        self.packets[i] += 1
+        wait = grant - request
+        self.wait[i] += wait
+        if wait > self.max_wait[i]:
+            self.max_wait[i] = wait
+        if queued == None:
+            grants = self.grants.setdefault(i, deque())
+            while len(grants) > 0 and grants[0] <= request:
+                grants.popleft()
+            queued = len(grants)
+            grants.append(grant)
+        self.queue[i, min(queued, self.queue_bins - 1)] += 1
+
+    # Link e is busy from start for busy moving size bytes
+    def transfer(self, e, start, busy, size, key = None):
+        i = self.link(e, key)
+        self.busy[i] += busy
+        self.bytes[i] += size
+        if not self.bucket == None:
+            series = self.series.setdefault(i, [])
+            t = start
+            while t < start + busy:
+                b = int(t // self.bucket)
+                stop = min(start + busy, (b + 1)*self.bucket)
+                if len(series) <= b:
+                    series.extend([0.0]*(b + 1 - len(series)))
+                series[b] += stop - t
+                t = stop
+        return i
+
+    # Add the counters of other, a LinkTelemetry with the same bucket and queue bins (e.g. the one of a partition
+    # of the parallel simulation, see parallel.py)
+    def merge(self, other):
+        for (key, j) in other.ids.items():
+            i = self.link(other.links[j], key)
+            for name in ('busy', 'bytes', 'packets', 'wait'):
+                getattr(self, name)[i] += getattr(other, name)[j]
+            if other.max_wait[j] > self.max_wait[i]:
+                self.max_wait[i] = other.max_wait[j]
+            self.queue[i] += other.queue[j]
+            if j in other.series:
+                series = self.series.setdefault(i, [])
+                if len(series) < len(other.series[j]):
+                    series.extend([0.0]*(len(other.series[j]) - len(series)))
+                for (b, busy) in enumerate(other.series[j]):
+                    series[b] += busy
+
+    # Counters of every used link as arrays (links as repr strings), with utilization busy/elapsed
+    def summary(self, elapsed = None):
+        n = len(self.links)
+        summary = {'links' : np.array([repr(e) for e in self.links], dtype = str),
+                   'busy' : self.busy[:n].copy(),
+                   'bytes' : self.bytes[:n].copy(),
+                   'packets' : self.packets[:n].copy(),
+                   'wait' : self.wait[:n].copy(),
+                   'max_wait' : self.max_wait[:n].copy(),
+                   'queue' : self.queue[:n].copy()}
+        if not elapsed == None and elapsed > 0:
+            summary['utilization'] = summary['busy']/elapsed
+        if not self.bucket == None:
+            series = np.zeros((n, max([len(b) for b in self.series.values()], default = 0)))
+            for (i,b) in self.series.items():
+                series[i,:len(b)] = b
+            summary['series'] = series/self.bucket
+        return summary
+
+    # The k links with the largest busy time, as (link, busy, max_wait)
+    def hot(self, k = 10):
+        n = len(self.links)
+        order = np.argsort(-self.busy[:n], kind = 'stable')[:k]
+        return [(self.links[i], float(self.busy[i]), float(self.max_wait[i])) for i in order.tolist()]
+
+    def save(self, filename, elapsed = None):
+        np.savez(filename, **self.summary(elapsed))
+
+
+# Columnar statistics
+# Every record is a row (id, hop, node, event, time) in growable NumPy columns
+#    message events ('send', 'sent', 'synced') -- id is the message number, hop and node are -1
+#    packet events ('start', 'request', 'grant', 'enter', 'arrive') -- id is the packet number, hop the index of
+#        the link on the route, node the node number of the node the packet is at
+# Messages, packets and nodes are numbered in order of appearance; the message ids and node names are kept in
+# messages and nodes, and each packet's message number and tag in packet_message and packet_tag (tag k >= 0
+# for the k-th data packet of a message, otherwise -1 - TAGS.index(tag), e.g. -5 for the sync packet)
+#    level -- 'message' records only message events
+#          -- 'hop' also records every packet at every hop
+#          -- 'sampled' also records every hop of a random fraction sample of the packets
+class Recorder():
+    EVENTS = ['send', 'sent', 'synced', 'start', 'request', 'grant', 'enter', 'arrive']
+    TAGS = ['flow', 'rndz_start', 'rndz_reply', 'fin', 'sync']
+    COLUMNS = [('id', np.int64), ('hop', np.int32), ('node', np.int32), ('event', np.int8), ('time', np.float64)]
+
+    def __init__(self, level = 'message', sample = 0.01, seed = 0, capacity = 1 << 16):
+        if not level in ('message', 'hop', 'sampled'):
+            raise ValueError('Unknown recorder level ' + repr(level))
+        self.level = level
+        self.sample = sample
+        self.random = random.Random(seed)
+        self.events = {event : i for (i,event) in enumerate(self.EVENTS)}
+        self.columns = {name : np.empty(capacity, dtype = dtype) for (name,dtype) in self.COLUMNS}
+        self.size = 0
+        self.message_ids = {}
+        self.messages = []
+        self.node_ids = {}
+        self.nodes = []
+        self.packet_message = []
+        self.packet_tag = []
+
+    def append(self, id, hop, node, event, time):
+        if self.size == len(self.columns['time']):
+            for name in self.columns:
+                self.columns[name] = np.resize(self.columns[name], 2*self.size)
+        i = self.size
+        self.columns['id'][i] = id
+        self.columns['hop'][i] = hop
+        self.columns['node'][i] = node
+        self.columns['event'][i] = self.events[event]
+        self.columns['time'][i] = time
+        self.size += 1
+
+    def message_number(self, id):
+        if not id in self.message_ids:
+            self.message_ids[id] = len(self.messages)
+            self.messages.append(id)
+        return self.message_ids[id]
+
+    def node_number(self, node):
+        if not node in self.node_ids:
+            self.node_ids[node] = len(self.nodes)
+            self.nodes.append(node)
+        return self.node_ids[node]
+
+    def message(self, id, event, time):
+        self.append(self.message_number(id), -1, -1, event, time)
+
+    # Start recording packet id, (message id, tag), at node; returns the log function of Topology.packet_log
+    def packet(self, id, node, time):
+        if self.level == 'message' or id == None:
+            return None
+        if self.level == 'sampled' and self.random.random() >= self.sample:
+            return None
+        (message, tag) = id
+        packet = len(self.packet_message)
+        self.packet_message.append(self.message_number(message))
+        if isinstance(tag, int):
+            self.packet_tag.append(tag)
+        else:
+            self.packet_tag.append(-1 - self.TAGS.index(tag))
+        self.append(packet, -1, self.node_number(node), 'start', time)
+        return lambda hop, node, event, time: self.append(packet, hop, self.node_number(node), event, time)
+
+    # The recorded rows and tables as a dict of arrays
+    def arrays(self):
+        arrays = {name : column[:self.size] for (name,column) in self.columns.items()}
+        arrays['events'] = np.array(self.EVENTS)
+        arrays['tags'] = np.array(self.TAGS)
+        arrays['messages'] = np.array([repr(m) for m in self.messages], dtype = str)
+        arrays['nodes'] = np.array([repr(n) for n in self.nodes], dtype = str)
+        arrays['packet_message'] = np.array(self.packet_message, dtype = np.int64)
+        arrays['packet_tag'] = np.array(self.packet_tag, dtype = np.int64)
+        return arrays
+
+    # Write the recording to filename: .npz with the arrays of arrays(), or with a .parquet name the rows
+    # (event names in place of event numbers) as a Parquet table, which needs pandas with pyarrow
+    def save(self, filename):
+        arrays = self.arrays()
+        if filename[-8:] == '.parquet':
+            import pandas as pd
+            table = pd.DataFrame({name : arrays[name] for (name,dtype) in self.COLUMNS})
+            table['event'] = pd.Categorical.from_codes(table['event'], self.EVENTS)
+            table.to_parquet(filename)
+        else:
+            np.savez(filename, **arrays)
+
+
+# Message DAG held in NumPy arrays, for DAGs from poger that are too large for an nx.DiGraph
+#    source, dest, index -- the message (source, dest, index) of each vertex
+#    kind -- 0 for a message; otherwise the vertex is an event (e.g. a collective of poger) named kinds[kind]
+#            that takes no time and only passes dependencies on, with source -1 and dest the collective's key
+#    size -- message size in bytes
+#    offsets, targets -- CSR successor lists: the successors of v are targets[offsets[v]:offsets[v+1]]
+#    labels -- optional list of the vertex labels as they appear in poger's output, used as statistics ids
+#              (without labels the vertex number is the id)
+#    method, sync, packet_stats -- send options for every message, as the node attributes of messageDAG
+class CompactDAG():
+    def __init__(self, source, dest, index, kind, kinds, size, offsets, targets, labels = None):
+        self.source = source
+        self.dest = dest
+        self.index = index
+        self.kind = kind
+        self.kinds = kinds
+        self.size = size
+        self.offsets = offsets
+        self.targets = targets
+        self.labels = labels
+        self.indegree = np.bincount(targets, minlength = len(source))
+        self.method = None
+        self.sync = True
+        self.packet_stats = False
+
+    @property
+    def num_vertices(self):
+        return len(self.source)
+
+    def successors(self, v):
+        return self.targets[self.offsets[v]:self.offsets[v+1]]
+
+    def id(self, v):
+        if self.labels == None:
+            return v
+        return self.labels[v]
+
+
+# Parse a vertex of poger's messages.txt / covers.txt, e.g. (3, 5, 0) or ('AllReduceStart', -1, 2)
+def parse_message(text):
+    (first, dest, index) = text.strip()[1:-1].rsplit(',', 2)
+    first = first.strip()
+    if first[0] in '\'"':
+        return (first[1:-1], int(dest), int(index))
+    return (int(first), int(dest), int(index))
+
+
+# Read a message DAG written by poger into a CompactDAG
+#    filename -- DAG.txt (vertex count, then one "u v" edge per line) together with messages, the matching
+#                messages.txt; or, with messages None, covers.txt ("message-->message" per line)
+#    size -- message size for every message, see trace_sizes for the sizes of a traced run
+#    labels -- keep the message tuples as statistics ids
+def read_messageDAG(filename, messages = None, size = 0, labels = False):
+    if messages == None:
+        ids = {}
+        vertices = []
+        edges = []
+        with open(filename, 'r') as input:
+            for line in input:
+                if len(line.strip()) == 0:
+                    continue
+                for text in line.rstrip().split('-->'):
+                    if not text in ids:
+                        ids[text] = len(vertices)
+                        vertices.append(parse_message(text))
+                    edges.append(ids[text])
+        del ids
+        edges = np.array(edges, dtype = np.int64).reshape(-1, 2)
+    else:
+        with open(messages, 'r') as input:
+            vertices = [parse_message(line) for line in input if len(line.strip()) > 0]
+        with open(filename, 'r') as input:
+            n = int(input.readline())
+            edges = np.loadtxt(input, dtype = np.int64, ndmin = 2).reshape(-1, 2)
+        if not n == len(vertices):
+            print("DAG has", n, "vertices but there are", len(vertices), "messages")
+            raise Exception('MismatchedMessages')
+
+    kinds = [None]
+    kind = {}
+    table = np.empty((len(vertices), 4), dtype = np.int64)
+    for (i,(first,dest,index)) in enumerate(vertices):
+        if isinstance(first, str):
+            if not first in kind:
+                kind[first] = len(kinds)
+                kinds.append(first)
+            table[i] = (kind[first], -1, dest, index)
+        else:
+            table[i] = (0, first, dest, index)
+    if not labels:
+        vertices = None
+
+    order = np.argsort(edges[:,0], kind = 'stable')
+    targets = np.ascontiguousarray(edges[order,1])
+    offsets = np.zeros(len(table) + 1, dtype = np.int64)
+    np.cumsum(np.bincount(edges[:,0], minlength = len(table)), out = offsets[1:])
+    sizes = np.where(table[:,0] == 0, size, 0).astype(np.int64)
+    return CompactDAG(table[:,1].copy(), table[:,2].copy(), table[:,3].copy(), table[:,0].copy(), kinds, sizes, offsets, targets, vertices)
+
+
+# Fill in the sizes of the messages of D from the send traces (trace_MPISend_<rank>.ct) of one traced run in dir
+# Message (s, d, j) of poger is the j-th message sent from s to d, so its size is on the j-th line of
+# trace_MPISend_<s>.ct with recipient d.  Messages of ranks without a send trace keep their size.
+def trace_sizes(D, dir):
+    for s in np.unique(D.source[D.kind == 0]).tolist():
+        try:
+            trace = np.loadtxt(dir + "/trace_MPISend_" + repr(s) + ".ct", delimiter = ',', usecols = (2,3), dtype = np.int64, ndmin = 2)
+        except OSError:
+            print("No send trace for rank", s)
+            continue
+        # Position of every line among the lines of the trace with the same recipient
+        order = np.argsort(trace[:,0], kind = 'stable')
+        recipient = trace[order,0]
+        first = np.searchsorted(recipient, recipient, side = 'left')
+        position = np.arange(len(order)) - first
+        messages = np.flatnonzero((D.source == s) & (D.kind == 0))
+        # Lines are ordered by (recipient, position), so a message is found by a search on both
+        lines = np.searchsorted(recipient, D.dest[messages], side = 'left') + D.index[messages]
+        found = (lines < len(order))
+        found[found] = (recipient[lines[found]] == D.dest[messages[found]]) & (position[lines[found]] == D.index[messages[found]])
+        D.size[messages[found]] = trace[order[lines[found]],1]
+        if not found.all():
+            print("Rank", s, "sent", int((~found).sum()), "messages that are not in its send trace")
+
+
 def PingPong(a,b,size, repeats = 10):
     D = nx.DiGraph()
     D.add_edges_from([((a,b,r),(b,a,r)) for r in range(repeats)])
@@ -0,0 +1,445 @@
+#############################################################################
+##                               FENATE                                    ##  
+##          Copyright © 2021, Battelle Memorial Institute                  ##
+##                                                                         ##
+## 1. Battelle Memorial Institute (hereinafter Battelle) hereby grants     ##
+##  permission to any person or entity lawfully obtaining a copy of this   ##
+##  software and associated documentation files (hereinafter               ##
+##  “the Software”) to redistribute and use the Software in source and     ##
+##  binary forms, with or without modification.  Such person or entity may ##
+##  use, copy, modify, merge, publish, distribute, sublicense, and/or sell ##
+##  copies of the Software, and may permit others to do so, subject to the ##
+##  following conditions:                                                  ##
+##  • Redistributions of source code must retain the above copyright       ##
+##    notice, this list of conditions and the following disclaimers.       ##
+##  • Redistributions in binary form must reproduce the above copyright    ##
+##    notice, this list of conditions and the following disclaimer in      ##
+##    the documentation and/or other materials provided with the           ##
+##    distribution.                                                        ##
+##  • Other than as used herein, neither the name Battelle Memorial        ##
+##    Institute or Battelle may be used in any form whatsoever without     ##
+##    the express written consent of Battelle.                             ##
+## 2. THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS  ##
+##  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT      ##
+##  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS      ##
+##  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL BATTELLE    ##
+##  OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,        ##
+##  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT       ##
+##  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,  ##
+##  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON      ##
+##  ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR     ##
+##  TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF     ##
+##  THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF        ##
+##  SUCH DAMAGE.                                                           ##
+#############################################################################
+
+import argparse
+import heapq
+import math
+import multiprocessing
+import time
+import numpy as np
+from DESnetworks import CompactDAG, LinkTelemetry, read_messageDAG, trace_sizes
+
+
+# Conservative parallel simulation of a CompactDAG with the packet model of the PacketEngine
+# The links are split over partitions, each simulated by one worker process; a link belongs to the partition of
+# the node requesting it.  A packet that requests a link at time t enters the next node no earlier than t and
+# requests its next link after the latency of that node, so nothing a partition does at time t has an effect
+# before t + lookahead, where lookahead is the smallest node or switch latency.  The simulation therefore
+# advances in windows [start, start + lookahead): every partition processes the link requests it holds in the
+# window, and the requests crossing partitions are exchanged, as timestamped messages, between windows.
+# The message DAG is kept by the coordinator, which starts each message once its predecessors are complete.
+# Link requests at the same time are served in order of (message, step, packet), whatever the number of
+# partitions, which is also the order of the PacketEngine (packet_engine 'heap'), so the message times are
+# those of Topology.messageDAG with the heap engine.  Partitions without requests before the end of a window
+# are left out of its exchange, but every window still costs a pipe round trip per busy partition, so this only
+# pays off with enough link requests per window and a core per worker; otherwise the heap engine is faster.
+# Only packet fidelity is supported, flows share links between every partition.  A LinkTelemetry is kept by
+# every partition and merged into T.telemetry; a Recorder only gets the message events, so packet recording
+# (Recorder levels 'hop' and 'sampled', packet_stats) is rejected.
+
+
+# Smallest latency of a node or switch, the lookahead of the simulation of T
+def lookahead(T):
+    tables = [T.node_latency, T.switch_latency] + list(T.latency.values())
+    return min([latency for table in tables for latency in table.values()])
+
+
+# Partition of the nodes of T into parts: the compute nodes in blocks of consecutive nodes (in order of their
+# first link), then every switch, nearest first, with the partition of most of its neighbours already placed
+def partition(T, parts):
+    neighbours = {}
+    for (u,v) in T.edges:
+        neighbours.setdefault(u, []).append(v)
+    nodes = [n for n in neighbours if not n in T.switch]
+    part = {n : i*parts//len(nodes) for (i,n) in enumerate(nodes)}
+    frontier = nodes
+    while len(frontier) > 0:
+        reached = {m : None for n in frontier for m in neighbours[n] if not m in part}
+        for m in reached:
+            votes = [0]*parts
+            for n in neighbours[m]:
+                if n in part:
+                    votes[part[n]] += 1
+            part[m] = votes.index(max(votes))
+        frontier = list(reached)
+    return part
+
+
+# Transfers of a message of size bytes as the steps of Topology.send: (reverse, packet sizes, RDMA) for each,
+# and the step after which the message is sent (the last step is the sync when sync is set)
+def message_plan(T, size, method = None, sync = True):
+    if method == None:
+        if size > T.eager_limit:
+            method = 'rendezvous'
+        else:
+            method = 'eager'
+    data = [T.packet_limit + T.packet_overhead]*(size//T.packet_limit)
+    if not size % T.packet_limit == 0:
+        data.append(size % T.packet_limit + T.packet_overhead)
+    control = [T.packet_overhead]
+    if method == 'eager':
+        if size <= T.packet_limit:
+            data = [T.packet_overhead + size]
+        steps = [(False, data, False)]
+    elif method == 'rendezvous':
+        steps = [(False, control, False), (True, control, False), (False, data, True), (True, control, False)]
+    else:
+        print("Unknown method", method)
+        raise Exception('UnknownMethod')
+    sent = len(steps) - 1
+    if sync:
+        steps.append((True, control, False))
+    return (steps, sent)
+
+
+# The links of T held by one partition
+#    owner -- link key -> partition
+#    heap -- pending link requests (time, message, step, packet, hop, (message, source, dest, size))
+#    free -- link key -> time the link is released
+#    trains -- (message, step) -> [packets still in flight, time the last of them arrived]
+#    telemetry -- LinkTelemetry of the links of the partition, when T has one
+class Partition():
+    def __init__(self, T, number, owner, method = None, sync = True):
+        self.T = T
+        self.number = number
+        self.owner = owner
+        self.method = method
+        self.sync = sync
+        self.heap = []
+        self.free = {}
+        self.trains = {}
+        self.plans = {}
+        self.routes = {}
+        self.outbox = {}
+        self.reports = []
+        self.telemetry = None
+        if not T.telemetry == None:
+            self.telemetry = LinkTelemetry(bucket = T.telemetry.bucket, queue_bins = T.telemetry.queue_bins)
+
+    def plan(self, size):
+        plan = self.plans.get(size)
+        if plan == None:
+            plan = message_plan(self.T, size, self.method, self.sync)
+            self.plans[size] = plan
+        return plan
+
+    # Hops of the route from source to dest (reversed with reverse) as in PacketEngine.send, with the partition of
+    # each link, and the latency before the first request
+    def hops(self, source, dest, reverse, RDMA):
+        route = self.routes.get((source, dest, reverse, RDMA))
+        if not route == None:
+            return route
+        T = self.T
+        if RDMA:
+            mode = 'RDMA'
+        else:
+            mode = 'eager'
+        R = T.route(source, dest)
+        if reverse:
+            R = R[::-1]
+        hops = []
+        for (a,b) in zip(R, R[1:]):
+            if b in T.switch:
+                hold = T.latency.get(b,T.switch_latency)[mode]
+                enter = 0
+            else:
+                hold = 0
+                if RDMA:
+                    enter = 0
+                else:
+                    enter = T.latency.get(b,T.node_latency)[mode]
+            key = T.link_key((a,b))
+            hops.append((key, hold, enter, node_latency(T, b, mode), self.owner[key], (a,b)))
+        if len(hops) > 0:
+            hops[-1] = hops[-1][:3] + (None,) + hops[-1][4:]
+        route = (hops, node_latency(T, R[0], mode), mode)
+        self.routes[(source, dest, reverse, RDMA)] = route
+        return route
+
+    def post(self, part, request):
+        if part == self.number:
+            heapq.heappush(self.heap, request)
+        else:
+            self.outbox.setdefault(part, []).append(request)
+
+    # Start step j of message at time t
+    def transfer(self, message, j, t):
+        (v, source, dest, size) = message
+        (steps, sent) = self.plan(size)
+        (reverse, sizes, RDMA) = steps[j]
+        (hops, latency, mode) = self.hops(source, dest, reverse, RDMA)
+        if len(sizes) == 0:
+            self.arrived(message, j, t)
+            return
+        for k in range(len(sizes)):
+            self.post(hops[0][4], (t + latency, v, j, k, 0, message))
+
+    # Step j of message is complete at time t
+    def arrived(self, message, j, t):
+        (steps, sent) = self.plan(message[3])
+        if j == sent:
+            self.reports.append((message[0], 'sent', t))
+        if j + 1 == len(steps):
+            self.reports.append((message[0], 'done', t))
+        else:
+            self.transfer(message, j + 1, t)
+
+    def request(self, request):
+        (time, v, j, k, hop, message) = request
+        (steps, sent) = self.plan(message[3])
+        (reverse, sizes, RDMA) = steps[j]
+        (hops, latency, mode) = self.hops(message[1], message[2], reverse, RDMA)
+        (key, hold, enter, latency, part, link) = hops[hop]
+        packet_time = self.T.packet_time(sizes[k], mode)
+        grant = self.free.get(key, time)
+        if grant < time:
+            grant = time
+        self.free[key] = grant + hold + packet_time
+        if not self.telemetry == None:
+            self.telemetry.packet(link, time, grant, hold + packet_time, sizes[k], key = key)
+        t = grant + enter
+        if not latency == None:
+            self.post(hops[hop + 1][4], (t + latency, v, j, k, hop + 1, message))
+            return
+        # The packet isn't done until the last bit arrives
+        t += packet_time
+        train = self.trains.get((v,j))
+        if train == None:
+            train = [len(sizes), t]
+            self.trains[(v,j)] = train
+        train[0] -= 1
+        if train[1] < t:
+            train[1] = t
+        if train[0] == 0:
+            del self.trains[(v,j)]
+            self.arrived(message, j, train[1])
+
+    # Start the messages of starts, (time, message), take in the requests and process every request before end
+    # Returns the requests for other partitions by partition, the reports (message, 'sent' or 'done', time) and
+    # the time of the next request held
+    def window(self, end, starts, requests):
+        self.outbox = {}
+        self.reports = []
+        for (t, message) in starts:
+            self.transfer(message, 0, t)
+        for request in requests:
+            heapq.heappush(self.heap, request)
+        while len(self.heap) > 0 and self.heap[0][0] < end:
+            self.request(heapq.heappop(self.heap))
+        if len(self.heap) > 0:
+            return (self.outbox, self.reports, self.heap[0][0])
+        return (self.outbox, self.reports, math.inf)
+
+
+def node_latency(T, node, mode):
+    if node in T.switch:
+        return T.latency.get(node,T.switch_latency)[mode]
+    return T.latency.get(node,T.node_latency)[mode]
+
+
+def serve(partition, connection):
+    while True:
+        work = connection.recv()
+        if work == None:
+            break
+        if work == 'telemetry':
+            connection.send(partition.telemetry)
+            continue
+        connection.send(partition.window(*work))
+    connection.close()
+
+
+# Simulate the messages of the CompactDAG D on T with workers processes, starting at T.env.now
+# The send, sent and synced times of each message are recorded as by Topology.record (in order of the vertices
+# rather than of time) and the link counters are added to T.telemetry; returns the makespan
+# part maps each node to its partition (by default partition(T, workers)).  Worker processes are forked, so
+# they share T and D with the coordinator.
+def simulate(T, D, workers = 2, part = None):
+    if not isinstance(D, CompactDAG):
+        raise ValueError('Parallel simulation needs a CompactDAG')
+    if not T.fidelity == 'packet':
+        raise ValueError('Parallel simulation needs packet fidelity')
+    if D.packet_stats or (not T.recorder == None and not T.recorder.level == 'message'):
+        raise ValueError('Parallel simulation only records message events')
+    window = lookahead(T)
+    if window <= 0:
+        raise ValueError('Parallel simulation needs positive node and switch latencies')
+    if part == None:
+        part = partition(T, workers)
+    owner = {}
+    for e in T.edges:
+        key = T.link_key(e)
+        if not key in owner:
+            owner[key] = part[e[0]]
+    partitions = [Partition(T, i, owner, D.method, D.sync) for i in range(workers)]
+
+    origin = T.env.now
+    n = D.num_vertices
+    send = np.full(n, np.nan)
+    sent = np.full(n, np.nan)
+    done = np.full(n, np.nan)
+    begin = np.full(n, origin, dtype = np.float64)
+    waiting = {}
+    starts = [[] for i in range(workers)]
+    first = {}  # (source, dest) -> partition of the first link, or None for a route without links
+
+    # Message v is complete at time t; returns the successors that have no incomplete predecessors left, with
+    # the time they start
+    def complete(v, t):
+        done[v] = t
+        ready = []
+        for x in D.successors(v).tolist():
+            count = waiting.pop(x, int(D.indegree[x])) - 1
+            if begin[x] < t:
+                begin[x] = t
+            if count == 0:
+                ready.append((x, float(begin[x])))
+            else:
+                waiting[x] = count
+        return ready
+
+    # Start the messages of ready, (vertex, time); messages without links and events complete at once and start
+    # their successors
+    def start(ready):
+        while len(ready) > 0:
+            (v, t) = ready.pop()
+            if D.kind[v] == 0:
+                (source, dest, size) = (int(D.source[v]), int(D.dest[v]), int(D.size[v]))
+                send[v] = t
+                if not (source, dest) in first:
+                    R = T.route(source, dest)
+                    if len(R) > 1:
+                        first[(source, dest)] = owner[T.link_key((R[0], R[1]))]
+                    else:
+                        first[(source, dest)] = None
+                if not first[(source, dest)] == None:
+                    starts[first[(source, dest)]].append((t, (v, source, dest, size)))
+                    continue
+                # As in the PacketEngine, a transfer without links takes the time of its largest packet
+                (steps, last) = partitions[0].plan(size)
+                for (j, (reverse, sizes, RDMA)) in enumerate(steps):
+                    if RDMA:
+                        t += max([T.packet_time(s, 'RDMA') for s in sizes], default = 0)
+                    else:
+                        t += max([T.packet_time(s, 'eager') for s in sizes], default = 0)
+                    if j == last:
+                        sent[v] = t
+            ready.extend(complete(v, t))
+
+    start([(v, origin) for v in np.flatnonzero(D.indegree == 0).tolist()])
+
+    connections = []
+    processes = []
+    if workers > 1:
+        context = multiprocessing.get_context('fork')
+        for p in partitions:
+            (connection, child) = context.Pipe()
+            process = context.Process(target = serve, args = (p, child), daemon = True)
+            process.start()
+            connections.append(connection)
+            processes.append(process)
+    try:
+        inbox = [[] for i in range(workers)]
+        pending = [math.inf]*workers
+        while True:
+            lower = min(pending)
+            for i in range(workers):
+                lower = min([lower] + [r[0] for r in inbox[i]] + [t + window for (t, message) in starts[i]])
+            if lower == math.inf:
+                break
+            end = lower + window
+            work = [(end, starts[i], inbox[i]) for i in range(workers)]
+            starts = [[] for i in range(workers)]
+            inbox = [[] for i in range(workers)]
+            if workers > 1:
+                active = [i for i in range(workers) if len(work[i][1]) > 0 or len(work[i][2]) > 0 or pending[i] < end]
+                for i in active:
+                    connections[i].send(work[i])
+                results = [(i, connections[i].recv()) for i in active]
+            else:
+                results = [(0, partitions[0].window(*work[0]))]
+            reports = []
+            for (i, (outbox, report, next)) in results:
+                pending[i] = next
+                for (j, requests) in outbox.items():
+                    inbox[j].extend(requests)
+                reports.extend(report)
+            for (v, event, t) in reports:
+                if event == 'sent':
+                    sent[v] = t
+            for (v, event, t) in reports:
+                if event == 'done':
+                    start(complete(v, t))
+        if not T.telemetry == None:
+            if workers > 1:
+                for connection in connections:
+                    connection.send('telemetry')
+                for connection in connections:
+                    T.telemetry.merge(connection.recv())
+            else:
+                T.telemetry.merge(partitions[0].telemetry)
+    finally:
+        for connection in connections:
+            connection.send(None)
+        for process in processes:
+            process.join()
+
+    for v in np.flatnonzero(D.kind == 0).tolist():
+        if np.isnan(send[v]):
+            continue
+        id = D.id(v)
+        times = [('send', send[v]), ('sent', sent[v])]
+        if D.sync:
+            times.append(('synced', done[v]))
+        for (event, t) in times:
+            if not T.recorder == None:
+                T.recorder.message(id, event, float(t))
+            elif event == 'send':
+                T.statistics[id] = [float(t)]
+            else:
+                T.statistics[id].append(float(t))
+    return float(np.nanmax(done, initial = origin))
+
+
+if __name__ == '__main__':
+    from sweep import make_topology, placement, num_ranks
+    parser = argparse.ArgumentParser(description = "Simulate a poger message DAG with a conservative parallel simulation")
+    parser.add_argument('--dag', type=str, required=True, help="DAG.txt (with --messages) or covers.txt of poger")
+    parser.add_argument('--messages', type=str, default=None, help="messages.txt matching --dag")
+    parser.add_argument('--size', type=int, default=0, help="Size in bytes of every message")
+    parser.add_argument('--traces', type=str, default=None, help="Directory of a traced run to take the message sizes from")
+    parser.add_argument('--topology', type=str, default='fattree:4', help="Topology, e.g. fattree:4, dragonfly:2,4,2, torus:4,4,4")
+    parser.add_argument('--placement', type=str, default='linear', help="Rank placement: linear, spread or random:SEED")
+    parser.add_argument('--workers', type=int, default=2, help="Worker processes, one per partition")
+    args = parser.parse_args()
+
+    D = read_messageDAG(args.dag, messages = args.messages, size = args.size)
+    if not args.traces == None:
+        trace_sizes(D, args.traces)
+    T = make_topology(args.topology)
+    T.place(placement(args.placement, num_ranks(D), T.hosts), nodes = T.hosts)
+    wall = time.time()
+    makespan = simulate(T, D, workers = args.workers)
+    print("Makespan", makespan, "Messages", len(T.statistics), "Lookahead", lookahead(T), "Seconds", time.time() - wall)
@@ -0,0 +1,262 @@
+#############################################################################
+##                               FENATE                                    ##  
+##          Copyright © 2021, Battelle Memorial Institute                  ##
+##                                                                         ##
+## 1. Battelle Memorial Institute (hereinafter Battelle) hereby grants     ##
+##  permission to any person or entity lawfully obtaining a copy of this   ##
+##  software and associated documentation files (hereinafter               ##
+##  “the Software”) to redistribute and use the Software in source and     ##
+##  binary forms, with or without modification.  Such person or entity may ##
+##  use, copy, modify, merge, publish, distribute, sublicense, and/or sell ##
+##  copies of the Software, and may permit others to do so, subject to the ##
+##  following conditions:                                                  ##
+##  • Redistributions of source code must retain the above copyright       ##
+##    notice, this list of conditions and the following disclaimers.       ##
+##  • Redistributions in binary form must reproduce the above copyright    ##
+##    notice, this list of conditions and the following disclaimer in      ##
+##    the documentation and/or other materials provided with the           ##
+##    distribution.                                                        ##
+##  • Other than as used herein, neither the name Battelle Memorial        ##
+##    Institute or Battelle may be used in any form whatsoever without     ##
+##    the express written consent of Battelle.                             ##
+## 2. THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS  ##
+##  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT      ##
+##  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS      ##
+##  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL BATTELLE    ##
+##  OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,        ##
+##  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT       ##
+##  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,  ##
+##  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON      ##
+##  ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR     ##
+##  TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF     ##
+##  THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF        ##
+##  SUCH DAMAGE.                                                           ##
+#############################################################################
+
+import argparse
+import csv
+import random
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from multiprocessing import shared_memory
+import numpy as np
+import simpy
+from DESnetworks import CompactDAG, LinkTelemetry, Recorder, read_messageDAG, trace_sizes
+from topologies import FatTree, Dragonfly, Torus3D
+
+
+# Parameter sweeps
+# A configuration is a dict of parameter -> value; every configuration is simulated in a fresh environment
+# on its own topology, and summarized by one row of the results table.
+#    topology -- topology spec, see make_topology
+#    placement -- rank placement, see placement
+#    duplex -- passed to the topology
+#    bw, node_latency, switch_latency -- a number sets both modes, 'bw.RDMA' etc. set one mode
+#    eager_limit, packet_limit, ... -- any Topology setting in SETTINGS
+# The workload is a CompactDAG; with more than one worker it is loaded once, copied into shared memory and
+# mapped read only by every worker of the pool.
+
+TOPOLOGIES = {'fattree' : FatTree, 'dragonfly' : Dragonfly, 'torus' : Torus3D}
+MODES = ['bw', 'node_latency', 'switch_latency']
+SETTINGS = ['eager_limit', 'packet_limit', 'packet_overhead', 'fidelity', 'flow_packets', 'packet_engine', 'dag_scheduler']
+METRICS = ['makespan', 'messages', 'latency_mean', 'latency_p50', 'latency_p90', 'latency_p99', 'latency_max', 'links', 'hot_link', 'hot_utilization', 'hot_max_wait', 'hot']
+
+
+# Topology from a spec name:args, e.g. fattree:4, dragonfly:2,4,2 (hosts, routers, links[, groups]) or
+# torus:4,4,4 (X, Y, Z[, hosts])
+def make_topology(spec, env = None, duplex = True):
+    (name, _, args) = spec.partition(':')
+    if not name in TOPOLOGIES:
+        raise ValueError('Unknown topology ' + repr(spec))
+    args = [int(a) for a in args.split(',') if len(a) > 0]
+    return TOPOLOGIES[name](*args, env = env, duplex = duplex)
+
+
+# Compute node of every one of ranks MPI ranks on a topology with hosts compute nodes
+#    linear -- rank r on node r
+#    spread -- ranks spread evenly over the nodes
+#    random:SEED -- ranks on a random sample of the nodes
+def placement(spec, ranks, hosts):
+    if ranks > hosts:
+        raise ValueError(repr(ranks) + ' ranks do not fit on ' + repr(hosts) + ' nodes')
+    (name, _, seed) = spec.partition(':')
+    if name == 'linear':
+        return np.arange(ranks)
+    if name == 'spread':
+        return np.arange(ranks)*hosts//ranks
+    if name == 'random':
+        return np.array(random.Random(int(seed or 0)).sample(range(hosts), ranks), dtype = np.int64)
+    raise ValueError('Unknown placement ' + repr(spec))
+
+
+# Apply the settings of config to topology T
+def configure(T, config):
+    for (name, value) in config.items():
+        if name in ('topology', 'placement', 'duplex'):
+            continue
+        (setting, _, mode) = name.partition('.')
+        if setting in MODES:
+            table = dict(getattr(T, setting))
+            if len(mode) == 0:
+                for m in table:
+                    table[m] = value
+            elif mode in table:
+                table[mode] = value
+            else:
+                raise ValueError('Unknown mode ' + repr(name))
+            setattr(T, setting, table)
+        elif name in SETTINGS:
+            setattr(T, name, value)
+        else:
+            raise ValueError('Unknown sweep parameter ' + repr(name))
+
+
+# Every combination of the values of each parameter, e.g. grid(bw = [3.5, 12.5], placement = ['linear', 'spread'])
+def grid(**values):
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in product(*[values[name] for name in names])]
+
+
+# Number of MPI ranks sending or receiving a message of D
+def num_ranks(D):
+    messages = (D.kind == 0)
+    return int(max(D.source[messages].max(initial = -1), D.dest[messages].max(initial = -1))) + 1
+
+
+# Simulate D under config and summarize the run as a row: the configuration, the makespan, percentiles of the
+# message latencies (send to delivery) and the hot links, the hot of them with the largest busy time
+# (hot_* for the busiest one)
+def run(D, config, topology = 'fattree:4', hot = 5):
+    T = make_topology(config.get('topology', topology), env = simpy.Environment(), duplex = config.get('duplex', True))
+    T.place(placement(config.get('placement', 'linear'), num_ranks(D), T.hosts), nodes = T.hosts)
+    configure(T, config)
+    T.recorder = Recorder('message')
+    T.telemetry = LinkTelemetry()
+    T.messageDAG(D)
+    T.env.run()
+
+    makespan = T.env.now
+    arrays = T.recorder.arrays()
+    send = np.full(len(T.recorder.messages), np.nan)
+    sent = np.full(len(T.recorder.messages), np.nan)
+    rows = (arrays['event'] == T.recorder.events['send'])
+    send[arrays['id'][rows]] = arrays['time'][rows]
+    rows = (arrays['event'] == T.recorder.events['sent'])
+    sent[arrays['id'][rows]] = arrays['time'][rows]
+    latency = (sent - send)[~np.isnan(sent)]
+
+    row = dict(config)
+    row['makespan'] = makespan
+    row['messages'] = len(latency)
+    if len(latency) > 0:
+        (p50, p90, p99) = np.percentile(latency, [50, 90, 99]).tolist()
+        row.update(latency_mean = float(latency.mean()), latency_p50 = p50, latency_p90 = p90, latency_p99 = p99, latency_max = float(latency.max()))
+    links = T.telemetry.hot(hot)
+    row['links'] = len(T.telemetry.links)
+    row['hot'] = [(repr(e), busy/makespan if makespan > 0 else 0.0, max_wait) for (e, busy, max_wait) in links]
+    if len(links) > 0:
+        (row['hot_link'], row['hot_utilization'], row['hot_max_wait']) = row['hot'][0]
+    return row
+
+
+# Worker side of the shared memory pool
+shared_dag = None
+
+
+def attach(specs, kinds, options, topology, hot):
+    global shared_dag
+    shared_dag = (CompactDAG.__new__(CompactDAG), topology, hot)
+    D = shared_dag[0]
+    D.segments = []
+    for (field, name, shape, dtype) in specs:
+        segment = shared_memory.SharedMemory(name = name)
+        D.segments.append(segment)
+        array = np.ndarray(shape, dtype = dtype, buffer = segment.buf)
+        array.flags.writeable = False
+        setattr(D, field, array)
+    D.kinds = kinds
+    D.labels = None
+    (D.method, D.sync, D.packet_stats) = options
+
+
+def run_shared(config):
+    (D, topology, hot) = shared_dag
+    return run(D, config, topology = topology, hot = hot)
+
+
+# Run every configuration of configs on D (a CompactDAG) with workers processes; returns the rows in order
+# Message ids are the vertex numbers of D, its labels are not passed to the workers
+def sweep(D, configs, topology = 'fattree:4', hot = 5, workers = None):
+    if workers == 1:
+        return [run(D, config, topology = topology, hot = hot) for config in configs]
+    segments = []
+    specs = []
+    try:
+        for field in ('source', 'dest', 'index', 'kind', 'size', 'offsets', 'targets', 'indegree'):
+            array = np.ascontiguousarray(getattr(D, field))
+            segment = shared_memory.SharedMemory(create = True, size = max(1, array.nbytes))
+            segments.append(segment)
+            np.ndarray(array.shape, dtype = array.dtype, buffer = segment.buf)[:] = array
+            specs.append((field, segment.name, array.shape, array.dtype.str))
+        initargs = (specs, D.kinds, (D.method, D.sync, D.packet_stats), topology, hot)
+        with ProcessPoolExecutor(max_workers = workers, initializer = attach, initargs = initargs) as pool:
+            return list(pool.map(run_shared, configs))
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+
+# Write the rows to filename as CSV, one column per parameter and metric
+def save_results(rows, filename):
+    columns = []
+    for row in rows:
+        columns.extend([name for name in row if not name in columns and not name in METRICS])
+    columns.extend(METRICS)
+    with open(filename, 'w', newline = '') as output:
+        writer = csv.DictWriter(output, fieldnames = columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+# Constants of sweep values: True and False (e.g. --set duplex True False) and None
+CONSTANTS = {'True' : True, 'False' : False, 'None' : None}
+
+
+# Sweep values are constants or numbers where they parse as such, otherwise strings
+def parse_value(text):
+    if text in CONSTANTS:
+        return CONSTANTS[text]
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Simulate a poger message DAG over a grid of network configurations")
+    parser.add_argument('--dag', type=str, required=True, help="DAG.txt (with --messages) or covers.txt of poger")
+    parser.add_argument('--messages', type=str, default=None, help="messages.txt matching --dag")
+    parser.add_argument('--size', type=int, default=0, help="Size in bytes of every message")
+    parser.add_argument('--traces', type=str, default=None, help="Directory of a traced run to take the message sizes from")
+    parser.add_argument('--topology', type=str, default='fattree:4', help="Topology of configurations without one, e.g. fattree:4, dragonfly:2,4,2, torus:4,4,4")
+    parser.add_argument('--set', nargs='+', action='append', default=[], metavar=('PARAMETER', 'VALUE'), help="Values of a parameter to sweep over, e.g. --set bw 3.5 12.5 --set placement linear random:1")
+    parser.add_argument('--hot', type=int, default=5, help="Number of hot links to report")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per core)")
+    parser.add_argument('--out', type=str, default=None, help="Write the results table to this CSV file")
+    args = parser.parse_args()
+
+    D = read_messageDAG(args.dag, messages = args.messages, size = args.size)
+    if not args.traces == None:
+        trace_sizes(D, args.traces)
+    configs = grid(**{values[0] : [parse_value(v) for v in values[1:]] for values in args.set})
+    print("Vertices", D.num_vertices, "Ranks", num_ranks(D), "Configurations", len(configs))
+    rows = sweep(D, configs, topology = args.topology, hot = args.hot, workers = args.workers)
+    names = [values[0] for values in args.set]
+    for row in rows:
+        print(' '.join([name + '=' + repr(row[name]) for name in names]), 'makespan', row['makespan'], 'p99', row.get('latency_p99'), 'hot', row.get('hot_link'), row.get('hot_utilization'))
+    if not args.out == None:
+        save_results(rows, args.out)
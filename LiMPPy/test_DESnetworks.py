@@ -0,0 +1,31 @@
+import pytest
+from DESnetworks import LinkTelemetry
+from topologies import Torus3D
+
+
+# Two messages crossing the link between the routers of a 2x1x1 torus in opposite directions
+def crossing_telemetry(duplex, engine):
+    T = Torus3D(2, 1, 1, duplex = duplex)
+    T.packet_engine = engine
+    T.telemetry = LinkTelemetry()
+    T.env.process(T.send(0, 1, 1024, id = 'a', sync = False))
+    T.env.process(T.send(1, 0, 1024, id = 'b', sync = False))
+    T.env.run()
+    return (T, {e : (int(T.telemetry.packets[i]), float(T.telemetry.busy[i])) for (i,e) in enumerate(T.telemetry.links)})
+
+
+@pytest.mark.parametrize('engine', ['process', 'heap'])
+def test_telemetry_counts_half_duplex_link_once(engine):
+    (T, links) = crossing_telemetry(False, engine)
+    crossing = [e for e in links if e[0] in T.switch and e[1] in T.switch]
+    assert len(crossing) == 1
+    assert links[crossing[0]][0] == 2
+    assert len(links) == 3
+
+
+@pytest.mark.parametrize('engine', ['process', 'heap'])
+def test_telemetry_counts_duplex_directions_apart(engine):
+    (T, links) = crossing_telemetry(True, engine)
+    crossing = [e for e in links if e[0] in T.switch and e[1] in T.switch]
+    assert len(crossing) == 2
+    assert [links[e][0] for e in crossing] == [1, 1]
@@ -0,0 +1,92 @@
+import random
+import numpy as np
+import pytest
+from DESnetworks import CompactDAG, LinkTelemetry, Recorder
+from parallel import simulate
+from topologies import FatTree, Torus3D
+
+
+# Random layered message DAG over ranks: every message waits for a few messages of the layer before, so
+# messages fan out together and the packets of a transfer reach their first link at once; a fraction events
+# of the vertices are collective events, which take no time
+def random_dag(ranks, layers, width, seed = 0, sizes = (0, 512, 4096, 9000, 20000), events = 0.1):
+    rnd = random.Random(seed)
+    (source, dest, size, kind, successors) = ([], [], [], [], [])
+    previous = []
+    for layer in range(layers):
+        current = []
+        for i in range(width):
+            v = len(source)
+            (s, d) = rnd.sample(range(ranks), 2)
+            kind.append(1 if rnd.random() < events else 0)
+            source.append(-1 if kind[-1] else s)
+            dest.append(d)
+            size.append(rnd.choice(sizes))
+            successors.append([])
+            for u in rnd.sample(previous, min(len(previous), rnd.randint(1, 3))):
+                successors[u].append(v)
+            current.append(v)
+        previous = current
+    offsets = np.cumsum([0] + [len(s) for s in successors])
+    targets = np.array([v for s in successors for v in s], dtype = np.int64)
+    n = len(source)
+    return CompactDAG(np.array(source), np.array(dest), np.arange(n), np.array(kind), [None, 'AllReduceStart'], np.array(size), offsets, targets)
+
+
+def sequential(T, D):
+    T.packet_engine = 'heap'
+    T.messageDAG(D)
+    T.env.run()
+    return T.env.now
+
+
+TOPOLOGIES = [lambda: FatTree(4), lambda: Torus3D(2, 2, 2), lambda: Torus3D(3, 2, 1, duplex = False)]
+
+
+@pytest.mark.parametrize('topology', TOPOLOGIES)
+@pytest.mark.parametrize('workers', [1, 2, 3])
+def test_parallel_matches_sequential(topology, workers):
+    D = random_dag(6, 12, 10, seed = workers)
+    (A, B) = (topology(), topology())
+    assert simulate(B, D, workers = workers) == sequential(A, D)
+    assert B.statistics == A.statistics
+
+
+@pytest.mark.parametrize('sync', [True, False])
+def test_parallel_matches_sequential_sync(sync):
+    D = random_dag(8, 10, 12, seed = 5)
+    D.sync = sync
+    (A, B) = (FatTree(4), FatTree(4))
+    assert simulate(B, D, workers = 2) == sequential(A, D)
+    assert B.statistics == A.statistics
+
+
+def counters(telemetry):
+    summary = telemetry.summary()
+    return {link : tuple([summary[name][i].tolist() for name in ('busy', 'bytes', 'packets', 'wait', 'max_wait', 'queue')]) for (i,link) in enumerate(summary['links'].tolist())}
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_parallel_telemetry_matches_sequential(workers):
+    D = random_dag(6, 12, 10, seed = 7)
+    (A, B) = (Torus3D(3, 2, 1, duplex = False), Torus3D(3, 2, 1, duplex = False))
+    (A.telemetry, B.telemetry) = (LinkTelemetry(bucket = 5000), LinkTelemetry(bucket = 5000))
+    (A.recorder, B.recorder) = (Recorder('message'), Recorder('message'))
+    assert simulate(B, D, workers = workers) == sequential(A, D)
+    assert counters(B.telemetry) == counters(A.telemetry)
+    assert np.allclose(B.telemetry.summary()['series'].sum(axis = 0), A.telemetry.summary()['series'].sum(axis = 0))
+    rows = [sorted([(R.messages[i], event, t) for (i, event, t) in zip(R.arrays()['id'].tolist(), R.arrays()['event'].tolist(), R.arrays()['time'].tolist())]) for R in (A.recorder, B.recorder)]
+    assert len(rows[0]) > 0
+    assert rows[0] == rows[1]
+
+
+def test_parallel_rejects_packet_recording():
+    D = random_dag(6, 2, 4)
+    T = FatTree(4)
+    T.recorder = Recorder('hop')
+    with pytest.raises(ValueError):
+        simulate(T, D, workers = 2)
+    T = FatTree(4)
+    D.packet_stats = True
+    with pytest.raises(ValueError):
+        simulate(T, D, workers = 2)
@@ -0,0 +1,13 @@
+import pytest
+from sweep import grid, make_topology, parse_value
+
+
+@pytest.mark.parametrize('text, value', [('True', True), ('False', False), ('None', None), ('4', 4), ('3.5', 3.5), ('linear', 'linear'), ('random:1', 'random:1'), ('false', 'false')])
+def test_parse_value(text, value):
+    parsed = parse_value(text)
+    assert parsed == value and type(parsed) is type(value)
+
+
+def test_duplex_false_from_the_command_line():
+    configs = grid(duplex = [parse_value(v) for v in ('True', 'False')])
+    assert [make_topology('fattree:4', duplex = config['duplex']).duplex for config in configs] == [True, False]
@@ -0,0 +1,179 @@
+#############################################################################
+##                               FENATE                                    ##  
+##          Copyright © 2021, Battelle Memorial Institute                  ##
+##                                                                         ##
+## 1. Battelle Memorial Institute (hereinafter Battelle) hereby grants     ##
+##  permission to any person or entity lawfully obtaining a copy of this   ##
+##  software and associated documentation files (hereinafter               ##
+##  “the Software”) to redistribute and use the Software in source and     ##
+##  binary forms, with or without modification.  Such person or entity may ##
+##  use, copy, modify, merge, publish, distribute, sublicense, and/or sell ##
+##  copies of the Software, and may permit others to do so, subject to the ##
+##  following conditions:                                                  ##
+##  • Redistributions of source code must retain the above copyright       ##
+##    notice, this list of conditions and the following disclaimers.       ##
+##  • Redistributions in binary form must reproduce the above copyright    ##
+##    notice, this list of conditions and the following disclaimer in      ##
+##    the documentation and/or other materials provided with the           ##
+##    distribution.                                                        ##
+##  • Other than as used herein, neither the name Battelle Memorial        ##
+##    Institute or Battelle may be used in any form whatsoever without     ##
+##    the express written consent of Battelle.                             ##
+## 2. THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS  ##
+##  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT      ##
+##  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS      ##
+##  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL BATTELLE    ##
+##  OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,        ##
+##  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT       ##
+##  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,  ##
+##  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON      ##
+##  ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR     ##
+##  TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF     ##
+##  THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF        ##
+##  SUCH DAMAGE.                                                           ##
+#############################################################################
+
+from itertools import combinations
+from itertools import product
+from DESnetworks import Topology
+
+
+# Built in topologies
+# Compute nodes are the integers 0 .. hosts-1 (by default MPI rank r runs on node r) and switches are tuples
+# naming their place in the topology.  Routes are computed by arithmetic on the node numbers and kept by
+# Topology.cached_route, so routing a message costs O(path length).
+
+
+
+# k-ary fat-tree (k even) with k pods of k/2 edge and k/2 aggregation switches, (k/2)^2 core switches and
+# k^3/4 compute nodes, k/2 under each edge switch
+# Routes go up to the lowest common level and back down; the aggregation and core switches are picked from
+# the destination (D-mod-k routing), so all traffic to one node converges on one path
+class FatTree(Topology):
+    def __init__(self, k, env = None, name = None, duplex = True):
+        super().__init__(env = env, name = name, duplex = duplex)
+        if k % 2 == 1:
+            raise ValueError('FatTree needs an even k')
+        self.k = k
+        half = k//2
+        self.hosts = k*half*half
+        for pod in range(k):
+            for e in range(half):
+                self.switch.add(('edge', pod, e))
+                for port in range(half):
+                    self.connect((pod*half + e)*half + port, ('edge', pod, e))
+                for a in range(half):
+                    self.connect(('edge', pod, e), ('agg', pod, a))
+            for a in range(half):
+                self.switch.add(('agg', pod, a))
+                for c in range(half):
+                    self.connect(('agg', pod, a), ('core', a, c))
+        for a in range(half):
+            for c in range(half):
+                self.switch.add(('core', a, c))
+        self.route = self.cached_route
+
+    def path(self, source, dest):
+        half = self.k//2
+        (pod, e) = divmod(source//half, half)
+        (dest_pod, dest_e) = divmod(dest//half, half)
+        if (pod, e) == (dest_pod, dest_e):
+            return [source, ('edge', pod, e), dest]
+        a = dest % half
+        if pod == dest_pod:
+            return [source, ('edge', pod, e), ('agg', pod, a), ('edge', pod, dest_e), dest]
+        c = (dest//half) % half
+        return [source, ('edge', pod, e), ('agg', pod, a), ('core', a, c), ('agg', dest_pod, a), ('edge', dest_pod, dest_e), dest]
+
+
+# Dragonfly of groups routers each, with hosts compute nodes and links global links per router
+# Routers of a group are fully connected.  Global link l of a group (owned by router l // links) leads to the
+# group l + 1 groups further on, so with the default groups * links + 1 groups every pair of groups is
+# connected by one global link.  Routes are minimal: to the router owning the global link, across it, and on
+# to the destination router.
+class Dragonfly(Topology):
+    def __init__(self, hosts = 2, routers = 4, links = 2, groups = None, env = None, name = None, duplex = True):
+        super().__init__(env = env, name = name, duplex = duplex)
+        if groups == None:
+            groups = routers*links + 1
+        if groups > routers*links + 1:
+            raise ValueError('Dragonfly with ' + repr(routers*links) + ' global links per group supports at most ' + repr(routers*links + 1) + ' groups')
+        self.p = hosts
+        self.a = routers
+        self.h = links
+        self.g = groups
+        self.hosts = groups*routers*hosts
+        for G in range(groups):
+            for r in range(routers):
+                self.switch.add(('router', G, r))
+                for port in range(hosts):
+                    self.connect((G*routers + r)*hosts + port, ('router', G, r))
+            for (r,s) in combinations(range(routers), 2):
+                self.connect(('router', G, r), ('router', G, s))
+            for l in range(groups - 1):
+                D = (G + l + 1) % groups
+                if G < D:
+                    self.connect(('router', G, l//links), ('router', D, ((G - D - 1) % groups)//links))
+        self.route = self.cached_route
+
+    def path(self, source, dest):
+        (G, r) = divmod(source//self.p, self.a)
+        (D, s) = divmod(dest//self.p, self.a)
+        R = [source, ('router', G, r)]
+        if G == D:
+            if not r == s:
+                R.append(('router', D, s))
+        else:
+            out = ((D - G - 1) % self.g)//self.h
+            into = ((G - D - 1) % self.g)//self.h
+            if not out == r:
+                R.append(('router', G, out))
+            R.append(('router', D, into))
+            if not into == s:
+                R.append(('router', D, s))
+        R.append(dest)
+        return R
+
+
+# 3D torus of X x Y x Z routers with hosts compute nodes on each; node n is on router n // hosts, numbered
+# x-major ((x*Y + y)*Z + z)
+# Routes are dimension ordered (x, then y, then z), each along the shorter way around the ring
+class Torus3D(Topology):
+    def __init__(self, X, Y, Z, hosts = 1, env = None, name = None, duplex = True):
+        super().__init__(env = env, name = name, duplex = duplex)
+        self.dims = (X, Y, Z)
+        self.p = hosts
+        self.hosts = X*Y*Z*hosts
+        for (x,y,z) in product(range(X), range(Y), range(Z)):
+            router = ('router', x, y, z)
+            self.switch.add(router)
+            for port in range(hosts):
+                self.connect(((x*Y + y)*Z + z)*hosts + port, router)
+            for (i,n) in enumerate(self.dims):
+                if n > 1:
+                    neighbour = [x, y, z]
+                    neighbour[i] = (neighbour[i] + 1) % n
+                    self.connect(router, ('router',) + tuple(neighbour))
+        self.route = self.cached_route
+
+    def coordinates(self, node):
+        (X, Y, Z) = self.dims
+        (xy, z) = divmod(node//self.p, Z)
+        (x, y) = divmod(xy, Y)
+        return [x, y, z]
+
+    def path(self, source, dest):
+        position = self.coordinates(source)
+        target = self.coordinates(dest)
+        R = [source, ('router',) + tuple(position)]
+        for (i,n) in enumerate(self.dims):
+            forward = (target[i] - position[i]) % n
+            if forward <= n - forward:
+                step = 1
+            else:
+                step = -1
+            while not position[i] == target[i]:
+                position[i] = (position[i] + step) % n
+                R.append(('router',) + tuple(position))
+        R.append(dest)
+        return R
@@ -34,9 +34,13 @@
 #############################################################################
 
 import os
+import numpy as np
 from collections import Counter
 from itertools import combinations
-from itertools import product
+from ast import literal_eval
+from csr import MESSAGE_DTYPE, EdgeStore, decode_messages, from_edges, read_graph, write_graph, write_graph_stream
+from traces import ARCHIVE_SUFFIXES, CONTAINER_SUFFIX, archive_runs, container_fresh, rank_traces, received_messages
+from transitive import reduce_components, reduce_edges, transitive_reduction, write_reduction
 
 def parse_line(line):
     entries = list(map(int,line.split(',')[:-1]))
@@ -48,205 +52,785 @@ def parse_line(line):
     return (sender, recipient, message, send_time, recv_time)
 
 
-def build_rankDAG(dirs, r):
-    # Because all messages are number sequentially by sender, we need to create a common index for message
-    # For messages sent to or from rank r, this builds an index (by data directory) which translates from
-    # The ordering from sequential relative to rank, to sequential relative to communication pair
-    index = {dir : {} for dir in dirs}
-    for dir in dirs:
-        messages = {}
-        try:
-            with open(dir + "/trace_MPISend_" + repr(r) + ".ct", "r") as input:
-                for line in input:
-                    (send,recv,midx,send_t,recv_t) = parse_line(line)
-                    if not (send,recv) in messages:
-                        messages[(send,recv)] = [midx]
-                    else:
-                        messages[(send,recv)].append(midx)
-        except:
-            pass
+# Collective traces as (trace name, event label, trace column naming the collective)
+# Each collective contributes a Start event at t_start and an End event at t_end
+COLLECTIVES = [("Allreduce", "AllReduce", 'recipient'),
+               ("Gather", "Gather", 'recipient'),
+               ("Reduce", "Reduce", 'recipient'),
+               ("Scatter", "Scatter", 'sender'),
+               ("Alltoall", "Alltoall", None),
+               ("Bcast", "Bcast", 'sender')]
+
+
+# All pairs (sources[a], targets[b]) with matrix[sources[a]] < matrix[targets[b]] in every coordinate
+# Both sides are sorted by the first coordinate, so each block of targets is only compared against the
+# prefix of sources that can precede it; the remaining coordinates are intersected as boolean blocks
+# of at most block_size entries
+def dominance_pairs(matrix, sources, targets, block_size = 1 << 22):
+    found = ([], [])
+    if len(sources) == 0 or len(targets) == 0:
+        return found
+    sources = sources[np.argsort(matrix[sources,0], kind = 'stable')]
+    targets = targets[np.argsort(matrix[targets,0], kind = 'stable')]
+    S = matrix[sources]
+    T = matrix[targets]
+    width = max(1, block_size // len(sources))
+    for t in range(0, len(targets), width):
+        block = T[t:t+width]
+        prefix = np.searchsorted(S[:,0], block[-1,0], side = 'left')
+        if prefix == 0:
+            continue
+        mask = S[None,:prefix,0] < block[:,None,0]
+        for d in range(1, matrix.shape[1]):
+            mask &= S[None,:prefix,d] < block[:,None,d]
+        (b, a) = np.nonzero(mask)
+        found[0].extend(sources[a].tolist())
+        found[1].extend(targets[b + t].tolist())
+    return found
+
+
+# Because all messages are number sequentially by sender, we need to create a common index for message
+# For messages sent to or from rank r, this builds an index (for one data directory) which translates from
+# The ordering from sequential relative to rank, to sequential relative to communication pair
+# traces is the rank_traces of rank r when the caller already has them
+def message_index(dir, r, traces = None):
+    messages = message_lists(dir, r, traces)
+    return {m : {idx : i for (i,idx) in enumerate(messages[m])} for m in messages}
+
+
+# The messages of each communication pair of rank r, as the sender's sequential numbers in the order sent
+def message_lists(dir, r, traces = None):
+    if traces == None:
+        traces = rank_traces(dir, r)
+    messages = {}
+    try:
+        trace = traces("Send")
+        for (send,recv,midx) in zip(trace['sender'].tolist(), trace['recipient'].tolist(), trace['index'].tolist()):
+            if not (send,recv) in messages:
+                messages[(send,recv)] = [midx]
+            else:
+                messages[(send,recv)].append(midx)
+    except:
+        pass
+    # Prefer the one-pass send index store (traces.py --send-index) over re-reading every sender's trace
+    received = received_messages(dir, r)
+    if not received == None:
+        messages.update(received)
+    else:
         try:
-            with open(dir + "/trace_MPIRecv_" + repr(r) + ".ct","r") as input:
-                sending_ranks = set([parse_line(line)[0] for line in input])
+            sending_ranks = set(traces("Recv")['sender'].tolist())
             for sender in sending_ranks:
-                with open(dir +"/trace_MPISend_" + repr(sender) + ".ct","r") as input:
-                    messages[(sender,r)] = [parse_line(line)[2] for line in input if parse_line(line)[1] == r]
+                trace = rank_traces(dir, sender)("Send")
+                messages[(sender,r)] = trace['index'][trace['recipient'] == r].tolist()
         except:
             pass
-    
-        for m in messages:
-            index[dir][m] = {idx : i for (i,idx) in enumerate(messages[m])}
+    return messages
 
-    
-    
-    print("Built Message index")
-    print(set([m for loc in index for m in index[loc]]))
-    # Build a list of tuples (timestamp, message_info)
-    # All timestamps are relative to the MPI rank
-    # Embedding builds a per message_info embedding of the timestamps into Z^d where d is the number of directors
-    # If embedding[m] < embedding[k] (as elements of the canonical poset on Z^d) then message m always preceeeds message k
-    embedding = {}
-    for dir in dirs:
-        print(dir)
-        messages = []
-        count = 0
-        try:
-            with open(dir + "/trace_MPIAllreduce_" + repr(r) + ".ct",'r') as input:
-                for line in input:
-                    #print(line)
-                    count += 1
-                    (send,recv,midx,prior_t,post_t) = parse_line(line)
-                    messages.append((prior_t,("AllReduceStart",recv,midx)))
-                    messages.append((post_t,("AllReduceEnd",recv,midx)))
-        except Exception as E:
-            print(E.__class__.__name__,E)
-        print("AllReduce Done", count, len(messages))
-        count = 0
-        try:
-            with open(dir + "/trace_MPIGather_" + repr(r) + ".ct",'r') as input:
-                for line in input:
-                    #print(line)
-                    count += 1
-                    (send,recv,midx,prior_t,post_t) = parse_line(line)
-                    messages.append((prior_t,("GatherStart",recv,midx)))
-                    messages.append((post_t,("GatherEnd",recv,midx)))
-        except Exception as E:
-            print(E.__class__.__name__,E)
-        print("Gather Done", count, len(messages))
-        count = 0
-        try:
-            with open(dir + "/trace_MPIReduce_" + repr(r) + ".ct",'r') as input:
-                for line in input:
-                    #print(line)
-                    count += 1
-                    (send,recv,midx,prior_t,post_t) = parse_line(line)
-                    messages.append((prior_t,("ReduceStart",recv,midx)))
-                    messages.append((post_t,("ReduceEnd",recv,midx)))
-        except Exception as E:
-            print(E.__class__.__name__,E)
-        print("Reduce Done", count, len(messages))
-        count = 0
-        try:
-            with open(dir + "/trace_MPIScatter_" + repr(r) + ".ct",'r') as input:
-                for line in input:
-                    #print(line)
-                    count += 1
-                    (send,recv,midx,prior_t,post_t) = parse_line(line)
-                    messages.append((prior_t,("ScatterStart",send,midx)))
-                    messages.append((post_t,("ScatterEnd",send,midx)))
-        except Exception as E:
-            print(E.__class__.__name__,E)
-        print("Scatter Done", count, len(messages))
-        count = 0
-        try:
-            with open(dir + "/trace_MPIAlltoall_" + repr(r) + ".ct",'r') as input:
-                for line in input:
-                    #print(line)
-                    count += 1
-                    (send,recv,midx,prior_t,post_t) = parse_line(line)
-                    messages.append((prior_t,("AlltoallStart",-1,midx)))
-                    messages.append((post_t,("AlltoallEnd",-1,midx)))
-        except Exception as E:
-            print(E.__class__.__name__,E)
-        print("Alltoall Done", count, len(messages))
-        count = 0
-        try:
-            with open(dir + "/trace_MPIBcast_" + repr(r) + ".ct",'r') as input:
-                for line in input:
-                    #print(line)
-                    count += 1
-                    (send,recv,midx,prior_t,post_t) = parse_line(line)
-                    messages.append((prior_t,("BcastStart",send,midx)))
-                    messages.append((post_t,("BcastEnd",send,midx)))
-        except Exception as E:
-            print(E.__class__.__name__,E)
-        print("Bcast Done", count, len(messages))
-        count = 0
-        try:
-            with open(dir + "/trace_MPISendrecv_" + repr(r) + ".ct",'r') as input:
-                for line in input:
-                    #print(line)
-                    count += 1
-                    (send,recv,midx,prior_t,post_t) = parse_line(line)
-                    messages.append((prior_t,("Sendrecv_"+repr(send)+"Start",recv,midx)))
-                    messages.append((post_t,("Sendrecv_" + repr(send)+ "End",recv,midx)))
-        except Exception as E:
-            print(E.__class__.__name__,E)
-        print("Sendrecv Done", count, len(messages))
+
+# Id of an event label (e.g. "AllReduceStart") in kinds, the {label : kind} table shared by the runs of a rank
+# Kind 0 is left for point to point messages, as in csr.encode_messages
+def intern(kinds, label):
+    if not label in kinds:
+        kinds[label] = len(kinds) + 1
+    return kinds[label]
+
+
+# The kinds list of csr.decode_messages for an interning table
+def kind_list(kinds):
+    return [None] + sorted(kinds, key = kinds.get)
+
+
+# The position of each message (sender[i], recipient[i], message[i]) in the ordering of its communication pair
+# (messages from message_lists, translated as message_index does), and whether it is there at all
+# Rows are grouped by pair with one sort, so each pair's translation is a single searchsorted
+def pair_numbers(messages, sender, recipient, message):
+    numbers = np.full(len(message), -1, dtype = np.int64)
+    found = np.zeros(len(message), dtype = bool)
+    order = np.lexsort((recipient, sender))
+    bounds = np.flatnonzero((np.diff(sender[order]) != 0) | (np.diff(recipient[order]) != 0)) + 1
+    for rows in np.split(order, bounds):
+        if len(rows) == 0:
+            continue
+        sent = messages.get((int(sender[rows[0]]), int(recipient[rows[0]])))
+        if sent == None or len(sent) == 0:
+            continue
+        # A number sent twice translates to its last position, as in message_index
+        ordering = np.argsort(np.asarray(sent, dtype = np.int64), kind = 'stable')
+        keys = np.asarray(sent, dtype = np.int64)[ordering]
+        at = np.maximum(np.searchsorted(keys, message[rows], side = 'right') - 1, 0)
+        hit = keys[at] == message[rows]
+        numbers[rows[hit]] = ordering[at[hit]]
+        found[rows[hit]] = True
+    return (numbers, found)
+
+
+# The events (message_info) of rank r in one data directory, in the order of their timestamps, encoded as
+# rows of csr.MESSAGE_DTYPE with their labels interned in kinds
+# All timestamps are relative to the MPI rank
+# The run is ordered by a single lexsort; events at the same time are ordered as their message_info tuples
+# would be (point to point messages first, which the tuples themselves cannot compare with collectives)
+def run_table(dir, r, kinds):
+    traces = rank_traces(dir, r)
+    messages = message_lists(dir, r, traces)
+    print(dir)
+    columns = []
+    total = 0
+    def add(kind, source, dest, idx, t):
+        columns.append((kind, source, dest, idx, t))
+        return len(t)
+    for (op, label, column) in COLLECTIVES:
         count = 0
         try:
-            with open(dir + "/trace_MPISend_" + repr(r) + ".ct", "r") as input:
-                for line in input:
-                    #print(line)
-                    count += 1
-                    (send,recv,midx,prior_t,post_t) = parse_line(line)
-                    messages.append((prior_t,(send,recv,index[dir][(send,recv)][midx])))
+            trace = traces(op)
+            count = len(trace)
+            keys = -1 if column == None else trace[column]
+            total += add(intern(kinds, label + "Start"), -1, keys, trace['index'], trace['t_start'])
+            total += add(intern(kinds, label + "End"), -1, keys, trace['index'], trace['t_end'])
         except Exception as E:
             print(E.__class__.__name__,E)
-        print("Send Done", count, len(messages))
+        print(label, "Done", count, total)
+    count = 0
+    try:
+        trace = traces("Sendrecv")
+        count = len(trace)
+        (senders, which) = np.unique(trace['sender'], return_inverse = True)
+        for (suffix, t) in (("Start", 't_start'), ("End", 't_end')):
+            labels = np.array([intern(kinds, "Sendrecv_" + repr(send) + suffix) for send in senders.tolist()], dtype = np.int64)
+            total += add(labels[which], -1, trace['recipient'], trace['index'], trace[t])
+    except Exception as E:
+        print(E.__class__.__name__,E)
+    print("Sendrecv Done", count, total)
+    for (op, t, name) in (("Send", 't_start', "Send"), ("Recv", 't_end', "Recieved")):
         count = 0
         try:
-            with open(dir + "/trace_MPIRecv_" + repr(r) + ".ct","r") as input:
-                for line in input:
-                    #print(line)
-                    count += 1
-                    (send,recv,midx,prior_t,post_t) = parse_line(line)
-                    messages.append((post_t,(send,recv,index[dir][(send,recv)][midx])))
+            trace = traces(op)
+            (numbers, found) = pair_numbers(messages, trace['sender'], trace['recipient'], trace['index'])
+            count = len(trace) if found.all() else int(np.argmin(found))
+            total += add(0, trace['sender'][:count], trace['recipient'][:count], numbers[:count], trace[t][:count])
+            if count < len(trace):
+                print("KeyError", (int(trace['sender'][count]), int(trace['recipient'][count]), int(trace['index'][count])))
         except Exception as E:
             print(E.__class__.__name__,E)
-        print("Recieved Done", count, len(messages))
-        messages.sort()
-        messages = [m for (t,m) in messages]
-        for (i,m) in enumerate(messages):
-            if not m in embedding:
-                embedding[m] = [i]
-            else:
-                embedding[m].append(i)
-    print("Total Messages", len(embedding))
+        print(name, "Done", count, total)
+
+    table = np.empty(total, dtype = MESSAGE_DTYPE)
+    times = np.empty(total, dtype = np.int64)
+    offset = 0
+    for (kind, source, dest, idx, t) in columns:
+        block = slice(offset, offset + len(t))
+        for (field, values) in zip(MESSAGE_DTYPE.names, (kind, source, dest, idx)):
+            table[field][block] = values
+        times[block] = t
+        offset += len(t)
+    # Labels compare as strings, so their ids are replaced by their rank in sorted order for the tie break
+    rank = np.zeros(len(kinds) + 1, dtype = np.int64)
+    rank[[kinds[label] for label in sorted(kinds)]] = np.arange(1, len(kinds) + 1)
+    collective = table['kind'] > 0
+    first = np.where(collective, rank[table['kind']], table['source'])
+    return table[np.lexsort((table['index'], table['dest'], first, collective, times))]
+
+
+# The events of rank r in one data directory as a list of message_info
+def run_events(dir, r):
+    kinds = {}
+    return decode_messages(run_table(dir, r, kinds), kind_list(kinds))
+
+
+# Embedding of the events of a rank over its runs (tables from run_table) into Z^d where d is the number of runs
+# If positions[m] < positions[k] (as elements of the canonical poset on Z^d) then message m always preceeeds message k
+# Returns (events, positions, ragged):
+#    events -- the distinct events as a MESSAGE_DTYPE table, in order of first appearance over the runs
+#    positions -- int32 (events x runs) position of the first occurrence of each event in each run, -1 where it is missing
+#    ragged -- {event : positions in every run} for the events missing from a run or repeated within one
+def rank_embedding(runs):
+    if len(runs) == 0:
+        return (np.empty(0, dtype = MESSAGE_DTYPE), np.empty((0, 0), dtype = np.int32), {})
+    lengths = [len(table) for table in runs]
+    table = np.concatenate(runs)
+    run = np.repeat(np.arange(len(runs)), lengths)
+    position = np.concatenate([np.arange(n) for n in lengths])
+    # Distinct events from one lexsort of the columns; the sort is stable, so within an event the occurrences
+    # stay in run order and the first one is its first appearance
+    order = np.lexsort((table['index'], table['dest'], table['source'], table['kind']))
+    columns = [table[field][order] for field in MESSAGE_DTYPE.names]
+    new = np.zeros(len(order), dtype = bool)
+    new[:1] = True
+    for column in columns:
+        new[1:] |= column[1:] != column[:-1]
+    group = np.cumsum(new) - 1
+    first = order[new]
+    number = np.empty(len(first), dtype = np.int64)
+    number[np.argsort(first, kind = 'stable')] = np.arange(len(first))
+    events = table[np.sort(first)]
+    event = number[group]
+    run = run[order]
+    position = position[order]
+
+    cell = event * len(runs) + run
+    counts = np.bincount(cell, minlength = len(events) * len(runs)).reshape(len(events), len(runs))
+    positions = np.full((len(events), len(runs)), -1, dtype = np.int32)
+    head = np.ones(len(cell), dtype = bool)
+    head[1:] = (group[1:] != group[:-1]) | (run[1:] != run[:-1])
+    positions[event[head], run[head]] = position[head]
+
+    repeated = (counts != 1).any(axis = 1)[event]
+    ragged = {}
+    for (e,i) in zip(event[repeated].tolist(), position[repeated].tolist()):
+        if not e in ragged:
+            ragged[e] = [i]
+        else:
+            ragged[e].append(i)
+    return (events, positions, ragged)
+
+
+def build_rankDAG(dirs, r):
+    kinds = {}
+    (events, positions, ragged) = rank_embedding([run_table(dir, r, kinds) for dir in dirs])
+    print("Total Messages", len(events))
+    (chain, edges) = rank_edges(events, kind_list(kinds), positions, ragged, r)
+    return chain + edges
+
 
-    # This is the list of directed temporally (m,k) in edges implies embedding[m] < embedding[k]
+# The edges of rank r from the embedding of its events (see rank_embedding), returned as (chain, edges) of
+# message_info: the chain of sends from r to each peer, which holds in every run by construction,
+# and the temporal edges (m,k) for which the embedding of m is below the embedding of k
+def rank_edges(events, kinds, positions, ragged, r):
+    chain = []
     edges = []
+    labels = decode_messages(events, kinds)
+    roles = event_roles(events, kinds, r)
 
-    send = [m for m in embedding if m[0] == r]
-    recieve = [m for m in embedding if m[1] == r and not isinstance(m[0],str)]
-    collectives = [m for m in embedding if isinstance(m[0],str)]
-    collective_types = [m[0][:-3] for m in embedding if isinstance(m[0],str) and m[0][-3:] == "End"]
-    
     # Ordering the Sends
-    # Need to figure out how many times rank r sends to v 
-    count = {}
-    for (u,v,idx) in send:
-        count[v] = max(count.get(v,-1),idx)
-    for v in count:
-        for j in range(count[v]):
-            edges.append(((r,v,j),(r,v,j+1)))
+    # Need to figure out how many times rank r sends to v
+    for (v,count) in send_counts(events, roles).items():
+        for j in range(count):
+            chain.append(((r,v,j),(r,v,j+1)))
 
-        
-    #Note that the edges  (r,"AllReduceStart", j) -> (r, "AllReduceStart",j+1) is achieved by the send process 
+
+    #Note that the edges  (r,"AllReduceStart", j) -> (r, "AllReduceStart",j+1) is achieved by the send process
     #allreduce = max([m[2] for m in embedding if m[1] == "AllReduceStart"], default = -1)
     #edges.extend([((r,"AllReduceStart",j),(r,"AllReduceEnd",j)) for j in range(allreduce)])
     #edges.extend([((r,"AllReduceEnd",j),(r,"AllReduceStart",j+1)) for j in range(allreduce-1)])
 
-    # Edges from recieve to send
-    #print(send)
-    #print(recieve)
-    for (m,k) in product(recieve, send):
-        if all( a < b for (a,b) in zip(embedding[m],embedding[k])):
-            edges.append((m,k))
+    everything = np.arange(len(events))
+    for (i,j) in zip(*temporal_edges(positions, ragged, roles, everything, everything)):
+        edges.append((labels[i],labels[j]))
 
-    for (m,k) in product(recieve, [ell for ell in collectives if ell[0][-5:] == "Start"]):
-        if all( a < b for (a,b) in zip(embedding[m],embedding[k])):
-            edges.append((m,k))
-            
-    for (m,k) in product([ell for ell in collectives if ell[0][-3:] == "End"],send):
-        if all( a < b for (a,b) in zip(embedding[m],embedding[k])):
-            edges.append((m,k))
-    for (m,k) in product(collectives,collectives):
-        if all(a < b for (a,b) in zip(embedding[m],embedding[k])):
-            edges.append((m,k))
-
-    return edges
-    
+    return (chain, edges)
+
+
+# Which events of rank r play each role in its edges, as boolean masks over the events
+def event_roles(events, kinds, r):
+    kind = events['kind']
+    starts = np.array([k != None and k[-5:] == "Start" for k in kinds], dtype = bool)
+    ends = np.array([k != None and k[-3:] == "End" for k in kinds], dtype = bool)
+    return {'send' : (kind == 0) & (events['source'] == r),
+            'recieve' : (kind == 0) & (events['dest'] == r),
+            'collectives' : kind > 0,
+            'starts' : starts[kind],
+            'ends' : ends[kind]}
+
+
+# The largest message number sent to each peer, in order of the peers' first send
+def send_counts(events, roles):
+    count = {}
+    send = roles['send']
+    for (v,idx) in zip(events['dest'][send].tolist(), events['index'][send].tolist()):
+        count[v] = max(count.get(v,-1),idx)
+    return count
+
+
+# Edges from recieve to send, recieve to collective start, collective end to send and between collectives
+EDGE_ROLES = [('recieve', 'send'), ('recieve', 'starts'), ('ends', 'send'), ('collectives', 'collectives')]
+
+
+# The temporal edges (m,k) as lists of event ids, for m among sources and k among targets (arrays of event ids)
+# Events that are missing from a run (or repeated within one) do not fit the positions matrix; they are
+# compared with the original zip semantics instead, which keeps the edge set unchanged
+def temporal_edges(positions, ragged, roles, sources, targets):
+    found = ([], [])
+    uneven = np.fromiter(ragged, dtype = np.int64, count = len(ragged))
+    for (source, target) in EDGE_ROLES:
+        S = sources[roles[source][sources]]
+        T = targets[roles[target][targets]]
+        (i, j) = dominance_pairs(positions, S[~np.isin(S, uneven)], T[~np.isin(T, uneven)])
+        found[0].extend(i)
+        found[1].extend(j)
+        ragged_pairs(positions, ragged, S, T, found)
+    return found
+
+
+def ragged_pairs(positions, ragged, sources, targets, found):
+    if len(ragged) == 0:
+        return
+    def embedding(m):
+        return ragged[m] if m in ragged else positions[m].tolist()
+    everything = targets.tolist()
+    uneven = [k for k in everything if k in ragged]
+    for m in sources.tolist():
+        for k in (everything if m in ragged else uneven):
+            if all( a < b for (a,b) in zip(embedding(m),embedding(k))):
+                found[0].append(m)
+                found[1].append(k)
+
+
+
+# Windowed construction of rank r for long traces
+# The events are taken in windows of window events, by their earliest position over the runs, and the edges come
+# out window by window as blocks of vertex ids, so only one window of edges is held at a time.  A window compares
+# its events with the frontier of earlier events; by default the frontier keeps every earlier event, since an
+# event that precedes a window in every run precedes all of it, and the edge set is exactly that of build_rankDAG.
+# With overlap the frontier only keeps the events whose latest position reaches within overlap events of the
+# window.  This is an approximation: it drops the edges whose ends are more than overlap events apart in every
+# run, and the roles of EDGE_ROLES do not always chain through the events in between, so the covers can lose
+# (and gain) edges
+# Returns (V, blocks): the vertex labels (the events, then chain vertices that are in no run) and a generator of
+# (sources, targets) blocks
+def build_rankWindows(dirs, r, window, overlap = None):
+    if window < 1 or (not overlap == None and overlap < 0):
+        raise ValueError('window must be positive and overlap non-negative')
+    kinds = {}
+    (events, positions, ragged) = rank_embedding([run_table(dir, r, kinds) for dir in dirs])
+    print("Total Messages", len(events))
+    kinds = kind_list(kinds)
+    roles = event_roles(events, kinds, r)
+    V = decode_messages(events, kinds)
+    chain = chain_ids(V, events, roles, r)
+    def blocks():
+        yield chain
+        yield from window_edges(positions, ragged, roles, window, overlap)
+    return (V, blocks())
+
+
+# The chain of sends from r to each peer as (sources, targets) vertex ids; chain vertices missing from every run are appended to V
+def chain_ids(V, events, roles, r):
+    send = np.flatnonzero(roles['send'])
+    ids = {(v,j) : i for (v,j,i) in zip(events['dest'][send].tolist(), events['index'][send].tolist(), send.tolist())}
+    def vertex(v, j):
+        if not (v,j) in ids:
+            ids[(v,j)] = len(V)
+            V.append((r,v,j))
+        return ids[(v,j)]
+    sources = []
+    targets = []
+    for (v,count) in send_counts(events, roles).items():
+        for j in range(count):
+            sources.append(vertex(v,j))
+            targets.append(vertex(v,j+1))
+    return (np.array(sources, dtype = np.int64), np.array(targets, dtype = np.int64))
+
+
+def window_edges(positions, ragged, roles, window, overlap):
+    if len(positions) == 0:
+        return
+    lo = np.where(positions >= 0, positions, np.iinfo(np.int32).max).min(axis = 1).astype(np.int64)
+    hi = positions.max(axis = 1).astype(np.int64)
+    # The zip comparison of ragged events does not follow their positions, so they are compared with every
+    # event in one last block instead
+    dense = np.ones(len(positions), dtype = bool)
+    dense[list(ragged)] = False
+    order = np.flatnonzero(dense)
+    order = order[np.argsort(lo[order], kind = 'stable')]
+    starts = lo[order]
+    frontier = np.zeros(0, dtype = np.int64)
+    for a in (np.unique(starts // window) * window).tolist():
+        core = np.sort(order[np.searchsorted(starts, a):np.searchsorted(starts, a + window)])
+        if not overlap == None:
+            frontier = frontier[hi[frontier] >= a - overlap]
+        (sources, targets) = temporal_edges(positions, {}, roles, np.union1d(frontier, core), core)
+        print("Window", a, "Events", len(core), "Frontier", len(frontier), "Edges", len(sources))
+        yield (np.array(sources, dtype = np.int64), np.array(targets, dtype = np.int64))
+        frontier = np.union1d(frontier, core)
+    if len(ragged) > 0:
+        found = ([], [])
+        everything = np.arange(len(positions))
+        for (source, target) in EDGE_ROLES:
+            ragged_pairs(positions, ragged, everything[roles[source]], everything[roles[target]], found)
+        print("Ragged", len(ragged), "Edges", len(found[0]))
+        yield (np.array(found[0], dtype = np.int64), np.array(found[1], dtype = np.int64))
+
+
+# Covering edges of the union of the blocks, reduced block by block: the reduction only depends on the transitive
+# closure, and the covers so far have the closure of the blocks so far, so each block is reduced together with them
+# and only the covers and one block are held at a time
+def reduce_blocks(blocks):
+    src = np.zeros(0, dtype = np.int64)
+    dst = np.zeros(0, dtype = np.int64)
+    count = 0
+    for (sources, targets) in blocks:
+        count += len(sources)
+        (vertices, local) = np.unique(np.concatenate((src, sources, dst, targets)), return_inverse = True)
+        (src, dst) = (np.concatenate((src, sources)), np.concatenate((dst, targets)))
+        keep = reduce_edges(len(vertices), local[:len(src)], local[len(src):])
+        (src, dst) = (src[keep], dst[keep])
+    print("Comparabilities", count, "Covers", len(src))
+    return (src, dst)
+
+
+# Write the blocks of build_rankWindows as write_rankDAG / write_rankCovers would write the edge list, streaming
+# the comparability DAG to DAG_rank<r>.txt block by block (through an EdgeStore for the sorted .csr)
+def write_rankBlocks(dest, r, V, blocks, covers = False, csr = False, edge_budget = 1 << 26):
+    if covers:
+        (src, dst) = reduce_blocks(blocks)
+        if csr:
+            write_graph(dest + '/covers_rank' + repr(r) + '.csr', from_edges(len(V), src, dst, V))
+            return
+        with open(dest + '/covers_rank' + repr(r) + '.txt','w') as output:
+            for (u,v) in zip(src.tolist(), dst.tolist()):
+                output.write(repr(V[u]) + '-->' + repr(V[v]) + '\n')
+        return
+
+    E = None
+    if csr:
+        E = EdgeStore(budget = edge_budget, tmpdir = dest)
+        for (sources, targets) in blocks:
+            E.add(sources, targets)
+        write_graph_stream(dest + '/DAG_rank' + repr(r) + '.csr', len(V), E.blocks(), V)
+        blocks = E.blocks()
+    else:
+        with open(dest + '/messages_rank' + repr(r) + '.txt','w') as output:
+            for v in V:
+                output.write(repr(v) + "\n")
+    count = 0
+    with open(dest + '/DAG_rank' + repr(r) +'.txt','w') as output:
+        output.write(repr(len(V)) + '\n')
+        for (sources, targets) in blocks:
+            np.savetxt(output, np.stack((sources, targets), axis = 1), fmt = '%d')
+            count += len(sources)
+    if not E == None:
+        E.close()
+    print("Total Edges", count)
+
+
+# Write the comparability DAG of rank r (messages_rank<r>.txt and DAG_rank<r>.txt) for the reduce and covers stages
+# With csr the messages go into DAG_rank<r>.csr instead; DAG_rank<r>.txt is still written as the input of reduce
+def write_rankDAG(dest, r, E, csr = False):
+    V = list(set([u for (u,v) in E] + [v for (u,v) in E]))
+    if csr:
+        ids = { v : i for (i,v) in enumerate(V)}
+        graph = from_edges(len(V), [ids[u] for (u,v) in E], [ids[v] for (u,v) in E], V)
+        write_graph(dest + '/DAG_rank' + repr(r) + '.csr', graph)
+    else:
+        with open(dest + '/messages_rank' + repr(r) + '.txt','w') as output:
+            for v in V:
+                output.write(repr(v) + "\n")
+    V = { v : repr(i) for (i,v) in enumerate(V)}
+
+    with open(dest + '/DAG_rank' + repr(r) +'.txt','w') as output:
+        output.write(repr(len(V)) + '\n')
+        for (u,v) in E:
+            output.write(V[u] + " " + V[v] + "\n")
+
+
+# Write only the covering edges of rank r, in the covers_rank<r>.txt (or with csr covers_rank<r>.csr) form produced by covers.py
+# The comparability DAG is reduced in memory, so the reduce and covers stages are not needed for this rank
+def write_rankCovers(dest, r, E, csr = False):
+    V = list(set([u for (u,v) in E] + [v for (u,v) in E]))
+    ids = { v : i for (i,v) in enumerate(V)}
+    covers = transitive_reduction(len(V), [(ids[u],ids[v]) for (u,v) in E])
+    print("Comparabilities", len(E), "Covers", len(covers))
+    if csr:
+        write_graph(dest + '/covers_rank' + repr(r) + '.csr', from_edges(len(V), [u for (u,v) in covers], [v for (u,v) in covers], V))
+        return
+    with open(dest + '/covers_rank' + repr(r) + '.txt','w') as output:
+        for (u,v) in covers:
+            output.write(repr(V[u]) + '-->' + repr(V[v]) + '\n')
+
+
+# Archives of traces in root (see traces.py; the containers written next to archives are not runs themselves)
+def run_archives(root):
+    root = root.rstrip('/') + '/'
+    entries = os.listdir(root)
+    return [root + d for d in entries if d.endswith(ARCHIVE_SUFFIXES) and os.path.isfile(root + d)
+            and not (d.endswith(CONTAINER_SUFFIX) and d[:-len(CONTAINER_SUFFIX)] in entries)]
+
+
+# Run directories under root: every subdirectory except the destination directory, and the runs inside every
+# archive of traces in root
+# With require the containers of the archives must have been built already (traces.py on the archive, or
+# pipeline.py), as in the per-rank jobs, which would otherwise all wait for one of them to build each container
+def run_dirs(root, dest, require = False):
+    root = root.rstrip('/') + '/'
+    archives = set(run_archives(root))
+    dirs = []
+    for d in os.listdir(root):
+        if os.path.isdir(root + d):
+            if not d == dest.strip('/'):
+                dirs.append(root + d)
+        elif root + d in archives:
+            if require and not container_fresh(root + d):
+                print('No up to date container for', root + d, '(run traces.py', root + d + ')')
+                raise Exception('UnknownContainer')
+            dirs.extend(archive_runs(root + d))
+    return dirs
+
+
+# Build rank r and write either its comparability DAG or, with covers, its covering edges into dest
+# With state the rank state is also saved in dest, so that runs can be added later with add_rank
+# With window the rank is built in windows of that many events (see build_rankWindows), exactly unless overlap is given
+def build_rank(dirs, r, dest, covers = False, csr = False, state = False, window = None, overlap = None):
+    if not window == None:
+        if state:
+            raise ValueError('a rank built in windows has no rank state')
+        (V, blocks) = build_rankWindows(dirs, r, window, overlap)
+        write_rankBlocks(dest, r, V, blocks, covers = covers, csr = csr)
+        return
+    if state:
+        S = build_rankState(dirs, r)
+        save_rankState(dest, r, S)
+        E = state_edges(S)
+    else:
+        E = build_rankDAG(dirs,r)
+    write_rank(dest, r, E, covers = covers, csr = csr)
+
+
+def write_rank(dest, r, E, covers = False, csr = False):
+    if covers:
+        write_rankCovers(dest, r, E, csr = csr)
+    else:
+        write_rankDAG(dest, r, E, csr = csr)
+
+
+# Persistent state of rank r for adding runs incrementally (dest/state_rank<r>.npz)
+#    events, kinds -- the events of the rank, encoded as in csr.encode_messages
+#    positions -- (events x runs) position of each event in each run, -1 where it is missing
+#    ragged -- the events missing from a run or repeated within one (see rank_embedding)
+#    sources, targets, fixed -- the current edges as event ids; fixed marks the chain of sends, which no run removes
+#    runs -- the data directories folded into the state
+# The events end with the vertices of the chain of sends that are in no run (missing from every run, not ragged)
+# A run can only remove edges, since an edge needs dominance in every coordinate of the embedding
+def state_path(dest, r):
+    return dest + '/state_rank' + repr(r) + '.npz'
+
+
+def build_rankState(dirs, r):
+    kinds = {}
+    (events, positions, ragged) = rank_embedding([run_table(dir, r, kinds) for dir in dirs])
+    print("Total Messages", len(events))
+    kinds = kind_list(kinds)
+    roles = event_roles(events, kinds, r)
+    V = decode_messages(events, kinds)
+    chain = chain_ids(V, events, roles, r)
+    everything = np.arange(len(events))
+    edges = temporal_edges(positions, ragged, roles, everything, everything)
+    # Chain vertices that are in no run become events missing from every run
+    extra = np.array([(0,) + m for m in V[len(events):]], dtype = np.int64).reshape(-1, 4)
+    missing = np.zeros(len(extra), dtype = MESSAGE_DTYPE)
+    for (field, column) in zip(MESSAGE_DTYPE.names, extra.T):
+        missing[field] = column
+    fixed = np.zeros(len(chain[0]) + len(edges[0]), dtype = bool)
+    fixed[:len(chain[0])] = True
+    uneven = np.zeros(len(V), dtype = bool)
+    uneven[list(ragged)] = True
+    return {'events' : np.concatenate((events, missing)),
+            'kinds' : np.array(kinds[1:], dtype = str),
+            'positions' : np.concatenate((positions, np.full((len(missing), len(dirs)), -1, dtype = positions.dtype))),
+            'ragged' : uneven,
+            'sources' : np.concatenate((chain[0], np.array(edges[0], dtype = np.int64))),
+            'targets' : np.concatenate((chain[1], np.array(edges[1], dtype = np.int64))),
+            'fixed' : fixed,
+            'runs' : np.array(dirs, dtype = str)}
+
+
+def save_rankState(dest, r, state):
+    filename = state_path(dest, r)
+    tmp = filename + '.' + repr(os.getpid()) + '.npz'
+    np.savez(tmp, **state)
+    os.replace(tmp, filename)
+
+
+def load_rankState(dest, r):
+    with np.load(state_path(dest, r)) as state:
+        return {key : state[key] for key in state.files}
+
+
+# The edges of a rank state as a list of (message_info, message_info) for write_rankDAG / write_rankCovers
+def state_edges(state):
+    events = decode_messages(state['events'], [None] + state['kinds'].tolist())
+    return [(events[u],events[v]) for (u,v) in zip(state['sources'].tolist(), state['targets'].tolist())]
+
+
+# Fold the run in dir into the state of rank r by pruning the edges (m,k) with m not before k in that run
+# This is the edge set of a rebuild only when every event of the rank is in every run exactly once: ragged
+# events are compared over all their occurrences at once (see temporal_edges), so a state with ragged events,
+# or a run that misses or repeats an event of the state or has events that are not in it, raises ValueError
+# and the rank has to be rebuilt from every run (as add_rank does)
+def add_rankRun(state, dir, r):
+    if dir in state['runs'].tolist():
+        print(dir, "is already in the state")
+        return state
+    # States saved without ragged only know the events missing from some but not all runs
+    positions = state['positions']
+    ragged = state['ragged'] if 'ragged' in state else (positions < 0).any(axis = 1) & (positions >= 0).any(axis = 1)
+    if ragged.any():
+        raise ValueError('rank ' + repr(r) + ' has ' + repr(int(ragged.sum())) + ' events missing from a run or repeated within one')
+    events = decode_messages(state['events'], [None] + state['kinds'].tolist())
+    ids = {m : i for (i,m) in enumerate(events)}
+    column = np.full(len(events), -1, dtype = np.int64)
+    count = np.zeros(len(events), dtype = np.int64)
+    new = 0
+    for (i,m) in enumerate(run_events(dir, r)):
+        if not m in ids:
+            new += 1
+            continue
+        count[ids[m]] += 1
+        if column[ids[m]] == -1:
+            column[ids[m]] = i
+    # Chain vertices that are in no earlier run are new to the embedding as well
+    seen = (positions >= 0).all(axis = 1)
+    new += int(count[~seen].sum())
+    if new > 0:
+        raise ValueError('run ' + dir + ' has ' + repr(new) + ' events of rank ' + repr(r) + ' that are not in its state')
+    uneven = int((count[seen] != 1).sum())
+    if uneven > 0:
+        raise ValueError('run ' + dir + ' misses or repeats ' + repr(uneven) + ' events of rank ' + repr(r))
+    before = column[state['sources']]
+    after = column[state['targets']]
+    keep = state['fixed'] | (before < after)
+    print("Edges", len(keep), "Pruned", len(keep) - int(keep.sum()))
+    state = dict(state)
+    state['positions'] = np.concatenate((state['positions'], column[:,None]), axis = 1)
+    for key in ('sources', 'targets', 'fixed'):
+        state[key] = state[key][keep]
+    state['runs'] = np.append(state['runs'], dir)
+    return state
+
+
+# Add the run in dir to the saved state of rank r and rewrite its comparability DAG or covers
+# Runs that cannot be folded into the state by pruning (see add_rankRun) rebuild the rank from every run
+def add_rank(dir, r, dest, covers = False, csr = False):
+    if not os.path.exists(state_path(dest, r)):
+        print('No state for rank', r, 'in', dest)
+        raise Exception('UnknownState')
+    state = load_rankState(dest, r)
+    try:
+        state = add_rankRun(state, dir, r)
+    except ValueError as E:
+        print(E.__class__.__name__, E)
+        print("Rebuilding rank", r, "from every run")
+        state = build_rankState(state['runs'].tolist() + [dir], r)
+    save_rankState(dest, r, state)
+    write_rank(dest, r, state_edges(state), covers = covers, csr = csr)
+
+
+# Messages and edges of a rank's covers, from covers_rank<r>.txt or covers_rank<r>.csr
+# Messages are the repr strings written by covers.py; edges are returned as arrays of ids[message]
+def read_rankMessages(filename):
+    if filename[-4:] == '.csr':
+        graph = read_graph(filename)
+        (sources, targets) = graph.edges()
+        used = np.bincount(np.concatenate((sources, targets)), minlength = graph.num_vertices) > 0
+        return set([repr(m) for (m,u) in zip(graph.message_list(), used.tolist()) if u])
+    messages = set()
+    with open(filename,'r') as input:
+        for line in input:
+            messages.update(line.rstrip().split('-->'))
+    return messages
+
+
+def read_rankEdges(filename, ids):
+    if filename[-4:] == '.csr':
+        graph = read_graph(filename)
+        # Vertices without edges are not interned by read_rankMessages, only edge endpoints have to be known
+        M = graph.message_list()
+        local = np.array([ids.get(repr(m), -1) for m in M], dtype = np.int64)
+        (sources, targets) = graph.edges()
+        unknown = np.concatenate((sources[local[sources] < 0], targets[local[targets] < 0]))
+        if len(unknown) > 0:
+            raise ValueError(filename + ' has edges on unknown message ' + repr(M[unknown[0]]))
+        return (local[sources], local[targets])
+    sources = []
+    targets = []
+    with open(filename,'r') as input:
+        for line in input:
+            (u,v) = line.rstrip().split('-->')
+            sources.append(ids[u])
+            targets.append(ids[v])
+    return (np.array(sources, dtype = np.int64), np.array(targets, dtype = np.int64))
+
+
+# The covers_rank*.txt / covers_rank*.csr files in dest
+def rank_files(dest):
+    files = []
+    for file in sorted(os.listdir(dest)):
+        # Check if it is the right type of file.
+        if len(file) < 11:
+            continue
+        if not file[-4:] in ('.txt', '.csr'):
+            continue
+        if not file[:11] == 'covers_rank':
+            continue
+        files.append(file)
+    return files
+
+
+# Merge the covers_rank*.txt / covers_rank*.csr files in dest into messages.txt and DAG.txt
+# With csr the merged graph and its messages are written to DAG.csr, and DAG.txt only as the input of the reducers
+# The rank files are streamed twice: first to intern every message (the vertex ids are the position of the
+# message in messages.txt), then to collect the edges as integer pairs in a deduplicating EdgeStore that
+# spills sorted runs to disk once it holds more than edge_budget edges
+def build_DAG(dest, csr = False, edge_budget = 1 << 26):
+    files = rank_files(dest)
+
+    mapping = set([])
+    for file in files:
+        mapping.update(read_rankMessages(dest + '/' + file))
+    print("Total Messages", len(mapping))
+    mapping = [(m.lstrip('(').split(',')[:2], int(m.rstrip(')').split(',')[-1]), m) for m in mapping]
+    mapping.sort(reverse = True)
+    mapping = [m for (pair, idx, m) in mapping]
+    if not csr:
+        with open(dest + '/messages.txt','w') as output:
+            for v in mapping:
+                output.write(v + '\n')
+    ids = {m : i for (i,m) in enumerate(mapping)}
+
+    E = EdgeStore(budget = edge_budget, tmpdir = dest)
+    for file in files:
+        rank = file.split('.')[0][11:]
+        (sources, targets) = read_rankEdges(dest + '/' + file, ids)
+        E.add(sources, targets)
+        print("Rank", rank)
+        print("\t Edges", len(sources))
+        print("\t Total Edges (with duplicates)", E.count)
+    print("Completed Building DAG")
+
+    if csr:
+        messages = [literal_eval(m) for m in mapping]
+        del ids, mapping
+        write_graph_stream(dest + '/DAG.csr', len(messages), E.blocks(), messages)
+        num_vertices = len(messages)
+        del messages
+    else:
+        num_vertices = len(mapping)
+        del ids, mapping
+    count = 0
+    with open(dest + '/DAG.txt','w') as output:
+        output.write(repr(num_vertices) + "\n")
+        for (sources, targets) in E.blocks():
+            np.savetxt(output, np.stack((sources, targets), axis = 1), fmt = '%d')
+            count += len(sources)
+    E.close()
+    print("Total Edges", count)
+
+
+# Global transitive reduction of the DAG merged by build_DAG, written to outfile in the layout of reduce
+# The rank covers are already reduced, so they are merged as components by transitive.reduce_components, fanin
+# neighbouring ranks at a time, rather than reducing DAG.txt from scratch; vertex ids are those of messages.txt
+# (or DAG.csr with csr), so covers.py reads the result as it reads the output of reduce
+def reduce_ranks(dest, outfile, csr = False, fanin = 8, workers = 1, memory = 1 << 28):
+    if csr:
+        messages = [repr(m) for m in read_graph(dest + '/DAG.csr').message_list()]
+    else:
+        with open(dest + '/messages.txt','r') as input:
+            messages = [line.rstrip('\n') for line in input]
+    ids = {m : i for (i,m) in enumerate(messages)}
+    files = sorted(rank_files(dest), key = lambda file: int(file.split('.')[0][11:]))
+    components = [read_rankEdges(dest + '/' + file, ids) for file in files]
+    del ids
+    (sources, targets) = reduce_components(components, fanin = fanin, workers = workers, memory = memory)
+    write_reduction(outfile, len(messages), sources, targets, np.ones(len(sources), dtype = bool))
+    print("Total Covers", len(sources))
 
 
 if __name__ == '__main__':
@@ -260,6 +844,15 @@ if __name__ == '__main__':
     parser.add_argument('--rank',  default = argparse.SUPPRESS, type = int, help ='Indicates the rank that is currently being processed.  If not present, this assumes that all rank covers have been produced and this will build the final DAG')
     parser.add_argument('--dest', default = '/MPICovers')
     parser.add_argument('--reduce', default = '/reduction')
+    parser.add_argument('--csr', action = 'store_true', help = 'Write messages and graphs in the binary CSR format (see csr.py) instead of text')
+    parser.add_argument('--edge-budget', type = int, default = 1 << 26, help = 'Without --rank, number of edges held in memory before sorted runs are spilled to disk')
+    parser.add_argument('--covers', action = 'store_true', help = 'With --rank, write covers_rank<rank>.txt directly instead of the comparability DAG for the reduce and covers stages')
+    parser.add_argument('--state', action = 'store_true', help = 'With --rank, also save the rank state (state_rank<rank>.npz) so that runs can be added with --add-run')
+    parser.add_argument('--add-run', default = None, help = 'With --rank, fold this run directory into the saved rank state by pruning edges, instead of rebuilding the rank from every run')
+    parser.add_argument('--hierarchical', action = 'store_true', help = 'Without --rank, also reduce the merged DAG into reducedDAG.dot by merging the rank covers up a tree (instead of reduce / reduceMPI on DAG.txt)')
+    parser.add_argument('--fanin', type = int, default = 8, help = 'With --hierarchical, rank covers merged at a time')
+    parser.add_argument('--window', type = int, default = None, help = 'With --rank, build the rank in windows of this many events, writing the edges window by window')
+    parser.add_argument('--overlap', type = int, default = None, help = 'With --window, only compare each window with this many events back; an approximation that can change the covers (default: every earlier event, exact)')
 
     args = vars(parser.parse_args())
     print(args)
@@ -267,59 +860,20 @@ if __name__ == '__main__':
 
     root = args['rootdir'].rstrip('/') + '/'
     print(root)
-    dirs = os.listdir(root)
-    dirs = [d for d in dirs if os.path.isdir(root + d)]
-    dirs = [d for d in dirs if not d == args['dest'].rstrip('/')]
-    dirs = [root +d for d in dirs]
+    # The final merge only reads the rank covers in dest, so the runs are only listed for the ranks
+    if 'rank' in args and args['add_run'] == None:
+        dirs = run_dirs(root, args['dest'], require = True)
     if 'rank' not in args:
         print('Building DAG from individual ranks')
         if not os.path.isdir(root + args['dest']):
             print('Destination directory', args['dest'], 'does not exist')
             raise Exception('UnknownDestination')
-        mapping = set([])
-        E = set([])
-        count = 0
-        for file in os.listdir(root + args['dest']):
-            # Check if it is the right type of file.
-            if len(file) < 11:
-                continue
-            if not file[-4:] == '.txt':
-                continue
-            if not file[:11] == 'covers_rank':
-                continue
-            rank = file.split('.')[0][11:]
-            with open(root + args['dest'] + '/' + file,'r') as input:
-                rankE = [tuple(line.rstrip().split('-->')) for line in input]
-
-            for (u,v) in rankE:
-                if not u in mapping:
-                    mapping.add(u)
-                if not v in mapping:
-                    mapping.add(v)
-            E.update(rankE)
-
-            print("Rank", rank)
-            print("\t Edges", len(rankE))
-            print("\t Total Edges", len(E))
-            print("\t Total Messages", len(mapping))
-        print("Completed Building DAG")
-
-        print(mapping)
-        mapping = [(m.lstrip('(').split(',')[:2], int(m.rstrip(')').split(',')[-1]), m) for m in mapping]
-        mapping.sort(reverse = True)
-        mapping = [m for (pair, idx, m) in mapping]
-        print(mapping)
-        with open(root + args['dest'] + '/messages.txt','w') as output:
-            for v in mapping:
-                output.write(v + '\n')
-        mapping = {m : repr(i) for (i,m) in enumerate(mapping)}
-        with open(root + args['dest'] + '/DAG.txt','w') as output:
-            output.write(repr(len(mapping)) + "\n")
-            for (u,v) in E:
-                output.write(mapping[u] + ' ' + mapping[v] + '\n')
-        
-            
-            
+        build_DAG(root + args['dest'], csr = args['csr'], edge_budget = args['edge_budget'])
+        if args['hierarchical']:
+            reduce_ranks(root + args['dest'], root + args['dest'] + '/reducedDAG.dot', csr = args['csr'], fanin = args['fanin'])
+    elif not args['add_run'] == None:
+        print('Adding run', args['add_run'], 'to rank', args['rank'])
+        add_rank(args['add_run'].rstrip('/'), args['rank'], root + args['dest'], covers = args['covers'], csr = args['csr'])
     elif args['rank'] == 0:
         print('Creating directory if needed')
         if not os.path.isdir(root + args['dest']):
@@ -328,17 +882,7 @@ if __name__ == '__main__':
             os.mkdir(root + args['dest'] + args['reduce'])
             
         print('Building rank 0 covers')
-        E = build_rankDAG(dirs,0)
-        V = list(set([u for (u,v) in E] + [v for (u,v) in E]))
-        with open(root + args['dest'] + '/messages_rank0.txt','w') as output:
-            for v in V:
-                output.write(repr(v) + "\n")
-        V = { v : repr(i) for (i,v) in enumerate(V)}
-        
-        with open(root + args['dest'] + '/DAG_rank0.txt','w') as output:
-            output.write(repr(len(V)) + '\n')
-            for (u,v) in E:
-                output.write(V[u] + " " + V[v] + "\n")
+        build_rank(dirs, 0, root + args['dest'], covers = args['covers'], csr = args['csr'], state = args['state'], window = args['window'], overlap = args['overlap'])
     else:
         print('Building rank', args['rank'], 'covers')
         # Wait 2 minutes for the directory to be created
@@ -351,24 +895,4 @@ if __name__ == '__main__':
             # Directory doesn't exist and not created
             print('Destination directory', args['dest'], 'does not exist and was not created')
             raise Exception('UnknownDestination')
-        E = build_rankDAG(dirs,args['rank'])
-        V = list(set([u for (u,v) in E] + [v for (u,v) in E]))
-        with open(root + args['dest'] + '/messages_rank' + repr(args['rank']) + '.txt','w') as output:
-            for v in V:
-                output.write(repr(v) + "\n")
-        V = { v : repr(i) for (i,v) in enumerate(V)}
-        
-        with open(root + args['dest'] + '/DAG_rank' + repr(args['rank']) +'.txt','w') as output:
-            output.write(repr(len(V)) + '\n')
-            for (u,v) in E:
-                output.write(V[u] + " " + V[v] + "\n")
-
-            
-     
-    
-            
-        
-    
-    
- 
-            
+        build_rank(dirs, args['rank'], root + args['dest'], covers = args['covers'], csr = args['csr'], state = args['state'], window = args['window'], overlap = args['overlap'])
@@ -0,0 +1,54 @@
+import os
+import random
+import pytest
+
+
+# Synthetic MPI traces in the trace_MPI<op>_<rank>.ct layout: every iteration each rank sends to its neighbours,
+# the messages are recieved in a shuffled order, then the ranks meet in an Allreduce, a Bcast and a Sendrecv
+def write_runs(root, ranks = 6, runs = 3, iterations = 4, seed = 0):
+    rnd = random.Random(seed)
+    dirs = []
+    for run in range(runs):
+        dir = os.path.join(str(root), 'run' + repr(run))
+        os.makedirs(dir, exist_ok = True)
+        dirs.append(dir)
+        files = {}
+        def write(op, r, fields):
+            files.setdefault((op, r), []).append(fields)
+        t = [1600000000000000000 + rnd.randint(0, 1000) for r in range(ranks)]
+        sent = [0]*ranks
+        for iteration in range(iterations):
+            pending = []
+            for r in range(ranks):
+                for v in ((r+1) % ranks, (r-1) % ranks) + ((r+2) % ranks,)*(iteration % 2):
+                    t[r] += rnd.randint(10, 500)
+                    end = t[r] + rnd.randint(1, 50)
+                    write('Send', r, (77, r, v, 1024, sent[r], t[r], end))
+                    pending.append((r, v, sent[r], end))
+                    sent[r] += 1
+            rnd.shuffle(pending)
+            for (s, v, i, end) in pending:
+                t[v] = max(t[v], end) + rnd.randint(10, 500)
+                write('Recv', v, (78, s, v, 1024, i, t[v] - rnd.randint(1, 9), t[v]))
+            for op in ('Allreduce', 'Bcast', 'Sendrecv'):
+                if op == 'Bcast' and iteration % 2:
+                    continue
+                meet = max(t) + rnd.randint(10, 500)
+                for r in range(ranks):
+                    start = t[r] + rnd.randint(1, 99)
+                    if op == 'Sendrecv':
+                        t[r] = start + rnd.randint(1, 99)
+                        write(op, r, (79, (r+1) % ranks, (r-1) % ranks, 8, iteration, start, t[r]))
+                    else:
+                        write(op, r, (80, 0 if op == 'Bcast' else r, -1, 8, iteration, start, meet + rnd.randint(1, 99)))
+                        t[r] = meet + 100
+        for ((op, r), lines) in files.items():
+            with open(os.path.join(dir, 'trace_MPI' + op + '_' + repr(r) + '.ct'), 'w') as output:
+                for fields in lines:
+                    output.write(','.join(map(str, fields)) + ',\n')
+    return dirs
+
+
+@pytest.fixture
+def runs(tmp_path):
+    return lambda **options: write_runs(tmp_path, **options)
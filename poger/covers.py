@@ -34,15 +34,28 @@
 #############################################################################
 
 import sys
+import csr
 
-if __name__ == '__main__':
-    dot_graph = sys.argv[1]
-    messages = sys.argv[2]
-    outfile = sys.argv[3]
-
-    print("DOT Graph:", dot_graph)
-    print("Message Lst:", messages)
-    print("Output File:", outfile)
+# Translate a DOT graph over message ids (output of reduce / reduction_merge.py) back into
+# message names, one "message-->message" line per edge
+# The graph and the message list may also be binary CSR files (see csr.py), e.g. DAG_rank<r>.csr
+# whose message table names the vertices; an outfile ending in .csr is written as a CSR graph
+def map_covers(dot_graph, messages, outfile):
+    if dot_graph[-4:] == '.csr' or messages[-4:] == '.csr' or outfile[-4:] == '.csr':
+        if messages[-4:] == '.csr':
+            M = csr.read_graph(messages).message_list()
+        else:
+            M = csr.read_messages(messages)
+        if dot_graph[-4:] == '.csr':
+            graph = csr.read_graph(dot_graph)
+            graph = csr.Graph(graph.num_vertices, graph.offsets, graph.targets, *csr.encode_messages(M))
+        else:
+            graph = csr.read_dot(dot_graph, M)
+        if outfile[-4:] == '.csr':
+            csr.write_graph(outfile, graph)
+        else:
+            csr.write_covers(graph, outfile)
+        return
 
     with open(messages,'r') as input:
         M = [line.rstrip() for line in input]
@@ -61,5 +74,15 @@ if __name__ == '__main__':
                     continue
                 (u,v) = list(map(int,nodes))
                 output.write(M[u] + '-->' + M[v] + '\n')
-        
-            
+
+
+if __name__ == '__main__':
+    dot_graph = sys.argv[1]
+    messages = sys.argv[2]
+    outfile = sys.argv[3]
+
+    print("DOT Graph:", dot_graph)
+    print("Message Lst:", messages)
+    print("Output File:", outfile)
+
+    map_covers(dot_graph, messages, outfile)
@@ -0,0 +1,390 @@
+#############################################################################
+##                               FENATE                                    ##  
+##          Copyright © 2021, Battelle Memorial Institute                  ##
+##                                                                         ##
+## 1. Battelle Memorial Institute (hereinafter Battelle) hereby grants     ##
+##  permission to any person or entity lawfully obtaining a copy of this   ##
+##  software and associated documentation files (hereinafter               ##
+##  “the Software”) to redistribute and use the Software in source and     ##
+##  binary forms, with or without modification.  Such person or entity may ##
+##  use, copy, modify, merge, publish, distribute, sublicense, and/or sell ##
+##  copies of the Software, and may permit others to do so, subject to the ##
+##  following conditions:                                                  ##
+##  • Redistributions of source code must retain the above copyright       ##
+##    notice, this list of conditions and the following disclaimers.       ##
+##  • Redistributions in binary form must reproduce the above copyright    ##
+##    notice, this list of conditions and the following disclaimer in      ##
+##    the documentation and/or other materials provided with the           ##
+##    distribution.                                                        ##
+##  • Other than as used herein, neither the name Battelle Memorial        ##
+##    Institute or Battelle may be used in any form whatsoever without     ##
+##    the express written consent of Battelle.                             ##
+## 2. THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS  ##
+##  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT      ##
+##  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS      ##
+##  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL BATTELLE    ##
+##  OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,        ##
+##  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT       ##
+##  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,  ##
+##  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON      ##
+##  ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR     ##
+##  TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF     ##
+##  THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF        ##
+##  SUCH DAMAGE.                                                           ##
+#############################################################################
+
+# Binary CSR graph interchange format for the poger stages
+#
+# A .csr file is a 64 byte header followed by 8 byte aligned little-endian arrays, so every array
+# can be memory-mapped in place:
+#    header -- magic, format version, flags, number of vertices, number of edges, size of kind table
+#    kinds -- JSON list of the collective labels used by the message table (padded to 8 bytes)
+#    offsets -- int64[num_vertices+1], successors of v are targets[offsets[v]:offsets[v+1]]
+#    targets -- int64[num_edges]
+#    messages -- MESSAGE_DTYPE[num_vertices], present when flags & HAS_MESSAGES
+#
+# Messages are the vertex labels of the rank DAGs: (sender, recipient, index) for point to point
+# messages, or (label, peer, index) for collectives, where label (e.g. "AllReduceStart") is stored
+# as its position in the kind table and kind 0 means point to point.
+
+import os
+import re
+import json
+import tempfile
+import warnings
+from ast import literal_eval
+import numpy as np
+
+MAGIC = b'POGERCSR'
+VERSION = 1
+HAS_MESSAGES = 1
+HEADER_DTYPE = np.dtype([('magic', 'S8'),
+                         ('version', '<u4'),
+                         ('flags', '<u4'),
+                         ('num_vertices', '<i8'),
+                         ('num_edges', '<i8'),
+                         ('kinds_size', '<i8'),
+                         ('reserved', '<i8', (3,))])
+MESSAGE_DTYPE = np.dtype([('kind', '<i8'),
+                          ('source', '<i8'),
+                          ('dest', '<i8'),
+                          ('index', '<i8')])
+
+
+class Graph():
+    def __init__(self, num_vertices, offsets, targets, messages = None, kinds = None):
+        self.num_vertices = num_vertices
+        self.offsets = offsets
+        self.targets = targets
+        self.messages = messages # MESSAGE_DTYPE table or None
+        self.kinds = kinds if not kinds is None else [None]
+
+    def num_edges(self):
+        return len(self.targets)
+
+    def successors(self, v):
+        return self.targets[self.offsets[v]:self.offsets[v+1]]
+
+    # Edge list as a pair of arrays (sources, targets)
+    def edges(self):
+        return (np.repeat(np.arange(self.num_vertices, dtype = np.int64), np.diff(self.offsets)), np.asarray(self.targets))
+
+    # Vertex labels as message tuples
+    def message_list(self):
+        return decode_messages(self.messages, self.kinds)
+
+
+# Build a CSR graph from parallel source/target arrays; duplicate edges are removed
+def from_edges(num_vertices, sources, targets, messages = None):
+    sources = np.asarray(sources, dtype = np.int64)
+    targets = np.asarray(targets, dtype = np.int64)
+    if len(sources) > 0:
+        edges = np.unique(np.stack((sources, targets), axis = 1), axis = 0)
+        (sources, targets) = (edges[:,0], edges[:,1])
+    offsets = np.zeros(num_vertices + 1, dtype = np.int64)
+    np.cumsum(np.bincount(sources, minlength = num_vertices), out = offsets[1:])
+    kinds = None
+    if not messages is None:
+        (messages, kinds) = encode_messages(messages)
+    return Graph(num_vertices, offsets, np.ascontiguousarray(targets), messages, kinds)
+
+
+def encode_messages(messages):
+    kinds = [None]
+    kind = {}
+    table = np.empty(len(messages), dtype = MESSAGE_DTYPE)
+    for (i,(source,dest,idx)) in enumerate(messages):
+        if isinstance(source, str):
+            if not source in kind:
+                kind[source] = len(kinds)
+                kinds.append(source)
+            table[i] = (kind[source], -1, dest, idx)
+        else:
+            table[i] = (0, source, dest, idx)
+    return (table, kinds)
+
+
+def decode_messages(table, kinds):
+    return [(kinds[k], d, i) if k > 0 else (s, d, i) for (k,s,d,i) in
+            zip(table['kind'].tolist(), table['source'].tolist(), table['dest'].tolist(), table['index'].tolist())]
+
+
+def write_graph(filename, graph):
+    kinds = json.dumps(graph.kinds[1:]).encode()
+    kinds += b' '*(-len(kinds) % 8)
+    header = np.zeros(1, dtype = HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['flags'] = HAS_MESSAGES if not graph.messages is None else 0
+    header['num_vertices'] = graph.num_vertices
+    header['num_edges'] = graph.num_edges()
+    header['kinds_size'] = len(kinds)
+    with open(filename, 'wb') as output:
+        output.write(header.tobytes())
+        output.write(kinds)
+        output.write(np.ascontiguousarray(graph.offsets, dtype = '<i8').tobytes())
+        output.write(np.ascontiguousarray(graph.targets, dtype = '<i8').tobytes())
+        if not graph.messages is None:
+            output.write(np.ascontiguousarray(graph.messages, dtype = MESSAGE_DTYPE).tobytes())
+
+
+# Write a CSR graph whose edges arrive as blocks of (sources, targets) sorted by source, e.g. from
+# EdgeStore.blocks(), without holding the whole edge list; offsets are filled in once all edges are seen
+def write_graph_stream(filename, num_vertices, blocks, messages = None):
+    kinds = [None]
+    if not messages is None:
+        (messages, kinds) = encode_messages(messages)
+    kinds_json = json.dumps(kinds[1:]).encode()
+    kinds_json += b' '*(-len(kinds_json) % 8)
+    header = np.zeros(1, dtype = HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['flags'] = HAS_MESSAGES if not messages is None else 0
+    header['num_vertices'] = num_vertices
+    header['kinds_size'] = len(kinds_json)
+    degree = np.zeros(num_vertices, dtype = np.int64)
+    offsets_at = HEADER_DTYPE.itemsize + len(kinds_json)
+    with open(filename, 'wb') as output:
+        output.write(header.tobytes())
+        output.write(kinds_json)
+        output.seek(offsets_at + 8*(num_vertices + 1))
+        for (sources, targets) in blocks:
+            degree += np.bincount(sources, minlength = num_vertices)
+            output.write(np.ascontiguousarray(targets, dtype = '<i8').tobytes())
+        if not messages is None:
+            output.write(messages.astype(MESSAGE_DTYPE).tobytes())
+        offsets = np.zeros(num_vertices + 1, dtype = '<i8')
+        np.cumsum(degree, out = offsets[1:])
+        header['num_edges'] = offsets[-1]
+        output.seek(0)
+        output.write(header.tobytes())
+        output.seek(offsets_at)
+        output.write(offsets.tobytes())
+
+
+# Deduplicated, array-backed edge storage for graphs too large to hold as Python tuples
+# Edges are packed into uint64 keys (source << 32 | target), so vertex ids must lie in [0, 2**32); add() raises
+# ValueError on any other id instead of silently merging edges.  Once more than budget keys are buffered
+# they are sorted, deduplicated and spilled to a run file in tmpdir; blocks() then merges the runs.
+class EdgeStore():
+    def __init__(self, budget = 1 << 26, tmpdir = None):
+        self.budget = budget
+        self.tmpdir = tmpdir
+        self.buffer = []
+        self.buffered = 0
+        self.runs = []
+        self.count = 0 # edges added, including duplicates
+        self.own_tmpdir = False
+
+    def add(self, sources, targets):
+        sources = np.asarray(sources, dtype = np.int64)
+        targets = np.asarray(targets, dtype = np.int64)
+        for ids in (sources, targets):
+            if len(ids) > 0 and (ids.min() < 0 or ids.max() >= 1 << 32):
+                raise ValueError('EdgeStore vertex ids must be in [0, 2**32), got ' + repr(int(ids.min())) + '..' + repr(int(ids.max())))
+        keys = (sources.astype(np.uint64) << np.uint64(32)) | targets.astype(np.uint64)
+        self.buffer.append(keys)
+        self.buffered += len(keys)
+        self.count += len(keys)
+        if self.buffered > self.budget:
+            self.spill()
+
+    def spill(self):
+        if self.tmpdir == None:
+            self.tmpdir = tempfile.mkdtemp()
+            self.own_tmpdir = True
+        (handle, filename) = tempfile.mkstemp(suffix = '.npy', dir = self.tmpdir)
+        with os.fdopen(handle, 'wb') as output:
+            np.save(output, np.unique(np.concatenate(self.buffer)))
+        self.runs.append(filename)
+        self.buffer = []
+        self.buffered = 0
+
+    # Sorted, deduplicated edges as blocks of (sources, targets)
+    def blocks(self, block_size = 1 << 20):
+        if len(self.runs) == 0:
+            keys = np.unique(np.concatenate(self.buffer)) if len(self.buffer) > 0 else np.empty(0, dtype = np.uint64)
+            for i in range(0, len(keys), block_size):
+                yield split_keys(keys[i:i+block_size])
+            return
+        if self.buffered > 0:
+            self.spill()
+        # k-way merge: every round emits all keys up to the smallest last key among the buffered
+        # blocks of unfinished runs, so memory is bounded by one block per run
+        runs = [np.load(filename, mmap_mode = 'r') for filename in self.runs]
+        position = [0]*len(runs)
+        while True:
+            heads = [np.asarray(run[p:p+block_size]) for (run,p) in zip(runs, position)]
+            live = [i for (i,head) in enumerate(heads) if len(head) > 0]
+            if len(live) == 0:
+                return
+            bound = min([heads[i][-1] for i in live if position[i] + len(heads[i]) < len(runs[i])], default = None)
+            merged = []
+            for i in live:
+                take = len(heads[i]) if bound == None else np.searchsorted(heads[i], bound, side = 'right')
+                merged.append(heads[i][:take])
+                position[i] += take
+            yield split_keys(np.unique(np.concatenate(merged)))
+
+    def close(self):
+        for filename in self.runs:
+            os.remove(filename)
+        self.runs = []
+        if self.own_tmpdir:
+            os.rmdir(self.tmpdir)
+            self.tmpdir = None
+            self.own_tmpdir = False
+
+
+def split_keys(keys):
+    return ((keys >> np.uint64(32)).astype(np.int64), (keys & np.uint64(0xFFFFFFFF)).astype(np.int64))
+
+
+# Read a .csr file; with mmap the arrays are memory-mapped read-only instead of loaded
+def read_graph(filename, mmap = True):
+    header = np.fromfile(filename, dtype = HEADER_DTYPE, count = 1)
+    if len(header) == 0 or not header['magic'][0] == MAGIC:
+        raise ValueError(filename + ' is not a poger CSR graph')
+    if header['version'][0] > VERSION:
+        raise ValueError(filename + ' has unsupported CSR version ' + repr(int(header['version'][0])))
+    n = int(header['num_vertices'][0])
+    m = int(header['num_edges'][0])
+    offset = HEADER_DTYPE.itemsize
+    with open(filename, 'rb') as input:
+        input.seek(offset)
+        kinds = [None] + json.loads(input.read(int(header['kinds_size'][0])).decode())
+    offset += int(header['kinds_size'][0])
+
+    def array(dtype, count):
+        nonlocal offset
+        if count == 0:
+            data = np.empty(0, dtype = dtype)
+        elif mmap:
+            data = np.memmap(filename, dtype = dtype, mode = 'r', offset = offset, shape = (count,))
+        else:
+            data = np.fromfile(filename, dtype = dtype, count = count, offset = offset)
+        offset += np.dtype(dtype).itemsize*count
+        return data
+
+    offsets = array('<i8', n + 1)
+    targets = array('<i8', m)
+    messages = array(MESSAGE_DTYPE, n) if header['flags'][0] & HAS_MESSAGES else None
+    return Graph(n, offsets, targets, messages, kinds)
+
+
+# Text formats, kept for the C++ reducers and as export options
+
+# NUM_VERTICES followed by one "SRC DST" line per edge (input of reduce / reduceMPI)
+def read_edgelist(filename, messages = None):
+    with open(filename, 'r') as input:
+        n = int(input.readline())
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore') # an empty edge list is valid
+            edges = np.loadtxt(input, dtype = np.int64, ndmin = 2).reshape(-1, 2)
+    return from_edges(n, edges[:,0], edges[:,1], messages)
+
+
+def write_edgelist(graph, filename):
+    (sources, targets) = graph.edges()
+    with open(filename, 'w') as output:
+        output.write(repr(graph.num_vertices) + '\n')
+        np.savetxt(output, np.stack((sources, targets), axis = 1), fmt = '%d')
+
+
+# DOT as written by reduce (boost::write_graphviz) and reduceMPI: "v;" vertex lines and "u->v ;" edge lines
+DOT_VERTEX = re.compile(rb'^\s*(\d+)\s*;', re.M)
+DOT_EDGE = re.compile(rb'^\s*(\d+)\s*->\s*(\d+)', re.M)
+
+
+def read_dot(filename, messages = None):
+    with open(filename, 'rb') as input:
+        text = input.read()
+    edges = np.array(DOT_EDGE.findall(text), dtype = np.int64).reshape(-1, 2)
+    vertices = np.array(DOT_VERTEX.findall(text), dtype = np.int64)
+    n = int(max(vertices.max(initial = -1), edges.max(initial = -1))) + 1
+    if not messages is None:
+        n = max(n, len(messages))
+    return from_edges(n, edges[:,0], edges[:,1], messages)
+
+
+def write_dot(graph, filename):
+    (sources, targets) = graph.edges()
+    with open(filename, 'w') as output:
+        output.write("digraph G {\n")
+        np.savetxt(output, np.arange(graph.num_vertices), fmt = '%d;')
+        np.savetxt(output, np.stack((sources, targets), axis = 1), fmt = '%d->%d ;')
+        output.write("}\n")
+
+
+# One repr(message) per line (messages_rank<r>.txt / messages.txt)
+def read_messages(filename):
+    with open(filename, 'r') as input:
+        return [literal_eval(line) for line in input]
+
+
+def write_messages(graph, filename):
+    with open(filename, 'w') as output:
+        for m in graph.message_list():
+            output.write(repr(m) + '\n')
+
+
+# One "message-->message" line per edge (covers_rank<r>.txt / covers.txt)
+def write_covers(graph, filename):
+    M = [repr(m) for m in graph.message_list()]
+    (sources, targets) = graph.edges()
+    with open(filename, 'w') as output:
+        for (u,v) in zip(sources.tolist(), targets.tolist()):
+            output.write(M[u] + '-->' + M[v] + '\n')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Convert poger graphs between the binary CSR format and the text formats')
+    parser.add_argument('input', help = 'Graph to convert (.csr, .dot or NUM_VERTICES edge list)')
+    parser.add_argument('--messages', default = None, help = 'Message list (one repr per line) for a text input graph')
+    parser.add_argument('--csr', default = None, help = 'Write the graph in binary CSR format')
+    parser.add_argument('--edgelist', default = None, help = 'Write NUM_VERTICES and the edge list')
+    parser.add_argument('--dot', default = None, help = 'Write the graph in DOT')
+    parser.add_argument('--message-list', default = None, help = 'Write the message of every vertex, one per line')
+    parser.add_argument('--covers', default = None, help = 'Write message-->message edges')
+    args = parser.parse_args()
+
+    messages = read_messages(args.messages) if not args.messages == None else None
+    if args.input[-4:] == '.csr':
+        graph = read_graph(args.input)
+    elif args.input[-4:] == '.dot':
+        graph = read_dot(args.input, messages)
+    else:
+        graph = read_edgelist(args.input, messages)
+    print("Vertices", graph.num_vertices, "Edges", graph.num_edges())
+    if not args.csr == None:
+        write_graph(args.csr, graph)
+    if not args.edgelist == None:
+        write_edgelist(graph, args.edgelist)
+    if not args.dot == None:
+        write_dot(graph, args.dot)
+    if not args.message_list == None:
+        write_messages(graph, args.message_list)
+    if not args.covers == None:
+        write_covers(graph, args.covers)
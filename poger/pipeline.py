@@ -0,0 +1,186 @@
+#############################################################################
+##                               FENATE                                    ##  
+##          Copyright © 2021, Battelle Memorial Institute                  ##
+##                                                                         ##
+## 1. Battelle Memorial Institute (hereinafter Battelle) hereby grants     ##
+##  permission to any person or entity lawfully obtaining a copy of this   ##
+##  software and associated documentation files (hereinafter               ##
+##  “the Software”) to redistribute and use the Software in source and     ##
+##  binary forms, with or without modification.  Such person or entity may ##
+##  use, copy, modify, merge, publish, distribute, sublicense, and/or sell ##
+##  copies of the Software, and may permit others to do so, subject to the ##
+##  following conditions:                                                  ##
+##  • Redistributions of source code must retain the above copyright       ##
+##    notice, this list of conditions and the following disclaimers.       ##
+##  • Redistributions in binary form must reproduce the above copyright    ##
+##    notice, this list of conditions and the following disclaimer in      ##
+##    the documentation and/or other materials provided with the           ##
+##    distribution.                                                        ##
+##  • Other than as used herein, neither the name Battelle Memorial        ##
+##    Institute or Battelle may be used in any form whatsoever without     ##
+##    the express written consent of Battelle.                             ##
+## 2. THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS  ##
+##  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT      ##
+##  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS      ##
+##  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL BATTELLE    ##
+##  OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,        ##
+##  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT       ##
+##  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,  ##
+##  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON      ##
+##  ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR     ##
+##  TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF     ##
+##  THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF        ##
+##  SUCH DAMAGE.                                                           ##
+#############################################################################
+
+# Single node driver for the whole poger pipeline (the stages of DAG.slurm) on a process pool
+#    1. send index -- one pass over the send traces of every run (traces.py --send-index), after the container
+#       of every archive of runs is built (traces.py on the archive)
+#       (with store, every run is also packed into its trace store, traces.py --store)
+#    2. ranks -- per rank: comparability DAG, reduce and covers.py (or buildDAG.py --covers)
+#       (with add_run, the run is folded into the rank states saved by an earlier run with state instead)
+#       (with window, each rank is built and written in windows of that many events, buildDAG.py --window)
+#    3. merge -- all rank covers into messages.txt and DAG.txt (buildDAG.py without --rank)
+#    4. final reduction -- reduce on DAG.txt, or reduceMPI under mpirun followed by reduction_merge.py --stream
+#       (with reduce_bin None, transitive.py does both reductions without the C++ binaries)
+#       (with hierarchical, the rank covers are merged up a tree instead, buildDAG.py --hierarchical)
+#    5. covers.txt -- map the reduced DAG back to messages (covers.py); covers.csr with --csr
+# Every rank is submitted to the pool as soon as the destination directory exists, so there is
+# no staggering or polling for the directory as in DAG.slurm / buildDAG.py
+
+import os
+import shlex
+import subprocess
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from buildDAG import add_rank, build_DAG, build_rank, reduce_ranks, run_archives, run_dirs
+from covers import map_covers
+from reduction_merge import streamDir
+from traces import build_containers, build_send_index, build_trace_store, trace_ranks
+from transitive import reduce_file
+
+
+# Run func(*args) with its output sent to logfile, as srun --output does for DAG.slurm
+def logged(logfile, func, *args, **kwargs):
+    with open(logfile, 'w') as log:
+        with contextlib.redirect_stdout(log):
+            return func(*args, **kwargs)
+
+
+def run(command, logfile):
+    with open(logfile, 'w') as log:
+        subprocess.run(command, stdout = log, stderr = subprocess.STDOUT, check = True)
+
+
+def rank_stage(dirs, r, dest, covers, reduce_bin, csr, state = False, add_run = None, window = None, overlap = None):
+    if add_run == None:
+        logged(dest + '/build_' + repr(r) + '_output.txt', build_rank, dirs, r, dest, covers = covers, csr = csr, state = state, window = window, overlap = overlap)
+    else:
+        logged(dest + '/build_' + repr(r) + '_output.txt', add_rank, add_run, r, dest, covers = covers, csr = csr)
+    if covers:
+        return r
+    rank = repr(r)
+    if reduce_bin == None:
+        logged(dest + '/reduce_' + rank + '_output.txt', reduce_file, dest + '/DAG_rank' + rank + '.txt', dest + '/reducedDAG_rank' + rank + '.dot')
+    else:
+        run([reduce_bin, dest + '/DAG_rank' + rank + '.txt', dest + '/reducedDAG_rank' + rank + '.dot'], dest + '/reduce_' + rank + '_output.txt')
+    if csr:
+        logged(dest + '/covers_' + rank + '_output.txt', map_covers, dest + '/reducedDAG_rank' + rank + '.dot', dest + '/DAG_rank' + rank + '.csr', dest + '/covers_rank' + rank + '.csr')
+    else:
+        logged(dest + '/covers_' + rank + '_output.txt', map_covers, dest + '/reducedDAG_rank' + rank + '.dot', dest + '/messages_rank' + rank + '.txt', dest + '/covers_rank' + rank + '.txt')
+    return r
+
+
+def pipeline(rootdir, dest = '/MPICovers', reduce = '/reduction', ranks = None, workers = None, index_workers = None,
+             covers = False, send_index = True, reduce_bin = './reduce', reduceMPI_bin = './reduceMPI', mpi_procs = 0, mpirun = 'mpirun', csr = False, edge_budget = 1 << 26,
+             state = False, add_run = None, store = False, window = None, overlap = None, hierarchical = False, fanin = 8):
+    root = rootdir.rstrip('/') + '/'
+    # The containers of archives are built once here, before any rank reads them
+    archives = run_archives(root)
+    for (archive, count) in zip(archives, build_containers(archives, index_workers or workers) if len(archives) > 0 else []):
+        print(archive, count, 'traces in its container')
+    dirs = run_dirs(root, dest, require = True)
+    dest = root + dest.strip('/')
+    os.makedirs(dest + reduce, exist_ok = True)
+    if not add_run == None:
+        # Only the new run is read; the other runs are in the rank states saved in dest
+        dirs = [add_run.rstrip('/')]
+    if ranks == None:
+        ranks = sorted(set([r for dir in dirs for r in trace_ranks(dir)]))
+    print('Runs', len(dirs), 'Ranks', len(ranks))
+
+    if store:
+        # The trace stores come with the send index stores
+        with ProcessPoolExecutor(max_workers = index_workers or workers) as pool:
+            for (dir, count) in zip(dirs, pool.map(build_trace_store, dirs)):
+                print(dir, count, 'traces stored')
+    elif send_index:
+        with ProcessPoolExecutor(max_workers = index_workers or workers) as pool:
+            for (dir, count) in zip(dirs, pool.map(build_send_index, dirs)):
+                print(dir, count, 'send traces indexed')
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = [pool.submit(rank_stage, dirs, r, dest, covers, reduce_bin, csr, state, add_run, window, overlap) for r in ranks]
+        for future in futures:
+            future.result()
+    print("Built covers for all ranks.")
+
+    logged(dest + '/build_output.txt', build_DAG, dest, csr = csr, edge_budget = edge_budget)
+    print("Built total DAG")
+
+    if hierarchical:
+        logged(dest + '/reduce_log.txt', reduce_ranks, dest, dest + '/reducedDAG.dot', csr = csr, fanin = fanin, workers = workers or os.cpu_count())
+    elif reduce_bin == None:
+        logged(dest + '/reduce_log.txt', reduce_file, dest + '/DAG.txt', dest + '/reducedDAG.dot', workers = workers or os.cpu_count())
+    elif mpi_procs > 0:
+        for file in os.listdir(dest + reduce):
+            if file[:7] == 'output_':
+                os.remove(dest + reduce + '/' + file)
+        run(shlex.split(mpirun) + ['-np', repr(mpi_procs), reduceMPI_bin, dest + '/DAG.txt', dest + reduce + '/output'], dest + '/reduce_log.txt')
+        logged(dest + '/merge_output.txt', streamDir, dest + reduce, dest + '/reducedDAG.dot', workers = workers)
+    else:
+        run([reduce_bin, dest + '/DAG.txt', dest + '/reducedDAG.dot'], dest + '/reduce_log.txt')
+    print("Completed transitive reduction on entire DAG")
+
+    if csr:
+        map_covers(dest + '/reducedDAG.dot', dest + '/DAG.csr', dest + '/covers.csr')
+    else:
+        map_covers(dest + '/reducedDAG.dot', dest + '/messages.txt', dest + '/covers.txt')
+    print("Done.")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Run the poger pipeline on a single node with a process pool')
+    parser.add_argument('rootdir', help = 'Directory containing multiple MPI runs of with same message set')
+    parser.add_argument('--dest', default = '/MPICovers')
+    parser.add_argument('--reduce', default = '/reduction')
+    parser.add_argument('--maxrank', type = int, default = None, help = 'Process ranks 0..maxrank (default: every rank with a trace)')
+    parser.add_argument('--workers', type = int, default = None, help = 'Worker processes for the per-rank stage (default: one per core)')
+    parser.add_argument('--index-workers', type = int, default = None, help = 'Worker processes for the send index stage (default: --workers)')
+    parser.add_argument('--covers', action = 'store_true', help = 'Write rank covers directly (buildDAG.py --covers) and skip the per-rank reduce')
+    parser.add_argument('--no-send-index', dest = 'send_index', action = 'store_false', help = 'Do not build the send index store')
+    parser.add_argument('--store', action = 'store_true', help = 'Pack the traces of each run into a trace store (traces.py --store) that the per-rank stage reads with one seek per rank')
+    parser.add_argument('--reduce-bin', default = './reduce', help = 'Path to the reduce binary')
+    parser.add_argument('--python-reduce', action = 'store_true', help = 'Use the transitive.py engine instead of the reduce / reduceMPI binaries')
+    parser.add_argument('--reduceMPI-bin', default = './reduceMPI', help = 'Path to the reduceMPI binary')
+    parser.add_argument('--mpi', type = int, default = 0, help = 'Run the final reduction with reduceMPI on this many MPI processes instead of reduce')
+    parser.add_argument('--csr', action = 'store_true', help = 'Pass messages and graphs between stages in the binary CSR format (export with csr.py)')
+    parser.add_argument('--edge-budget', type = int, default = 1 << 26, help = 'Edges held in memory by the global merge before spilling to disk')
+    parser.add_argument('--state', action = 'store_true', help = 'Save the rank states (buildDAG.py --state) so that runs can be added later with --add-run')
+    parser.add_argument('--add-run', default = None, help = 'Fold this run directory into the saved rank states by pruning edges, then redo the merge and final reduction')
+    parser.add_argument('--window', type = int, default = None, help = 'Build every rank in windows of this many events (buildDAG.py --window)')
+    parser.add_argument('--overlap', type = int, default = None, help = 'With --window, only compare each window with this many events back; an approximation that can change the covers (default: every earlier event, exact)')
+    parser.add_argument('--hierarchical', action = 'store_true', help = 'Reduce the merged DAG by merging the rank covers up a tree (buildDAG.py --hierarchical) instead of reduce / reduceMPI')
+    parser.add_argument('--fanin', type = int, default = 8, help = 'With --hierarchical, rank covers merged at a time')
+    parser.add_argument('--mpirun', default = 'mpirun', help = 'MPI launcher command for --mpi, e.g. "mpirun --map-by core"')
+    args = parser.parse_args()
+
+    ranks = None if args.maxrank == None else list(range(args.maxrank + 1))
+    pipeline(args.rootdir, dest = args.dest, reduce = args.reduce, ranks = ranks, workers = args.workers,
+             index_workers = args.index_workers, covers = args.covers, send_index = args.send_index,
+             reduce_bin = None if args.python_reduce else args.reduce_bin, reduceMPI_bin = args.reduceMPI_bin, mpi_procs = args.mpi, mpirun = args.mpirun, csr = args.csr, edge_budget = args.edge_budget,
+             state = args.state, add_run = args.add_run, store = args.store, window = args.window, overlap = args.overlap,
+             hierarchical = args.hierarchical, fanin = args.fanin)
@@ -37,17 +37,10 @@ import os
 import argparse
 import re
 import json
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--dir', type=str, help="Directory to be read")
-parser.add_argument('--out', type=str, help="Destinatino of combined directory")
-
-args = parser.parse_args()
-directory = args.dir
-out = args.out
-
-print ("DIR", directory)
-print ("OUT", out)
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import csr
 
 def readDir(home):
    lof = []
@@ -109,14 +102,110 @@ def dumpDict(d1, filename):
       writer.write("}\n")
       
 
-lof = readDir(directory)
-#print ("LOF ", lof )
-combined_dic = parseContents(lof)
-#golden_dic = parseContents([out])
-#fl = compareDicts(combined_dic, golden_dic)
-#if (fl == True):
-#   print ("Dictionaries are equal")
-#   dumpDict(combined_dic, "combined.txt")
-#else:
-#   print ("Dictionaries differ")
-dumpDict(combined_dic, out)
+def dumpCSR(d1, filename):
+   sources = [int(k) for k, l in d1.items() for v in l]
+   targets = [int(v) for k, l in d1.items() for v in l]
+   mval = max(sources + targets, default = -1)
+   csr.write_graph(filename, csr.from_edges(mval+1, sources, targets))
+
+# Merge every output_* shard under directory into a single DOT graph (binary CSR graph if out ends in .csr)
+def mergeDir(directory, out):
+   lof = readDir(directory)
+   #print ("LOF ", lof )
+   combined_dic = parseContents(lof)
+   #golden_dic = parseContents([out])
+   #fl = compareDicts(combined_dic, golden_dic)
+   #if (fl == True):
+   #   print ("Dictionaries are equal")
+   #   dumpDict(combined_dic, "combined.txt")
+   #else:
+   #   print ("Dictionaries differ")
+   if out[-4:] == '.csr':
+      dumpCSR(combined_dic, out)
+   else:
+      dumpDict(combined_dic, out)
+
+
+# Streaming merge
+# Every shard is parsed by a worker process into a run of edges sorted (stably) by source vertex and saved
+# next to the output.  The runs are then merged k ways by source, one block per run at a time, and written
+# out incrementally, so memory is bounded by the number of shards rather than by the number of edges.
+# Edges keep the order of mergeDir: by source, then by shard and line.
+
+def parseShard(task):
+   (f, run) = task
+   with open(f, 'rb') as reader:
+      text = reader.read()
+   edges = np.array(csr.DOT_EDGE.findall(text), dtype=np.int64).reshape(-1, 2)
+   edges = edges[np.argsort(edges[:,0], kind='stable')]
+   np.save(run + "_src.npy", np.ascontiguousarray(edges[:,0]))
+   np.save(run + "_dst.npy", np.ascontiguousarray(edges[:,1]))
+   if len(edges) == 0:
+      return (-1, -1)
+   return (int(edges[-1,0]), int(edges[:,1].max()))
+
+def mergeRuns(runs, block_size=1 << 20):
+   sources = [np.load(run + "_src.npy", mmap_mode='r') for run in runs]
+   targets = [np.load(run + "_dst.npy", mmap_mode='r') for run in runs]
+   position = [0]*len(runs)
+   while True:
+      live = [i for i in range(len(runs)) if position[i] < len(sources[i])]
+      if len(live) == 0:
+         return
+      # Emit every edge whose source is at most the smallest source reached by reading one block
+      # further in each run; ties at that source are emitted completely, so shard order is kept
+      bound = min([sources[i][min(position[i] + block_size, len(sources[i])) - 1] for i in live])
+      merged = []
+      for i in live:
+         cut = np.searchsorted(sources[i], bound, side='right')
+         merged.append((np.asarray(sources[i][position[i]:cut]), np.asarray(targets[i][position[i]:cut])))
+         position[i] = cut
+      src = np.concatenate([m[0] for m in merged])
+      dst = np.concatenate([m[1] for m in merged])
+      order = np.argsort(src, kind='stable')
+      yield (src[order], dst[order])
+
+def streamDir(directory, out, workers=None, block_size=1 << 20):
+   lof = readDir(directory)
+   tmpdir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(out)))
+   runs = [tmpdir + "/run_" + str(i) for i in range(len(lof))]
+   try:
+      with ProcessPoolExecutor(max_workers=workers) as pool:
+         bounds = list(pool.map(parseShard, zip(lof, runs)))
+      mval = max([b[0] for b in bounds], default=-1)
+      if out[-4:] == '.csr':
+         n = max([b[1] for b in bounds] + [mval], default=-1) + 1
+         csr.write_graph_stream(out, n, mergeRuns(runs, block_size))
+      else:
+         with open(out, "w") as writer:
+            writer.write("digraph G {\n")
+            np.savetxt(writer, np.arange(mval+1), fmt="%d;")
+            for (sources, targets) in mergeRuns(runs, block_size):
+               np.savetxt(writer, np.stack((sources, targets), axis=1), fmt="%d->%d ;")
+            writer.write("}\n")
+   finally:
+      for run in runs:
+         for f in (run + "_src.npy", run + "_dst.npy"):
+            if os.path.exists(f):
+               os.remove(f)
+      os.rmdir(tmpdir)
+
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser()
+   parser.add_argument('--dir', type=str, help="Directory to be read")
+   parser.add_argument('--out', type=str, help="Destinatino of combined directory")
+   parser.add_argument('--stream', action='store_true', help="Parse the shards in parallel and stream them through a k-way merge")
+   parser.add_argument('--workers', type=int, default=None, help="Worker processes for --stream (default: one per core)")
+
+   args = parser.parse_args()
+   directory = args.dir
+   out = args.out
+
+   print ("DIR", directory)
+   print ("OUT", out)
+
+   if args.stream:
+      streamDir(directory, out, workers=args.workers)
+   else:
+      mergeDir(directory, out)
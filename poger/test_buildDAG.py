@@ -0,0 +1,118 @@
+import os
+import shutil
+import numpy as np
+import pytest
+import buildDAG
+from buildDAG import MESSAGE_DTYPE, add_rank, add_rankRun, build_rank, build_rankDAG, build_rankState, build_rankWindows, intern, load_rankState, state_edges, write_rankBlocks, write_rankCovers
+
+
+def drop_line(dir, op, r, line):
+    filename = os.path.join(dir, 'trace_MPI' + op + '_' + repr(r) + '.ct')
+    with open(filename, 'r') as input:
+        lines = input.readlines()
+    del lines[line]
+    with open(filename, 'w') as output:
+        output.writelines(lines)
+
+
+def add_line(dir, op, r, line):
+    filename = os.path.join(dir, 'trace_MPI' + op + '_' + repr(r) + '.ct')
+    with open(filename, 'r') as input:
+        lines = input.readlines()
+    lines.append(lines[line])
+    with open(filename, 'w') as output:
+        output.writelines(lines)
+
+
+def window_edges(dirs, r, window, overlap = None):
+    (V, blocks) = build_rankWindows(dirs, r, window, overlap)
+    return set([(V[u],V[v]) for (sources, targets) in blocks for (u,v) in zip(sources.tolist(), targets.tolist())])
+
+
+@pytest.mark.parametrize('window', [1, 2, 5, 1000])
+def test_windows_match_rankDAG(runs, window):
+    dirs = runs(ranks = 8)
+    for r in (0, 3):
+        assert window_edges(dirs, r, window) == set(build_rankDAG(dirs, r))
+
+
+def test_windows_match_rankDAG_ragged(runs):
+    dirs = runs(ranks = 8)
+    drop_line(dirs[1], 'Bcast', 3, 0)
+    assert window_edges(dirs, 3, 2) == set(build_rankDAG(dirs, 3))
+
+
+def test_window_covers_match_rank_covers(runs, tmp_path):
+    dirs = runs(ranks = 8)
+    (flat, windowed) = (tmp_path / 'flat', tmp_path / 'windowed')
+    os.makedirs(flat)
+    os.makedirs(windowed)
+    write_rankCovers(str(flat), 2, build_rankDAG(dirs, 2))
+    (V, blocks) = build_rankWindows(dirs, 2, 3)
+    write_rankBlocks(str(windowed), 2, V, blocks, covers = True)
+    covers = [set(open(str(dest / 'covers_rank2.txt')).readlines()) for dest in (flat, windowed)]
+    assert len(covers[0]) > 0
+    assert covers[0] == covers[1]
+
+
+def test_no_runs(tmp_path):
+    assert build_rankDAG([], 0) == []
+    assert window_edges([], 0, 3) == set()
+    assert state_edges(build_rankState([], 0)) == []
+    build_rank([], 0, str(tmp_path), window = 3)
+    assert open(str(tmp_path / 'DAG_rank0.txt')).read() == '0\n'
+
+
+def test_add_run_matches_rebuild(runs, tmp_path):
+    dirs = runs(ranks = 6, runs = 4)
+    dest = str(tmp_path)
+    for r in (0, 4):
+        build_rank(dirs[:3], r, dest, state = True)
+        add_rank(dirs[3], r, dest)
+        state = load_rankState(dest, r)
+        assert state['runs'].tolist() == dirs
+        assert set(state_edges(state)) == set(build_rankDAG(dirs, r))
+
+
+@pytest.mark.parametrize('change', [drop_line, add_line])
+def test_add_uneven_run_rebuilds(runs, tmp_path, change):
+    dirs = runs(ranks = 6, runs = 4)
+    change(dirs[3], 'Bcast', 2, 1)
+    dest = str(tmp_path)
+    build_rank(dirs[:3], 2, dest, state = True)
+    with pytest.raises(ValueError):
+        add_rankRun(load_rankState(dest, 2), dirs[3], 2)
+    add_rank(dirs[3], 2, dest)
+    assert set(state_edges(load_rankState(dest, 2))) == set(build_rankDAG(dirs, 2))
+    # The rebuilt state has a ragged event, so no later run can be folded in either
+    shutil.copytree(dirs[0], dirs[0] + '_copy')
+    with pytest.raises(ValueError):
+        add_rankRun(load_rankState(dest, 2), dirs[0] + '_copy', 2)
+
+
+# Runs as lists of message_info, in place of the traces of run_table
+def fake_runs(monkeypatch, runs):
+    def run_table(dir, r, kinds):
+        table = np.zeros(len(runs[dir]), dtype = MESSAGE_DTYPE)
+        for (i,(source,dest,idx)) in enumerate(runs[dir]):
+            if isinstance(source, str):
+                table[i] = (intern(kinds, source), -1, dest, idx)
+            else:
+                table[i] = (0, source, dest, idx)
+        return table
+    monkeypatch.setattr(buildDAG, 'run_table', run_table)
+
+
+def test_state_with_chain_vertex_in_no_run(monkeypatch):
+    # Rank 0 sends (0,1,0) and (0,1,2), (0,1,1) is in neither run
+    fake_runs(monkeypatch, {'a' : [(0,1,0), (2,0,0), ('AllReduceStart',-1,0), (0,1,2)],
+                            'b' : [(2,0,0), (0,1,0), ('AllReduceStart',-1,0), (0,1,2)],
+                            'c' : [(2,0,0), (0,1,0), ('AllReduceStart',-1,0), (0,1,2)],
+                            'd' : [(2,0,0), (0,1,0), (0,1,1), ('AllReduceStart',-1,0), (0,1,2)]})
+    state = build_rankState(['a', 'b'], 0)
+    assert set(state_edges(state)) == set(build_rankDAG(['a', 'b'], 0))
+    assert ((0,1,0),(0,1,1)) in state_edges(state)
+    state = add_rankRun(state, 'c', 0)
+    assert set(state_edges(state)) == set(build_rankDAG(['a', 'b', 'c'], 0))
+    with pytest.raises(ValueError):
+        add_rankRun(state, 'd', 0)
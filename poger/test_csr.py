@@ -0,0 +1,36 @@
+import pytest
+from buildDAG import read_rankEdges
+from csr import EdgeStore, from_edges, write_graph
+
+
+def store_edges(E):
+    return [(u,v) for (sources, targets) in E.blocks() for (u,v) in zip(sources.tolist(), targets.tolist())]
+
+
+def test_edge_store_keeps_largest_ids(tmp_path):
+    E = EdgeStore(budget = 2, tmpdir = str(tmp_path))
+    top = (1 << 32) - 1
+    E.add([top, 0, top], [0, top, top])
+    E.add([0, top], [top, 5])
+    assert store_edges(E) == [(0, top), (top, 0), (top, 5), (top, top)]
+    E.close()
+
+
+@pytest.mark.parametrize('edge', [([-1], [0]), ([0], [-1]), ([1 << 32], [0]), ([0], [1 << 32])])
+def test_edge_store_rejects_out_of_range_ids(edge):
+    E = EdgeStore()
+    with pytest.raises(ValueError):
+        E.add(*edge)
+    assert E.count == 0
+
+
+def test_read_rankEdges_rejects_unknown_messages(tmp_path):
+    filename = str(tmp_path / 'covers_rank0.csr')
+    messages = [(0,1,0), (1,0,0), (0,1,1)]
+    write_graph(filename, from_edges(3, [0, 1], [1, 2], messages))
+    ids = {repr(m) : i for (i,m) in enumerate(messages)}
+    (sources, targets) = read_rankEdges(filename, ids)
+    assert list(zip(sources.tolist(), targets.tolist())) == [(0,1), (1,2)]
+    del ids[repr((0,1,1))]
+    with pytest.raises(ValueError, match = 'unknown message'):
+        read_rankEdges(filename, ids)
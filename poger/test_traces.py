@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+import tarfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pytest
+import traces
+from buildDAG import run_dirs
+from traces import CACHE_SUFFIX, CONTAINER_SUFFIX, build_container, container_fresh, load_member, load_trace, open_container, rank_traces
+
+
+def write_trace(filename, lines, mtime):
+    with open(filename, 'w') as output:
+        output.writelines([','.join(map(str, line)) + ',\n' for line in lines])
+    os.utime(filename, (mtime, mtime))
+
+
+def test_sidecar_is_reused_for_the_same_trace(tmp_path):
+    filename = str(tmp_path / 'trace_MPISend_0.ct')
+    write_trace(filename, [(0, 0, 1, 8, 0, 10, 20), (0, 0, 1, 8, 1, 30, 40)], 1000000)
+    assert load_trace(filename)['index'].tolist() == [0, 1]
+    trace = load_trace(filename)
+    assert isinstance(trace, np.memmap)
+    assert trace['t_end'].tolist() == [20, 40]
+
+
+@pytest.mark.parametrize('lines', [[(0, 0, 2, 8, 5, 50, 60)], [(0, 0, 1, 8, 0, 10, 20), (0, 0, 1, 8, 1, 30, 41)]])
+def test_sidecar_of_a_trace_replaced_by_an_older_file(tmp_path, lines):
+    filename = str(tmp_path / 'trace_MPISend_0.ct')
+    write_trace(filename, [(0, 0, 1, 8, 0, 10, 20), (0, 0, 1, 8, 1, 30, 40)], 2000000)
+    load_trace(filename)
+    write_trace(filename, lines, 1000000)
+    assert load_trace(filename).tolist() == [line[1:] for line in lines]
+
+
+def test_unstamped_sidecar_is_replaced(tmp_path):
+    filename = str(tmp_path / 'trace_MPISend_0.ct')
+    write_trace(filename, [(0, 0, 1, 8, 3, 10, 20)], 1000000)
+    np.save(filename + CACHE_SUFFIX, np.zeros(5, dtype = load_trace(filename, cache = False).dtype))
+    assert load_trace(filename)['index'].tolist() == [3]
+    assert load_trace(filename)['index'].tolist() == [3]
+
+
+def write_archive(runs, tmp_path):
+    dirs = runs(ranks = 4, runs = 2)
+    root = tmp_path / 'root'
+    os.makedirs(root)
+    archive = str(root / 'runs.tgz')
+    with tarfile.open(archive, 'w:gz') as tar:
+        for dir in dirs:
+            tar.add(dir, arcname = os.path.basename(dir))
+    return (str(root), archive, dirs)
+
+
+def open_names(archive, builds, queue):
+    # Count the archives read by this process, on top of opening the container
+    read_archive = traces.read_archive
+    def counted(path, workers = None):
+        with open(builds, 'a') as output:
+            output.write(path + '\n')
+        return read_archive(path, workers)
+    traces.read_archive = counted
+    queue.put(sorted(open_container(archive)[1]))
+
+
+def test_concurrent_opens_build_the_container_once(runs, tmp_path):
+    (root, archive, dirs) = write_archive(runs, tmp_path)
+    builds = str(tmp_path / 'builds.txt')
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    processes = [context.Process(target = open_names, args = (archive, builds, queue)) for i in range(4)]
+    for process in processes:
+        process.start()
+    names = [queue.get(timeout = 60) for process in processes]
+    for process in processes:
+        process.join()
+    assert all([process.exitcode == 0 for process in processes])
+    assert len(open(builds).readlines()) == 1
+    assert all([n == names[0] for n in names]) and len(names[0]) > 0
+    assert sorted(os.listdir(root)) == ['runs.tgz', 'runs.tgz' + CONTAINER_SUFFIX, 'runs.tgz' + CONTAINER_SUFFIX + '.lock']
+
+
+def read_members(archive, names):
+    return [int(load_member(archive, name)['index'].sum()) for name in names for i in range(20)]
+
+
+def test_forked_workers_read_a_container_opened_by_the_parent(runs, tmp_path):
+    (root, archive, dirs) = write_archive(runs, tmp_path)
+    names = sorted(open_container(archive)[1])
+    expected = read_members(archive, names)
+    with ProcessPoolExecutor(4, mp_context = multiprocessing.get_context('fork')) as pool:
+        results = list(pool.map(read_members, [archive]*16, [names]*16))
+    assert all([result == expected for result in results])
+
+
+def test_rank_jobs_require_the_container(runs, tmp_path):
+    (root, archive, dirs) = write_archive(runs, tmp_path)
+    with pytest.raises(Exception, match = 'UnknownContainer'):
+        run_dirs(root, '/MPICovers', require = True)
+    assert not container_fresh(archive)
+    assert build_container(archive) > 0
+    runs_in_archive = run_dirs(root, '/MPICovers', require = True)
+    assert runs_in_archive == [archive + '/run0', archive + '/run1']
+    for (dir, archived) in zip(dirs, runs_in_archive):
+        assert (rank_traces(dir, 1)('Send') == rank_traces(archived, 1)('Send')).all()
+
+
+def test_final_merge_does_not_open_archives(runs, tmp_path):
+    (root, archive, dirs) = write_archive(runs, tmp_path)
+    os.makedirs(root + '/MPICovers')
+    with open(root + '/MPICovers/covers_rank0.txt', 'w') as output:
+        output.write('(0, 1, 0)-->(1, 0, 0)\n')
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'buildDAG.py')
+    subprocess.run([sys.executable, script, root, '--dest', '/MPICovers'], check = True, capture_output = True, cwd = os.path.dirname(script))
+    assert os.path.exists(root + '/MPICovers/DAG.txt')
+    assert not os.path.exists(archive + CONTAINER_SUFFIX)
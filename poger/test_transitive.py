@@ -0,0 +1,46 @@
+import tracemalloc
+import numpy as np
+import pytest
+from transitive import BlockGraph, block_plan, reduce_block, reduce_edges, transitive_reduction
+
+
+def random_dag(num_vertices, num_edges, seed = 0):
+    rng = np.random.default_rng(seed)
+    (u, v) = (rng.integers(0, num_vertices, num_edges), rng.integers(0, num_vertices, num_edges))
+    edges = np.stack((np.minimum(u, v), np.maximum(u, v)), axis = 1)
+    return edges[edges[:,0] < edges[:,1]]
+
+
+@pytest.mark.parametrize('memory', [1, 1 << 12, 1 << 28])
+def test_reduce_edges_matches_transitive_reduction(memory):
+    edges = random_dag(300, 3000)
+    keep = reduce_edges(300, edges[:,0], edges[:,1], block_bits = 64 if memory == 1 else None, memory = memory)
+    assert set(map(tuple, edges[keep].tolist())) == set(transitive_reduction(300, edges.tolist()))
+
+
+# A complete layer of width x width edges above a matching: every source of the complete layer has more edges
+# than a chunk holds
+def layered(width):
+    top = np.repeat(np.arange(width), width)
+    middle = width + np.tile(np.arange(width), width)
+    src = np.concatenate((top, width + np.arange(width)))
+    dst = np.concatenate((middle, 2*width + np.arange(width)))
+    return (3*width, src, dst)
+
+
+def test_reduce_block_stays_within_memory():
+    (num_vertices, src, dst) = layered(800)
+    memory = 1 << 20
+    G = BlockGraph(num_vertices, src, dst)
+    (block_bits, chunk_edges) = block_plan(num_vertices, memory)
+    assert chunk_edges < 800
+    tracemalloc.start()
+    try:
+        for lo in range(0, num_vertices, block_bits):
+            reduce_block(G, lo, min(lo + block_bits, num_vertices), chunk_edges)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak <= memory
+    assert G.keep.all()
+    assert reduce_edges(num_vertices, src, dst, memory = memory).all()
@@ -0,0 +1,527 @@
+#############################################################################
+##                               FENATE                                    ##  
+##          Copyright © 2021, Battelle Memorial Institute                  ##
+##                                                                         ##
+## 1. Battelle Memorial Institute (hereinafter Battelle) hereby grants     ##
+##  permission to any person or entity lawfully obtaining a copy of this   ##
+##  software and associated documentation files (hereinafter               ##
+##  “the Software”) to redistribute and use the Software in source and     ##
+##  binary forms, with or without modification.  Such person or entity may ##
+##  use, copy, modify, merge, publish, distribute, sublicense, and/or sell ##
+##  copies of the Software, and may permit others to do so, subject to the ##
+##  following conditions:                                                  ##
+##  • Redistributions of source code must retain the above copyright       ##
+##    notice, this list of conditions and the following disclaimers.       ##
+##  • Redistributions in binary form must reproduce the above copyright    ##
+##    notice, this list of conditions and the following disclaimer in      ##
+##    the documentation and/or other materials provided with the           ##
+##    distribution.                                                        ##
+##  • Other than as used herein, neither the name Battelle Memorial        ##
+##    Institute or Battelle may be used in any form whatsoever without     ##
+##    the express written consent of Battelle.                             ##
+## 2. THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS  ##
+##  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT      ##
+##  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS      ##
+##  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL BATTELLE    ##
+##  OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,        ##
+##  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT       ##
+##  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,  ##
+##  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON      ##
+##  ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR     ##
+##  TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF     ##
+##  THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF        ##
+##  SUCH DAMAGE.                                                           ##
+#############################################################################
+
+import errno
+import fcntl
+import io
+import os
+import tarfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+
+# Columnar layout of a trace_MPI*_<rank>.ct file
+# Each line of a trace is "call,sender,recipient,size,index,t_start,t_end," and the leading
+# call identifier is not used by poger, so it is dropped when the trace is loaded
+TRACE_DTYPE = np.dtype([('sender', np.int64),
+                        ('recipient', np.int64),
+                        ('size', np.int64),
+                        ('index', np.int64),
+                        ('t_start', np.int64),
+                        ('t_end', np.int64)])
+
+# Binary sidecar written next to every parsed trace (trace_MPISend_0.ct -> trace_MPISend_0.ct.npy)
+# The sidecar holds the stamp of the trace it was parsed from (size and mtime in ns, as an int64 .npy), then the
+# trace (a TRACE_DTYPE .npy); it is only used when the stamp matches the trace exactly, so a trace replaced by
+# an older file (cp -p, tar extraction, rsync -a) is parsed again
+CACHE_SUFFIX = '.npy'
+
+
+def trace_path(dir, op, r):
+    return dir + "/trace_MPI" + op + "_" + repr(r) + ".ct"
+
+
+# Parse the text form of a trace (a file name, or a file object) straight into a TRACE_DTYPE array
+def parse_trace(filename):
+    if isinstance(filename, str) and os.path.getsize(filename) == 0:
+        return np.empty(0, dtype = TRACE_DTYPE)
+    columns = np.loadtxt(filename, delimiter = ',', usecols = range(7), dtype = np.int64, ndmin = 2)
+    trace = np.empty(len(columns), dtype = TRACE_DTYPE)
+    for (i,field) in enumerate(TRACE_DTYPE.names):
+        trace[field] = columns[:,i+1]
+    return trace
+
+
+# Load a trace, preferring the binary sidecar when it was parsed from this very text file
+# The sidecar is memory-mapped, so later stages and reruns never touch the text again
+# Raises the same OSError as open() when the trace itself does not exist
+# Traces inside an archive (see split_archive) are read from the archive's container instead
+def load_trace(filename, cache = True):
+    archive = split_archive(filename)
+    if not archive == None:
+        return load_member(archive[0], archive[1], cache)
+    sidecar = filename + CACHE_SUFFIX
+    stamp = trace_stamp(filename)
+    if cache:
+        try:
+            trace = read_sidecar(sidecar, stamp)
+            if not trace is None:
+                return trace
+        except (OSError, ValueError, EOFError):
+            pass
+    trace = parse_trace(filename)
+    if cache:
+        write_sidecar(sidecar, stamp, trace)
+    return trace
+
+
+def trace_stamp(filename):
+    status = os.stat(filename)
+    return np.array([status.st_size, status.st_mtime_ns], dtype = np.int64)
+
+
+# The trace of a sidecar, memory-mapped, or None when it was parsed from another file than stamp's (or is a
+# sidecar of the unstamped format)
+def read_sidecar(sidecar, stamp):
+    with open(sidecar, 'rb') as input:
+        saved = np.load(input)
+        if not (saved.dtype == np.int64 and saved.shape == stamp.shape and (saved == stamp).all()):
+            return None
+        version = np.lib.format.read_magic(input)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        (shape, fortran_order, dtype) = read_header(input)
+        if not dtype == TRACE_DTYPE or not len(shape) == 1:
+            return None
+        if shape[0] == 0:
+            return np.empty(0, dtype = TRACE_DTYPE)
+        return np.memmap(sidecar, dtype = TRACE_DTYPE, mode = 'r', offset = input.tell(), shape = shape)
+
+
+# Several ranks read the same files concurrently, so write to a private file and rename it into place
+def save_array(filename, array):
+    replace_file(filename, lambda output: np.save(output, array))
+
+
+def replace_file(filename, write):
+    tmp = filename + '.' + repr(os.getpid())
+    try:
+        with open(tmp, 'wb') as output:
+            write(output)
+        os.replace(tmp, filename)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+# Failing to cache (e.g. a read-only trace directory) is not an error
+def write_sidecar(sidecar, stamp, trace):
+    def write(output):
+        np.save(output, stamp)
+        np.save(output, trace)
+    try:
+        replace_file(sidecar, write)
+    except OSError:
+        pass
+
+
+# Trace archives
+# A run directory may also be a run inside an archive of traces: runs.tgz (or .tar.gz), runs.tar.zst, an
+# uncompressed runs.tar, or a trace container runs.npz, optionally followed by the directory of the run
+# inside the archive, e.g. sw4lite_256_2k_data.tgz/resPP_1k.  Compressed tar streams cannot be read at an
+# offset, so the first use of an archive reads it once, parses every trace_MPI*_<rank>.ct member (in
+# worker processes, while the stream is decompressed) and saves the arrays in one container next to the
+# archive (runs.tgz -> runs.tgz.npz, an uncompressed .npz keyed by member name).  Later reads open the
+# container's member index and load a trace with a single seek.  Other members (e.g. skew_<rank>.ct) are
+# not kept.  .tar.zst archives need the zstandard package.
+# The container is built under a lock (runs.tgz.npz.lock) and renamed into place, so jobs that need it at the
+# same time build it once; jobs that run in parallel per rank should have it built up front (traces.py on the
+# archive) rather than wait for one of them to build it.
+ARCHIVE_SUFFIXES = ('.tar', '.tgz', '.tar.gz', '.tar.zst', '.tzst', '.npz')
+CONTAINER_SUFFIX = '.npz'
+# Open containers share their file offset with every process forked after they were opened, so each process
+# opens its own: the cache is keyed by (process id, archive)
+containers = {}  # (pid, archive) -> (container, member names)
+
+
+# (archive, member) for a path into an archive, e.g. ('runs.tgz', 'resPP_1k/trace_MPISend_0.ct'), else None
+def split_archive(filename):
+    parts = filename.split('/')
+    for i in range(len(parts)):
+        if parts[i].endswith(ARCHIVE_SUFFIXES) and os.path.isfile('/'.join(parts[:i+1])):
+            return ('/'.join(parts[:i+1]), '/'.join([part for part in parts[i+1:] if len(part) > 0]))
+    return None
+
+
+# The trace members of an archive as (member name, contents), in archive order
+def archive_members(path):
+    with open(path, 'rb') as raw:
+        if path.endswith(('.tar.zst', '.tzst')):
+            import zstandard
+            (stream, mode) = (zstandard.ZstdDecompressor().stream_reader(raw), 'r|')
+        else:
+            (stream, mode) = (raw, 'r|*')
+        with tarfile.open(fileobj = stream, mode = mode) as tar:
+            for member in tar:
+                name = os.path.normpath(member.name)
+                base = os.path.basename(name)
+                if member.isfile() and base[:9] == 'trace_MPI' and base[-3:] == '.ct':
+                    yield (name, tar.extractfile(member).read())
+
+
+def parse_members(members):
+    return {name : parse_trace(io.BytesIO(data)) if len(data.strip()) > 0 else np.empty(0, dtype = TRACE_DTYPE) for (name, data) in members}
+
+
+# The trace members of an archive in batches of about batch_size bytes
+def archive_batches(path, batch_size = 1 << 22):
+    batch = []
+    size = 0
+    for (name, data) in archive_members(path):
+        batch.append((name, data))
+        size += len(data)
+        if size >= batch_size:
+            yield batch
+            batch = []
+            size = 0
+    if len(batch) > 0:
+        yield batch
+
+
+# Parse every trace of an archive into {member name : trace}; batches are handed to workers processes as
+# soon as they are decompressed
+def read_archive(path, workers = None):
+    traces = {}
+    if workers == 1:
+        for batch in archive_batches(path):
+            traces.update(parse_members(batch))
+        return traces
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = [pool.submit(parse_members, batch) for batch in archive_batches(path)]
+        for future in futures:
+            traces.update(future.result())
+    return traces
+
+
+def save_container(path, traces):
+    replace_file(path + CONTAINER_SUFFIX, lambda output: np.savez(output, **traces))
+
+
+# Whether the container of an archive exists and is at least as new as the archive (a container is its own)
+def container_fresh(path):
+    if path[-len(CONTAINER_SUFFIX):] == CONTAINER_SUFFIX:
+        return True
+    try:
+        return os.path.getmtime(path + CONTAINER_SUFFIX) >= os.path.getmtime(path)
+    except OSError:
+        return False
+
+
+# Exclusive lock on the container of an archive; raises OSError when the lock file cannot be created
+@contextmanager
+def container_lock(path):
+    with open(path + CONTAINER_SUFFIX + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# Write the container of an archive unless it is fresh already; returns the number of traces it holds
+# Whoever takes the lock first builds it, the others wait for it and find it fresh
+def build_container(path, workers = None):
+    with container_lock(path):
+        if not container_fresh(path):
+            save_container(path, read_archive(path, workers))
+    with np.load(path + CONTAINER_SUFFIX) as container:
+        return len(container.files)
+
+
+# Build the containers of several archives, each decompressed by its own worker process
+def build_containers(paths, workers = None):
+    if len(paths) == 1:
+        return [build_container(paths[0], workers)]
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        return list(pool.map(build_container, paths, [1]*len(paths)))
+
+
+# The container of an archive (a mapping from member name to trace) and the set of its member names
+# The container is (re)built by build_container when it is missing or older than the archive; without cache,
+# or when it cannot be written (e.g. a read-only archive directory), the archive is only read into memory
+def open_container(path, cache = True):
+    key = (os.getpid(), path)
+    if key in containers:
+        return containers[key]
+    if path[-len(CONTAINER_SUFFIX):] == CONTAINER_SUFFIX:
+        container = np.load(path)
+    elif not cache:
+        container = read_archive(path)
+    else:
+        try:
+            build_container(path)
+            container = np.load(path + CONTAINER_SUFFIX)
+        except OSError:
+            container = read_archive(path)
+    containers[key] = (container, set(container))
+    return containers[key]
+
+
+# Raises the same OSError as open() when the archive has no such member
+def load_member(path, member, cache = True):
+    (container, names) = open_container(path, cache)
+    if not member in names:
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path + '/' + member)
+    return container[member]
+
+
+# The run directories of an archive: every directory of it holding traces
+def archive_runs(path):
+    (container, names) = open_container(path)
+    return sorted(set([path + '/' + os.path.dirname(name) if len(os.path.dirname(name)) > 0 else path for name in names]))
+
+
+# File names in dir, a directory or a run in an archive
+def trace_files(dir):
+    archive = split_archive(dir)
+    if archive == None:
+        return os.listdir(dir)
+    (path, prefix) = archive
+    if len(prefix) > 0:
+        prefix += '/'
+    (container, names) = open_container(path)
+    return [name[len(prefix):] for name in names if name[:len(prefix)] == prefix and not '/' in name[len(prefix):]]
+
+
+# Path of a file poger keeps for the run in dir (e.g. SEND_INDEX_PAIRS): inside a run directory, and next to
+# the archive for a run in an archive (runs.tgz/resPP_1k -> runs.tgz.resPP_1k.send_index_pairs.npy)
+def run_file(dir, name):
+    archive = split_archive(dir)
+    if archive == None:
+        return dir + name
+    (path, prefix) = archive
+    return '.'.join([path] + [part for part in prefix.split('/') if len(part) > 0] + [name.strip('/')])
+
+
+# Trace store
+# The traces of a run packed into one file, so that all traces of a rank are read with one seek and without
+# probing for the trace_MPI<op>_<rank>.ct files that do not exist.  The file holds two .npy records, the
+# operation names and the index, one row per (rank, operation) sorted by rank then operation, followed by
+# the data: one chunk per rank in index order, each chunk the columns of TRACE_DTYPE (int64) of every row of
+# the rank, operation after operation.  index offset counts the rows before an entry.
+# The store is written once by traces.py --store, together with the send index store that build_rankDAG also
+# reads, and then used instead of the trace files; rebuild it when the traces change.
+TRACE_STORE = '/trace_store.dat'
+STORE_DTYPE = np.dtype([('rank', np.int64),
+                        ('op', np.int64),
+                        ('offset', np.int64),
+                        ('count', np.int64)])
+stores = {}  # run directory -> (store file, operations, index, start of the data) or None without a store
+
+
+# Operations with a trace_MPI<op>_<rank>.ct file in dir
+def trace_ops(dir):
+    ops = set()
+    for file in trace_files(dir):
+        if file[:9] == 'trace_MPI' and file[-3:] == '.ct' and '_' in file[9:]:
+            ops.add(file[9:-3].rsplit('_', 1)[0])
+    return sorted(ops)
+
+
+# Pack every trace of dir into its trace store (and build its send index store); returns the number of traces
+# packed
+def build_trace_store(dir):
+    dir = dir.rstrip('/')
+    build_send_index(dir)
+    ops = trace_ops(dir)
+    index = []
+    chunks = []
+    offset = 0
+    for r in trace_ranks(dir):
+        traces = []
+        for (op, name) in enumerate(ops):
+            try:
+                trace = load_trace(trace_path(dir, name, r))
+            except OSError:
+                continue
+            index.append((r, op, offset, len(trace)))
+            traces.append(trace)
+            offset += len(trace)
+        if len(traces) > 0:
+            trace = np.concatenate(traces)
+            chunks.append(np.stack([trace[field] for field in TRACE_DTYPE.names]))
+    index = np.array(index, dtype = STORE_DTYPE)
+    def write(output):
+        np.save(output, np.array(ops, dtype = str))
+        np.save(output, index)
+        for chunk in chunks:
+            output.write(np.ascontiguousarray(chunk, dtype = np.int64).tobytes())
+    replace_file(run_file(dir, TRACE_STORE), write)
+    stores.pop(dir, None)
+    return len(index)
+
+
+def open_store(dir):
+    if not dir in stores:
+        filename = run_file(dir, TRACE_STORE)
+        try:
+            with open(filename, 'rb') as input:
+                ops = np.load(input).tolist()
+                index = np.load(input)
+                stores[dir] = (filename, ops, index, input.tell())
+        except (OSError, ValueError):
+            stores[dir] = None
+    return stores[dir]
+
+
+# Every trace of rank r in the trace store of dir as {operation : trace}, or None when dir has no store
+def load_rank(dir, r):
+    store = open_store(dir.rstrip('/'))
+    if store == None:
+        return None
+    (filename, ops, index, start) = store
+    lo = np.searchsorted(index['rank'], r, side = 'left')
+    hi = np.searchsorted(index['rank'], r, side = 'right')
+    if lo == hi:
+        return {}
+    first = int(index['offset'][lo])
+    rows = int(index['offset'][hi-1] + index['count'][hi-1]) - first
+    with open(filename, 'rb') as input:
+        input.seek(start + first*len(TRACE_DTYPE.names)*8)
+        columns = np.fromfile(input, dtype = np.int64, count = rows*len(TRACE_DTYPE.names)).reshape(len(TRACE_DTYPE.names), rows)
+    traces = {}
+    for (op, offset, count) in zip(index['op'][lo:hi].tolist(), index['offset'][lo:hi].tolist(), index['count'][lo:hi].tolist()):
+        trace = np.empty(count, dtype = TRACE_DTYPE)
+        for (i,field) in enumerate(TRACE_DTYPE.names):
+            trace[field] = columns[i, offset-first:offset-first+count]
+        traces[ops[op]] = trace
+    return traces
+
+
+# The traces of rank r in dir as a function of the operation, read from the trace store of dir when it has
+# one and from the trace files otherwise; raises the same OSError as load_trace for a missing trace
+def rank_traces(dir, r):
+    traces = load_rank(dir, r)
+    if traces == None:
+        return lambda op: load_trace(trace_path(dir, op, r))
+    def trace(op):
+        if not op in traces:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), trace_path(dir, op, r))
+        return traces[op]
+    return trace
+
+
+# Send index store
+# Messages are numbered sequentially by sender, so rank r needs every sender's ordering of the messages
+# addressed to r.  Rather than every rank re-reading the send traces of all of its senders, the store
+# is built once per run directory by reading each trace_MPISend_<s>.ct a single time:
+#    send_index_pairs.npy -- one row per (sender, recipient) pair, sorted by recipient then sender
+#    send_index_messages.npy -- sender message indices, pair by pair, in send order
+SEND_INDEX_PAIRS = '/send_index_pairs.npy'
+SEND_INDEX_MESSAGES = '/send_index_messages.npy'
+PAIR_DTYPE = np.dtype([('sender', np.int64),
+                       ('recipient', np.int64),
+                       ('offset', np.int64),
+                       ('count', np.int64)])
+
+
+# Ranks with a trace_MPI<op>_<rank>.ct file in dir (any operation when op is None)
+def trace_ranks(dir, op = None):
+    prefix = 'trace_MPI' if op == None else 'trace_MPI' + op + '_'
+    ranks = set()
+    for file in trace_files(dir):
+        if file[:len(prefix)] == prefix and file[-3:] == '.ct':
+            try:
+                ranks.add(int(file[:-3].split('_')[-1]))
+            except ValueError:
+                pass
+    return sorted(ranks)
+
+
+# Returns the number of send traces read; nothing is written for directories without send traces
+def build_send_index(dir):
+    dir = dir.rstrip('/')
+    traces = [load_trace(trace_path(dir, "Send", s)) for s in trace_ranks(dir, "Send")]
+    if len(traces) == 0:
+        return 0
+    sender = np.concatenate([trace['sender'] for trace in traces])
+    recipient = np.concatenate([trace['recipient'] for trace in traces])
+    message = np.concatenate([trace['index'] for trace in traces])
+    # lexsort is stable, so each pair keeps the order the sender issued its messages in
+    order = np.lexsort((sender, recipient))
+    (sender, recipient, message) = (sender[order], recipient[order], message[order])
+    starts = np.flatnonzero(np.diff(sender, prepend = -2) | np.diff(recipient, prepend = -2))
+    pairs = np.empty(len(starts), dtype = PAIR_DTYPE)
+    pairs['sender'] = sender[starts]
+    pairs['recipient'] = recipient[starts]
+    pairs['offset'] = starts
+    pairs['count'] = np.diff(starts, append = len(message))
+    save_array(run_file(dir, SEND_INDEX_MESSAGES), message)
+    save_array(run_file(dir, SEND_INDEX_PAIRS), pairs)
+    return len(traces)
+
+
+# Sender orderings of all messages addressed to rank r as {(sender, r) : [message index, ...]}
+# Returns None when the run directory has no send index store
+def received_messages(dir, r):
+    try:
+        pairs = np.load(run_file(dir, SEND_INDEX_PAIRS), mmap_mode = 'r')
+        messages = np.load(run_file(dir, SEND_INDEX_MESSAGES), mmap_mode = 'r')
+    except (OSError, ValueError):
+        return None
+    lo = np.searchsorted(pairs['recipient'], r, side = 'left')
+    hi = np.searchsorted(pairs['recipient'], r, side = 'right')
+    return {(sender, r) : messages[offset:offset+count].tolist() for (sender, offset, count)
+            in zip(pairs['sender'][lo:hi].tolist(), pairs['offset'][lo:hi].tolist(), pairs['count'][lo:hi].tolist())}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Convert MPI traces to binary sidecars so later stages skip text parsing')
+    parser.add_argument('dirs', nargs = '+', help = 'Directories containing trace_MPI*_<rank>.ct files, or archives of them (.tgz, .tar.zst, .tar) to build the trace containers of')
+    parser.add_argument('--send-index', action = 'store_true', help = 'Also build the per-run send index store read by buildDAG.py')
+    parser.add_argument('--store', action = 'store_true', help = 'Also pack the traces of each run into its trace store (trace_store.dat) read by buildDAG.py')
+    parser.add_argument('--workers', type = int, default = None, help = 'Worker processes reading archives (default: one per core)')
+    args = parser.parse_args()
+
+    archives = [dir for dir in args.dirs if dir.endswith(ARCHIVE_SUFFIXES) and os.path.isfile(dir)]
+    compressed = [archive for archive in archives if not archive.endswith(CONTAINER_SUFFIX)]
+    for (archive, count) in zip(compressed, build_containers(compressed, args.workers) if len(compressed) > 0 else []):
+        print(archive, count, 'traces in', archive + CONTAINER_SUFFIX)
+    dirs = [dir for dir in args.dirs if not dir in archives] + [run for archive in archives for run in archive_runs(archive)]
+    for dir in dirs:
+        count = 0
+        for file in sorted(trace_files(dir)):
+            if file[:9] == 'trace_MPI' and file[-3:] == '.ct':
+                load_trace(dir.rstrip('/') + '/' + file)
+                count += 1
+        print(dir, count, 'traces cached')
+        if args.send_index:
+            print(dir, build_send_index(dir), 'send traces indexed')
+        if args.store:
+            print(dir, build_trace_store(dir), 'traces stored in', run_file(dir.rstrip('/'), TRACE_STORE))
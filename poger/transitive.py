@@ -0,0 +1,430 @@
+#############################################################################
+##                               FENATE                                    ##  
+##          Copyright © 2021, Battelle Memorial Institute                  ##
+##                                                                         ##
+## 1. Battelle Memorial Institute (hereinafter Battelle) hereby grants     ##
+##  permission to any person or entity lawfully obtaining a copy of this   ##
+##  software and associated documentation files (hereinafter               ##
+##  “the Software”) to redistribute and use the Software in source and     ##
+##  binary forms, with or without modification.  Such person or entity may ##
+##  use, copy, modify, merge, publish, distribute, sublicense, and/or sell ##
+##  copies of the Software, and may permit others to do so, subject to the ##
+##  following conditions:                                                  ##
+##  • Redistributions of source code must retain the above copyright       ##
+##    notice, this list of conditions and the following disclaimers.       ##
+##  • Redistributions in binary form must reproduce the above copyright    ##
+##    notice, this list of conditions and the following disclaimer in      ##
+##    the documentation and/or other materials provided with the           ##
+##    distribution.                                                        ##
+##  • Other than as used herein, neither the name Battelle Memorial        ##
+##    Institute or Battelle may be used in any form whatsoever without     ##
+##    the express written consent of Battelle.                             ##
+## 2. THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS  ##
+##  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT      ##
+##  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS      ##
+##  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL BATTELLE    ##
+##  OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,        ##
+##  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT       ##
+##  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,  ##
+##  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON      ##
+##  ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR     ##
+##  TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF     ##
+##  THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF        ##
+##  SUCH DAMAGE.                                                           ##
+#############################################################################
+
+# Transitive reduction of a DAG given as NUM_VERTICES and a list of (source, destination) edges
+# Vertices are numbered from 0 to num_vertices-1 as in the input of reduce.cpp / reduceMPI.cpp
+
+import warnings
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Kahn's algorithm; raises ValueError if the graph has a cycle
+def topological_order(num_vertices, successors):
+    indegree = [0]*num_vertices
+    for succ in successors:
+        for w in succ:
+            indegree[w] += 1
+    order = [v for v in range(num_vertices) if indegree[v] == 0]
+    for v in order:
+        for w in successors[v]:
+            indegree[w] -= 1
+            if indegree[w] == 0:
+                order.append(w)
+    if not len(order) == num_vertices:
+        raise ValueError('Graph is not a DAG')
+    return order
+
+
+# Vertices are visited in reverse topological order, keeping for each vertex the set of vertices it
+# reaches as a bitset (a Python int indexed by topological position).  An edge (v,w) is a cover exactly
+# when w is not reachable through a successor of v that comes earlier in topological order.
+def transitive_reduction(num_vertices, edges):
+    successors = [set() for _ in range(num_vertices)]
+    for (u,v) in edges:
+        successors[u].add(v)
+    successors = [list(succ) for succ in successors]
+    order = topological_order(num_vertices, successors)
+    position = [0]*num_vertices
+    for (i,v) in enumerate(order):
+        position[v] = i
+
+    reach = [0]*num_vertices
+    covers = []
+    for v in reversed(order):
+        reachable = 0
+        for w in sorted(successors[v], key = position.__getitem__):
+            bit = 1 << position[w]
+            if not reachable & bit:
+                covers.append((v,w))
+                reachable |= bit | reach[w]
+        reach[v] = reachable
+    return covers
+
+
+# NumPy engine for large graphs
+# Vertices are given heights (longest path to a sink) and laid out in columns by height, so every edge
+# goes from a higher column block to a lower one.  The targets are split into blocks of block_bits columns
+# and each block is reduced independently: walking up the heights, every vertex gets the bitset of block
+# columns it reaches (one row of uint64 words), and an edge (v,w) into the block is redundant exactly when
+# the bit of w is already set by another successor of v.  Blocks are handed to a process pool that shares
+# the graph arrays and the result through shared memory; each edge is decided by the one block holding
+# its target, so workers never write the same entry.
+
+# Index array covering the segments [starts[i], starts[i]+lengths[i])
+def segments(starts, lengths):
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype = np.int64)
+    ends = np.cumsum(lengths)
+    return np.arange(total, dtype = np.int64) + np.repeat(starts - ends + lengths, lengths)
+
+
+# Heights by peeling sinks, one height level per round; raises ValueError if the graph has a cycle
+def heights(num_vertices, src, dst):
+    outdegree = np.bincount(src, minlength = num_vertices)
+    order = np.argsort(dst, kind = 'stable')
+    predecessors = src[order]
+    start = np.zeros(num_vertices + 1, dtype = np.int64)
+    np.cumsum(np.bincount(dst, minlength = num_vertices), out = start[1:])
+    height = np.full(num_vertices, -1, dtype = np.int64)
+    frontier = np.flatnonzero(outdegree == 0)
+    h = 0
+    while len(frontier) > 0:
+        height[frontier] = h
+        preds = predecessors[segments(start[frontier], start[frontier+1] - start[frontier])]
+        (preds, counts) = np.unique(preds, return_counts = True)
+        outdegree[preds] -= counts
+        frontier = preds[outdegree[preds] == 0]
+        h += 1
+    if (height < 0).any():
+        raise ValueError('Graph is not a DAG')
+    return height
+
+
+class BlockGraph():
+    def __init__(self, num_vertices, src, dst):
+        height = heights(num_vertices, src, dst)
+        self.column_vertex = np.lexsort((np.arange(num_vertices), height))
+        column = np.empty(num_vertices, dtype = np.int64)
+        column[self.column_vertex] = np.arange(num_vertices)
+        self.column_height = height[self.column_vertex]
+        self.level_ptr = np.searchsorted(self.column_height, np.arange(int(height.max(initial = -1)) + 2))
+        # Edges grouped by the column of their source
+        self.edge_id = np.argsort(column[src], kind = 'stable')
+        self.edge_target = column[dst][self.edge_id]
+        self.out_ptr = np.zeros(num_vertices + 1, dtype = np.int64)
+        np.cumsum(np.bincount(column[src], minlength = num_vertices), out = self.out_ptr[1:])
+        self.keep = np.ones(len(src), dtype = np.uint8)
+
+    FIELDS = ('column_height', 'level_ptr', 'edge_id', 'edge_target', 'out_ptr', 'keep')
+
+
+# Block width and edges per chunk for a budget of memory bytes: 7/8 of it holds the reachability rows of a block
+# (one per vertex, fewer blocks means fewer walks up the heights), the rest the rows of the chunk of a level's
+# edges being reduced; the graph arrays themselves are not counted
+def block_plan(num_vertices, memory, block_bits = None):
+    if block_bits == None:
+        block_bits = min(1 << 16, max(64, 64*((memory - memory // 8) // (8*num_vertices))))
+    words = (min(block_bits, num_vertices) + 63) // 64
+    return (block_bits, max(1, (memory // 8) // (24*words + 64)))
+
+
+# Decide every edge whose target column lies in [lo, hi)
+# The edges of a level are taken chunk_edges at a time, so a vertex's edges may span several chunks: its row of R
+# is first the union of the rows of all its successors, then the edges into the block are checked against it
+def reduce_block(G, lo, hi, chunk_edges = 1 << 20):
+    words = (hi - lo + 63) // 64
+    hlo = int(G.column_height[lo])
+    top = len(G.level_ptr) - 1
+    if hlo + 1 >= top:
+        return
+    base = int(G.level_ptr[hlo+1]) # columns below base cannot reach the block
+    R = np.zeros((len(G.column_height) - base, words), dtype = np.uint64)
+    for h in range(hlo + 1, top):
+        (first, last) = (int(G.level_ptr[h]), int(G.level_ptr[h+1]))
+        (e0, e1) = (int(G.out_ptr[first]), int(G.out_ptr[last]))
+        for c0 in range(e0, e1, chunk_edges):
+            c1 = min(c0 + chunk_edges, e1)
+            target = G.edge_target[c0:c1]
+            row = np.searchsorted(G.out_ptr, np.arange(c0, c1), side = 'right') - 1 - base
+            starts = np.flatnonzero(np.concatenate(([True], row[1:] != row[:-1])))
+            reach = np.zeros((c1 - c0, words), dtype = np.uint64)
+            inner = target >= base
+            reach[inner] = R[target[inner] - base]
+            R[row[starts]] |= np.bitwise_or.reduceat(reach, starts, axis = 0)
+            del reach
+        for c0 in range(e0, e1, chunk_edges):
+            target = G.edge_target[c0:min(c0 + chunk_edges, e1)]
+            block = np.flatnonzero((target >= lo) & (target < hi))
+            if len(block) == 0:
+                continue
+            row = np.searchsorted(G.out_ptr, c0 + block, side = 'right') - 1 - base
+            offset = target[block] - lo
+            word = offset >> 6
+            bit = np.left_shift(np.uint64(1), (offset & 63).astype(np.uint64))
+            G.keep[G.edge_id[c0 + block]] = (R[row, word] & bit) == 0
+            np.bitwise_or.at(R, (row, word), bit)
+
+
+# Worker side of the shared memory pool
+shared_graph = None
+
+
+def attach(specs):
+    global shared_graph
+    shared_graph = BlockGraph.__new__(BlockGraph)
+    shared_graph.segments = []
+    for (field, name, shape, dtype) in specs:
+        segment = shared_memory.SharedMemory(name = name)
+        shared_graph.segments.append(segment)
+        setattr(shared_graph, field, np.ndarray(shape, dtype = dtype, buffer = segment.buf))
+
+
+def reduce_shared_block(bounds):
+    reduce_block(shared_graph, *bounds)
+    return bounds
+
+
+# Transitive reduction of the graph with edges zip(src, dst); returns a keep flag for every edge
+# Duplicate edges are collapsed onto their first occurrence
+# memory bounds the working arrays of a block (see block_plan), not the graph arrays
+def reduce_edges(num_vertices, src, dst, workers = 1, block_bits = None, memory = 1 << 28):
+    src = np.asarray(src, dtype = np.int64)
+    dst = np.asarray(dst, dtype = np.int64)
+    keep = np.zeros(len(src), dtype = bool)
+    if len(src) == 0:
+        return keep
+    (keys, first) = np.unique((src << 32) | dst, return_index = True)
+    first.sort()
+    G = BlockGraph(num_vertices, src[first], dst[first])
+    (block_bits, chunk_edges) = block_plan(num_vertices, memory, block_bits)
+    blocks = [(lo, min(lo + block_bits, num_vertices), chunk_edges) for lo in range(0, num_vertices, block_bits)]
+    print("Vertices", num_vertices, "Edges", len(first), "Heights", len(G.level_ptr) - 1, "Blocks", len(blocks))
+    if workers == 1:
+        for (lo, hi, chunk) in blocks:
+            reduce_block(G, lo, hi, chunk)
+    else:
+        segments = []
+        specs = []
+        try:
+            for field in BlockGraph.FIELDS:
+                array = getattr(G, field)
+                segment = shared_memory.SharedMemory(create = True, size = max(1, array.nbytes))
+                segments.append(segment)
+                np.ndarray(array.shape, dtype = array.dtype, buffer = segment.buf)[:] = array
+                specs.append((field, segment.name, array.shape, array.dtype.str))
+            with ProcessPoolExecutor(max_workers = workers, initializer = attach, initargs = (specs,)) as pool:
+                for _ in pool.map(reduce_shared_block, blocks):
+                    pass
+            G.keep = np.ndarray(G.keep.shape, dtype = G.keep.dtype, buffer = segments[-1].buf).copy()
+        finally:
+            for segment in segments:
+                segment.close()
+                segment.unlink()
+    keep[first] = G.keep.astype(bool)
+    return keep
+
+
+# Hierarchical engine for the union of DAGs that are each transitively reduced already (the covers of the ranks)
+# Components are merged a few at a time up a tree.  Only the portals of a merge, the vertices that appear in more
+# than one of its components (the message endpoints the ranks share), get reachability bits: walking up the
+# heights of the union, R[u] holds the portals reachable from u and, on the reversed union, C[v] the portals that
+# reach v.  An edge (u,v) has another path exactly when a portal lies on one, R[u] & C[v] != 0, or when v is itself
+# a portal reached from another successor of u; a path without portals stays inside a single component, which is
+# reduced already.  The portal columns are split into blocks of block_bits as in reduce_block.
+
+# The out-edges of a graph grouped by source and laid out by the level of the source, so that the edges of every
+# level are one slice (the layout walked by portal_reach); every edge must go to a lower level, as with heights
+class LevelGraph():
+    def __init__(self, num_vertices, src, dst, height):
+        order = np.lexsort((src, height[src]))
+        source = src[order]
+        self.num_vertices = num_vertices
+        self.target = dst[order]
+        self.group_start = np.flatnonzero(np.concatenate(([True], source[1:] != source[:-1]))) if len(source) > 0 else np.zeros(0, dtype = np.int64)
+        self.group_vertex = source[self.group_start]
+        levels = np.arange(int(height.max(initial = 0)) + 2)
+        self.edge_ptr = np.searchsorted(height[source], levels)
+        self.group_ptr = np.searchsorted(height[self.group_vertex], levels)
+
+
+# Bitsets of the portal columns in [lo, hi) for every vertex of the LevelGraph G, walking up the heights: R[u]
+# the columns reachable through the out-edges of u, and T[u] the same without the columns of its successors
+def portal_reach(G, column, lo, hi):
+    words = (hi - lo + 63) // 64
+    offset = column[G.target] - lo
+    own = np.flatnonzero((column[G.target] >= 0) & (offset >= 0) & (offset < hi - lo))
+    own_ptr = np.searchsorted(own, G.edge_ptr)
+    own_word = offset[own] >> 6
+    own_bit = np.left_shift(np.uint64(1), (offset[own] & 63).astype(np.uint64))
+    R = np.zeros((G.num_vertices, words), dtype = np.uint64)
+    T = np.zeros((G.num_vertices, words), dtype = np.uint64)
+    for h in range(len(G.edge_ptr) - 1):
+        (e0, e1) = (int(G.edge_ptr[h]), int(G.edge_ptr[h+1]))
+        if e0 == e1:
+            continue
+        (g0, g1) = (int(G.group_ptr[h]), int(G.group_ptr[h+1]))
+        (o0, o1) = (int(own_ptr[h]), int(own_ptr[h+1]))
+        reach = R[G.target[e0:e1]]
+        starts = G.group_start[g0:g1] - e0
+        level = G.group_vertex[g0:g1]
+        T[level] = np.bitwise_or.reduceat(reach, starts, axis = 0)
+        reach[own[o0:o1] - e0, own_word[o0:o1]] |= own_bit[o0:o1]
+        R[level] = np.bitwise_or.reduceat(reach, starts, axis = 0)
+    return (R, T)
+
+
+# Transitive reduction of the union of components, a list of reduced DAGs as (src, dst) arrays over shared vertex ids
+# Returns the kept edges as (src, dst), without duplicates
+def merge_reduced(components, block_bits = None, memory = 1 << 28, block_edges = 1 << 20):
+    src = np.concatenate([np.asarray(s, dtype = np.int64) for (s, d) in components])
+    dst = np.concatenate([np.asarray(d, dtype = np.int64) for (s, d) in components])
+    if len(components) < 2 or len(src) == 0:
+        return (src, dst)
+    # Vertices are renumbered to the ones the merge touches
+    (vertices, local) = np.unique(np.concatenate((src, dst)), return_inverse = True)
+    num_vertices = len(vertices)
+    membership = np.zeros(num_vertices, dtype = np.int64)
+    offset = 0
+    for (s, d) in components:
+        membership[np.unique(np.concatenate((local[offset:offset+len(s)], local[len(src)+offset:len(src)+offset+len(s)])))] += 1
+        offset += len(s)
+    (src, dst) = (local[:len(src)], local[len(src):])
+    first = np.unique((src << 32) | dst, return_index = True)[1]
+    (src, dst) = (src[first], dst[first])
+
+    portals = np.flatnonzero(membership > 1)
+    column = np.full(num_vertices, -1, dtype = np.int64)
+    column[portals] = np.arange(len(portals))
+    if block_bits == None:
+        block_bits = min(1 << 16, max(64, 64*(memory // (24*num_vertices))))
+    print("Vertices", num_vertices, "Edges", len(src), "Components", len(components), "Portals", len(portals))
+
+    # The reversed union is walked down the same heights, as every predecessor is higher
+    height = heights(num_vertices, src, dst)
+    forward = LevelGraph(num_vertices, src, dst, height)
+    backward = LevelGraph(num_vertices, dst, src, height.max() - height)
+    redundant = np.zeros(len(src), dtype = bool)
+    for lo in range(0, len(portals), block_bits):
+        hi = min(lo + block_bits, len(portals))
+        (R, T) = portal_reach(forward, column, lo, hi)
+        C = portal_reach(backward, column, lo, hi)[0]
+        for e in range(0, len(src), block_edges):
+            (u, v) = (src[e:e+block_edges], dst[e:e+block_edges])
+            through = (R[u] & C[v]).any(axis = 1)
+            offset = column[v] - lo
+            own = np.flatnonzero((column[v] >= 0) & (offset >= 0) & (offset < hi - lo))
+            bit = np.left_shift(np.uint64(1), (offset[own] & 63).astype(np.uint64))
+            through[own] |= (T[u[own], offset[own] >> 6] & bit) != 0
+            redundant[e:e+block_edges] |= through
+        del R, T, C
+    return (vertices[src[~redundant]], vertices[dst[~redundant]])
+
+
+# Worker side of the hierarchical merges
+def merge_group(args):
+    (components, block_bits, memory) = args
+    return merge_reduced(components, block_bits = block_bits, memory = memory)
+
+
+# Transitive reduction of the union of reduced DAGs, merging fanin neighbouring components at a time up a tree,
+# so that most merges only share the portals of neighbouring ranks; the merges of a level run on workers processes
+def reduce_components(components, fanin = 8, workers = 1, block_bits = None, memory = 1 << 28):
+    if fanin < 2:
+        raise ValueError('fanin must be at least 2')
+    components = list(components)
+    if len(components) == 0:
+        return (np.empty(0, dtype = np.int64), np.empty(0, dtype = np.int64))
+    level = 0
+    while True:
+        groups = [(components[i:i+fanin], block_bits, memory) for i in range(0, len(components), fanin)]
+        print("Level", level, "Merges", len(groups))
+        if workers == 1 or len(groups) == 1:
+            components = [merge_group(group) for group in groups]
+        else:
+            with ProcessPoolExecutor(max_workers = workers) as pool:
+                components = list(pool.map(merge_group, groups))
+        if len(components) == 1:
+            return components[0]
+        level += 1
+
+
+# NUM_VERTICES followed by "SRC DST" lines, edges in file order
+def read_graph(filename):
+    with open(filename, 'r') as input:
+        num_vertices = int(input.readline())
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore') # an empty edge list is valid
+            edges = np.loadtxt(input, dtype = np.int64, ndmin = 2).reshape(-1, 2)
+    return (num_vertices, edges[:,0], edges[:,1])
+
+
+# DOT in the layout written by reduce (parts == 0) or reduceMPI (parts > 0, one <outfile>_<i> per part):
+# the vertex lines, then the kept out-edges of every vertex in input order
+def write_reduction(outfile, num_vertices, src, dst, keep, parts = 0):
+    order = np.argsort(src, kind = 'stable')
+    order = order[keep[order]]
+    (src, dst) = (src[order], dst[order])
+    if parts == 0:
+        ranges = [(outfile, 0, num_vertices)]
+    else:
+        # Same split as break_ranges in reduceMPI.cpp
+        (group, rem) = divmod(num_vertices, parts)
+        bounds = np.cumsum([0] + [group + (1 if i < rem else 0) for i in range(parts)])
+        ranges = [(outfile + '_' + repr(i), int(bounds[i]), int(bounds[i+1])) for i in range(parts)]
+    for (filename, lo, hi) in ranges:
+        (e0, e1) = np.searchsorted(src, [lo, hi])
+        with open(filename, 'w') as output:
+            output.write("digraph G {\n")
+            np.savetxt(output, np.arange(lo, hi), fmt = '%d;')
+            np.savetxt(output, np.stack((src[e0:e1], dst[e0:e1]), axis = 1), fmt = '%d->%d ;')
+            output.write("}\n")
+
+
+# File to file reduction with the same input and output as reduce / reduceMPI
+def reduce_file(infile, outfile, workers = 1, parts = 0, block_bits = None, memory = 1 << 28):
+    print("Reading...")
+    (num_vertices, src, dst) = read_graph(infile)
+    print("Reducing...")
+    keep = reduce_edges(num_vertices, src, dst, workers = workers, block_bits = block_bits, memory = memory)
+    print("Writing...")
+    write_reduction(outfile, num_vertices, src, dst, keep, parts = parts)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Transitive reduction of a DAG (drop-in for reduce / reduceMPI)')
+    parser.add_argument('input', help = 'NUM_VERTICES followed by one "SRC DST" line per edge')
+    parser.add_argument('output', help = 'DOT output, or output prefix with --parts')
+    parser.add_argument('--workers', type = int, default = 1, help = 'Worker processes (default: 1)')
+    parser.add_argument('--parts', type = int, default = 0, help = 'Write <output>_0 .. <output>_<parts-1> split by vertex like reduceMPI')
+    parser.add_argument('--block-bits', type = int, default = None, help = 'Target columns per block (default: from --memory)')
+    parser.add_argument('--memory', type = int, default = 1 << 28, help = 'Bytes of reachability bitsets and level edge chunks per worker, used to size blocks and chunks')
+    args = parser.parse_args()
+
+    reduce_file(args.input, args.output, workers = args.workers, parts = args.parts, block_bits = args.block_bits, memory = args.memory)